@@ -1,12 +1,26 @@
-from flask import Flask
-from flask_socketio import SocketIO
-from apscheduler.schedulers.background import BackgroundScheduler
+# the Flask app is created on first use, so the CLI can start without
+# importing Flask, pandas and the statistics modules
 
 P_DIST = './dist/'
 
-app = Flask(__name__, static_url_path='', static_folder=P_DIST)
-socketio = SocketIO(app)
-scheduler = BackgroundScheduler()
 
-from bobaserver import routes
-from bobaserver import monitor
+def _create_app():
+    global app
+    from flask import Flask
+    app = Flask(__name__, static_url_path='', static_folder=P_DIST)
+
+    from bobaserver import routes
+    from bobaserver.dataset import register_prefix_routes
+    register_prefix_routes(app)
+    return app
+
+
+def __getattr__(name):
+    if name == 'app':
+        return _create_app()
+    # socket.io, the scheduler and the monitor routes are only set up when
+    # the monitor is first imported
+    if name in ('socketio', 'scheduler'):
+        from bobaserver import monitor
+        return getattr(monitor, name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+# serve the client bundle compressed, versioned and with validators
+
+import os
+import re
+import stat
+import gzip
+import atexit
+import shutil
+import hashlib
+import tempfile
+import mimetypes
+import threading
+from flask import request, send_file, abort, make_response
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# files worth compressing, and the smallest size worth it
+COMPRESSIBLE = ('.js', '.css', '.html', '.map', '.json', '.svg', '.txt')
+MIN_COMPRESS_BYTES = 1024
+
+# a year, the longest max-age browsers honor
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+# local scripts and stylesheets referenced by index.html
+_REF = re.compile(r'(\s(?:src|href)=")([^":?#]+)(")')
+
+
+class StaticAssets:
+    """
+    Serve the files of the dist folder with a content hash as ETag, and
+    precompressed variants when the client accepts them: a .br or .gz file
+    next to the original, written at build time, or a gzip (and brotli, if
+    the brotli module is installed) variant written on first request into a
+    private cache folder. index.html refers to each local file as `name?v=<hash>`;
+    such versioned requests are cached by the browser for a year, and the
+    others revalidate with If-None-Match.
+    """
+
+    def __init__(self, folder, cache_dir=None):
+        """
+        Parameters:
+         - folder: the dist folder
+         - cache_dir: where compressed variants are written, by default a
+           folder of this process in the system temp directory, removed at
+           exit. It must belong to us and be writable by no one else.
+        """
+        self.folder = os.path.realpath(folder)
+        self.cache_dir = cache_dir
+        self.entries = {}  # path -> (mtime, size, hash, variants)
+        self.written = set()  # variants written by this process
+        self.lock = threading.Lock()
+
+    def _cache_dir(self):
+        """
+        The cache folder, created on first use. Raises OSError if it belongs
+        to someone else or others can write to it, as they could plant the
+        files we serve.
+        """
+        if self.cache_dir is None:
+            self.cache_dir = tempfile.mkdtemp(prefix='boba-assets-')
+            atexit.register(shutil.rmtree, self.cache_dir, True)
+        os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+        st = os.lstat(self.cache_dir)
+        if not stat.S_ISDIR(st.st_mode) or st.st_mode & 0o022 or \
+                (hasattr(os, 'getuid') and st.st_uid != os.getuid()):
+            raise OSError(f'Unsafe asset cache folder {self.cache_dir}')
+        return self.cache_dir
+
+    def _entry(self, fn):
+        """ The content hash and compressed variants of a file """
+        st = os.stat(fn)
+        e = self.entries.get(fn)
+        if e is not None and e[:2] == (st.st_mtime_ns, st.st_size):
+            return e[2], e[3]
+
+        with self.lock:
+            h = hashlib.sha256()
+            with open(fn, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    h.update(block)
+            digest = h.hexdigest()[:16]
+            variants = {}
+            if fn.endswith(COMPRESSIBLE) and st.st_size >= MIN_COMPRESS_BYTES:
+                variants = self._compress(fn, digest, st.st_mtime_ns)
+            self.entries[fn] = (st.st_mtime_ns, st.st_size, digest, variants)
+            return digest, variants
+
+    def _compress(self, fn, digest, mtime):
+        # prebuilt variants that are not older than the file win
+        res = {}
+        for enc, ext in [('br', '.br'), ('gzip', '.gz')]:
+            p = fn + ext
+            if os.path.exists(p) and os.stat(p).st_mtime_ns >= mtime:
+                res[enc] = p
+
+        try:
+            self._cache_dir()
+            if 'gzip' not in res:
+                res['gzip'] = self._write(fn, digest + '.gz',
+                    lambda data: gzip.compress(data, 9, mtime=0))
+            if 'br' not in res and brotli is not None:
+                res['br'] = self._write(fn, digest + '.br', brotli.compress)
+        except OSError:
+            pass  # serve uncompressed
+        return res
+
+    def _write(self, fn, name, compress):
+        # compress a file into the cache, named by its content hash. Only
+        # files written by this process are reused; any other is replaced.
+        out = os.path.join(self.cache_dir, name)
+        if out not in self.written:
+            with open(fn, 'rb') as f:
+                data = compress(f.read())
+            tmp = f'{out}.{os.getpid()}.tmp'
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC |
+                         getattr(os, 'O_NOFOLLOW', 0), 0o600)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, out)
+            self.written.add(out)
+        return out
+
+    def send(self, filename):
+        """ The static view: serve a file of the folder """
+        fn = safe_join(self.folder, filename)
+        if fn is None or not os.path.isfile(fn):
+            abort(404)
+        digest, variants = self._entry(fn)
+
+        enc = None
+        accept = request.accept_encodings
+        for e in ['br', 'gzip']:
+            if e in variants and accept[e]:
+                enc = e
+                break
+
+        mimetype = mimetypes.guess_type(filename)[0] or \
+            'application/octet-stream'
+        rsp = send_file(variants.get(enc, fn), mimetype=mimetype,
+                        etag=f'{digest}-{enc}' if enc else digest,
+                        conditional=True, max_age=None)
+        if enc:
+            rsp.headers['Content-Encoding'] = enc
+        if variants:
+            rsp.vary.add('Accept-Encoding')
+        rsp.headers['Cache-Control'] = IMMUTABLE \
+            if request.args.get('v') == digest else 'no-cache'
+        return rsp
+
+    def send_index(self):
+        """ Serve index.html, referring to local files by content hash """
+        fn = os.path.join(self.folder, 'index.html')
+        if not os.path.isfile(fn):
+            abort(404)
+        with open(fn, 'r', encoding='utf-8') as f:
+            html = f.read()
+
+        def version(m):
+            p = safe_join(self.folder, m.group(2))
+            if p is None or not os.path.isfile(p):
+                return m.group(0)
+            digest = self._entry(p)[0]
+            return f'{m.group(1)}{m.group(2)}?v={digest}{m.group(3)}'
+
+        body = _REF.sub(version, html).encode('utf-8')
+        rsp = make_response(body)
+        rsp.mimetype = 'text/html'
+        rsp.set_etag(hashlib.sha256(body).hexdigest()[:16])
+        rsp.headers['Cache-Control'] = 'no-cache'
+        return rsp.make_conditional(request)
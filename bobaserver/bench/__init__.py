@@ -0,0 +1 @@
+# synthetic multiverses, benchmarks and load tests for the boba server
@@ -0,0 +1,250 @@
+# drive a running boba-server with concurrent clients and report latency
+
+import os
+import sys
+import json
+import time
+import socket
+import tempfile
+import threading
+import subprocess
+import shutil
+import http.client
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from .synthetic import generate, generate_logs
+
+# the cheap overview request measures the overhead of the server itself
+VISUALIZER = ['get_overview', 'get_pred', 'get_raw', 'get_uncertainty']
+MONITOR = ['monitor/get_snapshot']
+
+
+def free_port():
+  with socket.socket() as s:
+    s.bind(('127.0.0.1', 0))
+    return s.getsockname()[1]
+
+
+class Server:
+  """ Run boba-server in a subprocess until stopped """
+
+  def __init__(self, folder, args=(), port=None):
+    self.port = port or free_port()
+    cmd = [sys.executable, '-m', 'bobaserver.run_server', '-i', folder,
+      '--host', '127.0.0.1', '--port', str(self.port)] + list(args)
+    self.err = tempfile.TemporaryFile()
+    self.proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL,
+      stderr=self.err)
+
+
+  def last_error(self):
+    """ The last line the server wrote to stderr """
+    self.err.seek(0)
+    lines = self.err.read().decode(errors='replace').strip().splitlines()
+    return lines[-1] if len(lines) else ''
+
+
+  def wait(self, timeout=120):
+    """ Wait until the server answers, or raise RuntimeError """
+    end = time.time() + timeout
+    while time.time() < end:
+      if self.proc.poll() is not None:
+        raise RuntimeError('boba-server exited during startup: ' +
+          self.last_error())
+      try:
+        c = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        c.request('POST', '/api/get_overview', body='{}',
+          headers={'Content-Type': 'application/json'})
+        c.getresponse().read()
+        return
+      except OSError:
+        time.sleep(0.2)
+    raise RuntimeError('boba-server did not start in time')
+
+
+  def stop(self):
+    self.proc.terminate()
+    try:
+      self.proc.wait(10)
+    except subprocess.TimeoutExpired:
+      self.proc.kill()
+    self.err.close()
+
+
+def _client(port, endpoints, n_universes, end, seed):
+  # one client with its own connection, looping over the endpoints
+  rng = np.random.default_rng(seed)
+  conn = None
+  res = []
+  i = 0
+  while time.time() < end:
+    ep = endpoints[i % len(endpoints)]
+    i += 1
+    body = {'uid': int(rng.integers(1, n_universes + 1))}
+    t = time.perf_counter()
+    ok = False
+    size = 0
+    try:
+      if conn is None:
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+      conn.request('POST', f'/api/{ep}', body=json.dumps(body),
+        headers={'Content-Type': 'application/json'})
+      r = conn.getresponse()
+      data = r.read()
+      size = len(data)
+      ok = r.status == 200 and b'"fail"' not in data[:200]
+      if r.getheader('Connection', '').lower() == 'close':
+        conn.close()
+        conn = None
+    except (OSError, http.client.HTTPException):
+      conn = None
+    res.append((ep, time.perf_counter() - t, ok, size))
+  return res
+
+
+def _sockets(port, n, stop, out):
+  # connect n socket.io clients and keep them open until stop is set
+  try:
+    import socketio
+    socketio.Client
+  except (ImportError, AttributeError):
+    out['error'] = 'python-socketio client is not installed'
+    return
+
+  clients = []
+  latency = []
+  failed = 0
+  for i in range(n):
+    c = socketio.Client(reconnection=False)
+    t = time.perf_counter()
+    try:
+      c.connect(f'http://127.0.0.1:{port}', wait_timeout=30)
+      latency.append(time.perf_counter() - t)
+      clients.append(c)
+    except Exception:
+      failed += 1
+
+  stop.wait()
+  alive = sum([1 for c in clients if c.connected])
+  for c in clients:
+    c.disconnect()
+  out.update({'clients': n, 'failed': failed, 'alive_at_end': alive})
+  out.update(_percentiles(latency))
+
+
+def _percentiles(ts):
+  if not len(ts):
+    return {}
+  ms = np.asarray(ts) * 1000
+  return {'p50': float(np.percentile(ms, 50)),
+    'p95': float(np.percentile(ms, 95)), 'p99': float(np.percentile(ms, 99)),
+    'mean': float(ms.mean())}
+
+
+def summarize(samples, duration):
+  """ Per endpoint throughput and latency percentiles in milliseconds """
+  res = {}
+  for ep in sorted(set([s[0] for s in samples])):
+    rows = [s for s in samples if s[0] == ep]
+    ok = [s[1] for s in rows if s[2]]
+    r = {'requests': len(rows), 'errors': len(rows) - len(ok),
+      'throughput': len(ok) / duration,
+      'bytes': int(np.mean([s[3] for s in rows]))}
+    r.update(_percentiles(ok))
+    res[ep] = r
+  return res
+
+
+def run(n_universes=1000, concurrency=16, duration=10, sockets=10,
+  server_args=(), folder=None, log=None):
+  """
+  Start boba-server on a synthetic multiverse, then drive the visualizer
+  endpoints, and in a second monitor server the snapshot endpoint and a set
+  of socket.io clients.
+
+  Parameters:
+   - n_universes: size of the synthetic multiverse
+   - concurrency: number of concurrent HTTP clients
+   - duration: seconds of load per server
+   - sockets: number of socket.io clients connected to the monitor
+   - server_args: extra boba-server options, such as ['--production']
+   - folder: use a copy of this data folder instead of generating one; the
+     size of the multiverse is then read from its summary
+   - log: if given, called with progress messages
+
+  Returns: a JSON-serializable report
+  """
+  log = log or (lambda msg: None)
+  tmp = tempfile.TemporaryDirectory()
+  if folder is None:
+    folder = tmp.name
+    log(f'Generating {n_universes} universes in {folder}')
+    generate(folder, n_universes, n_points=2000, n_draws=100)
+  else:
+    # the monitor needs run logs, so fake them in a copy of the folder
+    src, folder = folder, os.path.join(tmp.name, 'data')
+    log(f'Copying {src} to {folder}')
+    shutil.copytree(src, folder)
+    n_universes = pd.read_csv(os.path.join(folder, 'summary.csv')).shape[0]
+  generate_logs(folder)
+
+  report = {'meta': {'universes': n_universes, 'concurrency': concurrency,
+    'duration': duration, 'server_args': list(server_args),
+    'time': time.strftime('%Y-%m-%dT%H:%M:%S')}, 'endpoints': {},
+    'sockets': {}, 'errors': {}}
+
+  try:
+    for mode, args, endpoints in [('visualizer', [], VISUALIZER),
+      ('monitor', ['--monitor'], MONITOR)]:
+      srv = Server(folder, list(args) + list(server_args))
+      try:
+        try:
+          srv.wait()
+        except RuntimeError as e:
+          # report and move on, so the other server is still measured
+          report['errors'][mode] = str(e)
+          log(f'Skipping the {mode} endpoints. {e}')
+          continue
+        log(f'Driving the {mode} endpoints for {duration} seconds')
+
+        stop = threading.Event()
+        sock_out = {}
+        th = None
+        if mode == 'monitor' and sockets > 0:
+          th = threading.Thread(target=_sockets,
+            args=(srv.port, sockets, stop, sock_out))
+          th.start()
+
+        end = time.time() + duration
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+          futures = [pool.submit(_client, srv.port,
+            endpoints[i % len(endpoints):] + endpoints[:i % len(endpoints)],
+            n_universes, end, i) for i in range(concurrency)]
+          samples = sum([f.result() for f in futures], [])
+
+        stop.set()
+        if th is not None:
+          th.join()
+          report['sockets'] = sock_out
+        report['endpoints'].update(summarize(samples, duration))
+      finally:
+        srv.stop()
+  finally:
+    tmp.cleanup()
+
+  return report
+
+
+def compare(current, baseline):
+  """ Ratio of each endpoint's throughput and latency to the baseline """
+  res = []
+  for ep, r in current['endpoints'].items():
+    b = baseline.get('endpoints', {}).get(ep)
+    if not b or 'p50' not in r or 'p50' not in b:
+      continue
+    row = {'endpoint': ep}
+    for k in ['throughput', 'p50', 'p95', 'p99']:
+      row[k] = r[k] / b[k] if b[k] else np.inf
+    res.append(row)
+  return res
@@ -0,0 +1,203 @@
+# time the statistical routines and loaders on synthetic multiverses
+
+import sys
+import time
+import platform
+import tempfile
+import subprocess
+import numpy as np
+import pandas as pd
+from time import perf_counter
+from .synthetic import generate
+from ..dataset import Dataset
+from ..bobastats import sampling, sensitivity
+from ..bobastats.sketch import QuantileSketch
+from ..bobastats.accumulator import decision_codes
+from ..bobastats.estimators import ESTIMATORS, round_robin_strata
+import bobaserver.common as common
+
+
+def _cases(folder, seed=0):
+  """ Return a list of (name, setup-free function) to time """
+  ds = Dataset(folder).load()
+  with ds.activate():
+    df = common.read_results_with_summary('point_estimate', dtype=float,
+      diagnostics=False)
+    col = common.get_field_name('point_estimate')
+    dec_df = common.get_decision_df()
+    dec_list = common.get_decision_list()
+    order, weights = sampling.round_robin(dec_df, dec_df.shape[0])
+    weights = 1 / (weights * dec_df.shape[0])
+    sub = order[:min(len(order), 200)]
+    strata = round_robin_strata(decision_codes(df, ds.decisions))
+  stream = np.random.default_rng(seed).normal(size=1 << 20)
+
+  def sen(method):
+    def run():
+      ds.visualizer['sensitivity'] = method
+      common.cal_sensitivity(df)
+    return run
+
+  return ds, [
+    ('cli_help', _python('from bobaserver.run_server import main; '
+      'main(["--help"])')),
+    ('import_server', _python('from bobaserver import app')),
+    ('load', lambda: Dataset(folder).load()),
+    ('read_results_batch', lambda: common.read_results_batch(
+      ['point_estimate', 'p_value', 'fit', 'standard_error'])),
+    ('cal_sensitivity_f', sen('f')),
+    ('cal_sensitivity_ks', sen('ks')),
+    ('cal_sensitivity_ad', sen('ad')),
+    ('sensitivity_matrix_f', lambda: common.cal_sensitivity_matrix(
+      method='f')),
+    ('sensitivity_matrix_ks', lambda: common.cal_sensitivity_matrix(
+      method='ks')),
+    ('ad_wrapper', lambda: [sensitivity.ad_wrapper(df, d, col) for d in
+      dec_list]),
+    ('round_robin', lambda: sampling.round_robin(dec_df, dec_df.shape[0])),
+    ('bootstrap_outcome', lambda: sampling.bootstrap_outcome(df, col, order,
+      weights)),
+    ('delta_outcome', lambda: sampling.estimate_outcome(df, col, order,
+      weights, 'delta')),
+    ('snis_outcome', lambda: sampling.estimate_outcome(df, col, order,
+      weights, 'snis')),
+    ('stratified_outcome', lambda: sampling.estimate_outcome(df, col, order,
+      strata=strata, estimator='stratified')),
+    ('bootstrap_sensitivity', lambda: sampling.bootstrap_sensitivity(df, col,
+      sub, dec_list)),
+    ('quantile_sketch', lambda: QuantileSketch().update(stream))
+  ]
+
+
+def _python(code):
+  # run code in a fresh interpreter, to time the imports
+  def run():
+    subprocess.run([sys.executable, '-c', code], check=True,
+      stdout=subprocess.DEVNULL)
+  return run
+
+
+def time_func(func, repeat=3, seed=0):
+  """ Call func repeat times and return the elapsed seconds of each call """
+  res = []
+  for i in range(repeat):
+    np.random.seed(seed + i)
+    t = perf_counter()
+    func()
+    res.append(perf_counter() - t)
+  return res
+
+
+def run(sizes=(100, 1000), n_decisions=4, n_options=3, repeat=3, seed=0,
+  only=None, log=None):
+  """
+  Generate a multiverse for each size and time every routine on it.
+
+  Parameters:
+   - sizes: a list of universe counts
+   - n_decisions, n_options: passed to synthetic.generate
+   - repeat: number of timed calls per routine
+   - only: if given, a list of routine names to run
+   - log: if given, called with a line of text after each routine
+
+  Returns: a JSON-serializable dict with the environment and the timings
+  """
+  results = []
+  for size in sizes:
+    with tempfile.TemporaryDirectory() as folder:
+      generate(folder, size, n_decisions, n_options, n_points=100, n_draws=20,
+        seed=seed)
+      ds, cases = _cases(folder, seed)
+      with ds.activate():
+        for name, func in cases:
+          if only and name not in only:
+            continue
+          ts = time_func(func, repeat, seed)
+          r = {'name': name, 'size': size, 'repeat': repeat,
+            'min': min(ts), 'median': float(np.median(ts))}
+          results.append(r)
+          if log:
+            log(f'{name:<24}{size:>10}{r["median"] * 1000:>12.2f} ms')
+
+  meta = {'python': platform.python_version(), 'numpy': np.__version__,
+    'pandas': pd.__version__, 'platform': platform.platform(),
+    'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'decisions': n_decisions,
+    'options': n_options}
+  return {'meta': meta, 'results': results}
+
+
+def validate_estimators(size=1000, n_samples=(30, 100, 300), repeat=50,
+  n_decisions=4, n_options=3, seed=0, log=None):
+  """
+  Check the outcome CI of every estimator against the bootstrap, on round
+  robin samples of a synthetic multiverse, as the monitor draws them.
+
+  Parameters:
+   - size: the number of universes
+   - n_samples: the sample sizes, each a prefix of the sampling order
+   - repeat: the number of sampling orders
+
+  Returns: a JSON-serializable list of dict with the estimator, the sample
+    size, the coverage of the mean of all universes by the 95% CI, the
+    median CI width relative to the bootstrap, and the median seconds per CI
+  """
+  res = {}
+  with tempfile.TemporaryDirectory() as folder:
+    generate(folder, size, n_decisions, n_options, n_points=10, n_draws=2,
+      seed=seed)
+    ds = Dataset(folder).load()
+    with ds.activate():
+      col = common.get_field_name('point_estimate')
+      df = pd.merge(common.read_summary(),
+        common.read_results('point_estimate'), on='uid', how='left')
+      dec_df = common.get_decision_df()
+      strata = round_robin_strata(decision_codes(df, ds.decisions))
+      truth = pd.to_numeric(df[col]).mean()
+
+      for r in range(repeat):
+        np.random.seed(seed + r)
+        order, weights = sampling.round_robin(dec_df, max(n_samples))
+        weights = 1 / (weights * dec_df.shape[0])
+        for n in n_samples:
+          for est in ESTIMATORS:
+            t = perf_counter()
+            mean, lower, upper = sampling.estimate_outcome(df, col,
+              order[:n], None if est == 'stratified' else weights, est,
+              strata, seed=seed + r)
+            row = res.setdefault((est, n), {'hit': [], 'width': [],
+              'time': []})
+            row['time'].append(perf_counter() - t)
+            row['hit'].append(lower <= truth <= upper)
+            row['width'].append(upper - lower)
+
+  out = []
+  for (est, n), row in res.items():
+    base = np.asarray(res[('bootstrap', n)]['width'])
+    r = {'estimator': est, 'n': n, 'coverage': float(np.mean(row['hit'])),
+      'width': float(np.median(np.asarray(row['width']) / base)),
+      'time': float(np.median(row['time']))}
+    out.append(r)
+    if log:
+      log(f'{est:<12}{n:>6}{r["coverage"]:>10.2f}{r["width"]:>10.2f}'
+        f'{r["time"] * 1000:>12.3f} ms')
+  return out
+
+
+def compare(current, baseline, threshold=0.2):
+  """
+  Compare two results of run() by the median time of each routine and size.
+
+  Returns: a list of dict with the name, size, both medians, the ratio, and
+    whether the routine is slower than the baseline by more than threshold
+  """
+  lookup = {(r['name'], r['size']): r for r in baseline['results']}
+  res = []
+  for r in current['results']:
+    b = lookup.get((r['name'], r['size']))
+    if b is None:
+      continue
+    ratio = r['median'] / b['median'] if b['median'] > 0 else np.inf
+    res.append({'name': r['name'], 'size': r['size'],
+      'baseline': b['median'], 'current': r['median'], 'ratio': ratio,
+      'regression': ratio > 1 + threshold})
+  return res
@@ -0,0 +1,149 @@
+# generate a synthetic multiverse in the format of example/mortgage
+
+import os
+import itertools
+import numpy as np
+import pandas as pd
+from scipy import stats
+from ..util import write_json
+
+
+def _options(n_options, n_decisions):
+  # the number of options of each decision
+  if isinstance(n_options, int):
+    return [n_options] * n_decisions
+  if len(n_options) != n_decisions:
+    raise ValueError('Expecting one option count per decision')
+  return list(n_options)
+
+
+def generate(folder, n_universes=None, n_decisions=4, n_options=3,
+  n_points=200, n_draws=50, seed=0):
+  """
+  Write a complete data folder: overview.json, summary.csv, estimates.csv,
+  uncertainty.csv, null.csv and one raw prediction file per universe.
+
+  Parameters:
+   - folder: output directory, created if it does not exist
+   - n_universes: number of universes. By default, use all combinations of
+     options. Otherwise, draw the options of each universe at random, with
+     every option appearing at least once if there are enough universes.
+   - n_decisions: number of decisions
+   - n_options: number of options, either one int for all decisions or a
+     list with one int per decision
+   - n_points: rows in each raw prediction file
+   - n_draws: rows per universe in uncertainty.csv and null.csv
+   - seed: random seed
+
+  Returns: the number of universes
+  """
+  rng = np.random.default_rng(seed)
+  k = _options(n_options, n_decisions)
+  names = [f'd{i}' for i in range(n_decisions)]
+  labels = [[f'{names[i]}_opt{j}' for j in range(k[i])] for i in
+    range(n_decisions)]
+
+  # option index of each universe
+  if n_universes is None:
+    codes = np.array(list(itertools.product(*[range(n) for n in k])))
+  else:
+    codes = np.column_stack([rng.integers(0, n, n_universes) for n in k])
+    # fill the first rows round robin so every option appears at least once,
+    # given enough universes, then shuffle them into the rest
+    m = min(n_universes, max(k))
+    codes[:m] = np.column_stack([np.arange(m) % n for n in k])
+    codes = codes[rng.permutation(n_universes)]
+  n = codes.shape[0]
+  uid = np.arange(1, n + 1)
+
+  # outcome: each decision shifts the estimate, with decreasing effect size
+  effects = [rng.normal(0, 1.0 / (i + 1), k[i]) for i in range(n_decisions)]
+  mu = 1 + sum([effects[i][codes[:, i]] for i in range(n_decisions)])
+  se = rng.uniform(0.2, 0.6, n)
+  est = mu + rng.normal(0, 0.1, n)
+
+  os.makedirs(os.path.join(folder, 'raw'), exist_ok=True)
+
+  # summary.csv
+  smr = pd.DataFrame({'Filename': [f'universe_{i}.py' for i in uid]})
+  for i, d in enumerate(names):
+    smr[d] = np.array(labels[i])[codes[:, i]]
+  smr.to_csv(os.path.join(folder, 'summary.csv'), index=False)
+
+  # estimates.csv
+  z = est / se
+  p = 2 * (1 - stats.norm.cdf(np.abs(z)))
+  df = pd.DataFrame({'uid': uid, 'estimate': est, 'std.error': se,
+    'p.value': p, 'NRMSE': rng.uniform(0.1, 0.5, n)})
+  df.to_csv(os.path.join(folder, 'estimates.csv'), index=False)
+
+  # uncertainty.csv and null.csv
+  rep = np.repeat(uid, n_draws)
+  unc = np.repeat(est, n_draws) + rng.normal(0, 1, n * n_draws) * \
+    np.repeat(se, n_draws)
+  pd.DataFrame({'uid': rep, 'estimate': unc}).to_csv(
+    os.path.join(folder, 'uncertainty.csv'), index=False)
+  nul = rng.normal(0, 1, n * n_draws) * np.repeat(se, n_draws)
+  pd.DataFrame({'uid': rep, 'estimate': nul}).to_csv(
+    os.path.join(folder, 'null.csv'), index=False)
+
+  # raw predictions, one file per universe
+  for i in range(n):
+    obs = rng.normal(100, 15, n_points)
+    pred = obs + rng.normal(0, 15 * (0.5 + i % 3 * 0.1), n_points)
+    pd.DataFrame({'observed': obs, 'pred': pred}).to_csv(
+      os.path.join(folder, 'raw', f'pred_{i + 1}.csv'), index=False)
+
+  # overview.json
+  nodes = [{'id': i, 'name': d} for i, d in enumerate(names)]
+  edges = [{'source': i, 'target': i + 1, 'type': 'order'} for i in
+    range(n_decisions - 1)]
+  overview = {
+    'decisions': [{'var': d, 'options': labels[i]} for i, d in
+      enumerate(names)],
+    'graph': {'nodes': nodes, 'edges': edges},
+    'visualizer': {
+      'files': [
+        {'id': 'est', 'path': 'estimates.csv'},
+        {'id': 'unc', 'path': 'uncertainty.csv'},
+        {'id': 'null', 'path': 'null.csv'},
+        {'id': 'fit', 'path': 'raw/pred_{}.csv', 'multi': True}
+      ],
+      'schema': {
+        'point_estimate': {'file': 'est', 'field': 'estimate'},
+        'standard_error': {'file': 'est', 'field': 'std.error'},
+        'p_value': {'file': 'est', 'field': 'p.value'},
+        'fit': {'file': 'est', 'field': 'NRMSE'},
+        'uncertainty': {'file': 'unc', 'field': 'estimate'},
+        'null_distribution': {'file': 'null', 'field': 'estimate'},
+        'prediction': {'file': 'fit'}
+      },
+      'labels': {'dataset': 'synthetic', 'x_axis': 'Effect'},
+      'sensitivity': 'ad'
+    }
+  }
+  write_json(overview, os.path.join(folder, 'overview.json'), nice=True)
+  return n
+
+
+def generate_logs(folder, failure_rate=0.05, seed=0):
+  """
+  Pretend the multiverse in folder has finished running: write the boba
+  run log with exit codes, error messages of the failed universes, and an
+  empty post_exe.sh so the monitor can merge results.
+  """
+  from boba.wrangler import DIR_LOG
+
+  rng = np.random.default_rng(seed)
+  n = pd.read_csv(os.path.join(folder, 'summary.csv')).shape[0]
+  dir_log = os.path.join(folder, DIR_LOG)
+  os.makedirs(dir_log, exist_ok=True)
+
+  codes = (rng.random(n) < failure_rate).astype(int)
+  pd.DataFrame({'uid': np.arange(1, n + 1), 'exit_code': codes}).to_csv(
+    os.path.join(dir_log, 'logs.csv'), index=False)
+  for uid in np.flatnonzero(codes) + 1:
+    with open(os.path.join(dir_log, f'error_{uid}.txt'), 'w') as f:
+      f.write(f'Error in fit: singular matrix in universe {uid}\n')
+
+  open(os.path.join(folder, 'post_exe.sh'), 'w').close()
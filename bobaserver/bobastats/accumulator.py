@@ -0,0 +1,106 @@
+import numpy as np
+
+
+def decision_codes (df, decisions):
+  """
+  Code the options of each row as integers.
+
+  Parameters:
+   - df: a table with one column per decision
+   - decisions: a list of {'var': name, 'options': [...]}
+
+  Returns: an int32 array of shape (rows, decisions), with the index of the
+    option in its decision, or -1 if the row has none of the options
+  """
+  codes = np.full((df.shape[0], len(decisions)), -1, dtype=np.int32)
+  for i, d in enumerate(decisions):
+    col = df[d['var']].astype(str).to_numpy()
+    for j, o in enumerate(d['options']):
+      codes[col == str(o), i] = j
+  return codes
+
+
+class OptionStats:
+  """
+  Count, mean and sum of squared deviations (M2) of the outcome for every
+  option of every decision, and of all rows, updated one row at a time with
+  Welford's algorithm. The one-way F score of every decision is then
+  computed from these in O(options), as in sensitivity_f.
+  """
+
+  def __init__(self, decisions):
+    """
+    Parameters:
+     - decisions: a list of {'var': name, 'options': [...]}
+    """
+    self.decisions = [d['var'] for d in decisions]
+    self.options = [[str(o) for o in d['options']] for d in decisions]
+    k = max([len(o) for o in self.options] + [1])
+    self.count = np.zeros((len(decisions), k), dtype=np.int64)
+    self.mean = np.zeros((len(decisions), k))
+    self.m2 = np.zeros((len(decisions), k))
+    self.total = [0, 0.0, 0.0]  # count, mean, M2 of all rows
+
+
+  def add(self, codes, value):
+    """
+    Add one row, given the option code of each decision (negative if the
+    row has none of the options) and its outcome. NaN and Inf are skipped.
+    """
+    if not np.isfinite(value):
+      return
+    t = self.total
+    t[0] += 1
+    delta = value - t[1]
+    t[1] += delta / t[0]
+    t[2] += delta * (value - t[1])
+
+    codes = np.asarray(codes)
+    d = np.nonzero(codes >= 0)[0]
+    c = codes[d]
+    self.count[d, c] += 1
+    delta = value - self.mean[d, c]
+    self.mean[d, c] += delta / self.count[d, c]
+    self.m2[d, c] += delta * (value - self.mean[d, c])
+
+
+  def variance(self):
+    """ Sample variance of each option, NaN with fewer than 2 rows """
+    with np.errstate(divide='ignore', invalid='ignore'):
+      return np.where(self.count > 1, self.m2 / (self.count - 1), np.nan)
+
+
+  def f_scores(self):
+    """
+    F score of each decision. Options without rows are left out, and a
+    decision with fewer than 2 options with rows scores 0.
+    """
+    n, grand = self.total[0], self.total[1]
+    present = self.count > 0
+    groups = present.sum(axis=1)
+    ms_b = (self.count * (self.mean - grand)**2).sum(axis=1)
+    ms_w = np.where(present, self.m2, 0).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+      res = (ms_b / (groups - 1)) / (ms_w / (n - groups))
+    return np.where(groups < 2, 0, res)
+
+
+  def summary(self):
+    """
+    A JSON-serializable summary: the number of rows, and the F score and
+    the count, mean and variance of each option of each decision, with None
+    in place of NaN and Inf.
+    """
+    def clean(arr):
+      return [float(v) if np.isfinite(v) else None for v in arr]
+
+    scores = self.f_scores()
+    var = self.variance()
+    res = {'n_samples': self.total[0], 'decisions': []}
+    for i, dec in enumerate(self.decisions):
+      k = len(self.options[i])
+      mean = np.where(self.count[i, :k] > 0, self.mean[i, :k], np.nan)
+      res['decisions'].append({'var': dec, 'score': clean([scores[i]])[0],
+        'options': self.options[i], 'count': self.count[i, :k].tolist(),
+        'mean': clean(mean), 'variance': clean(var[i, :k])})
+    return res
@@ -1,5 +1,4 @@
 import numpy as np
-from scipy import stats
 from time import perf_counter
 
 class bootstrap():
@@ -8,18 +7,22 @@ class bootstrap():
   basic, percentile, and bias-corrected and accelerated (BCa).
   """
 
-  def __init__(self, func, ci_type='percentile', n=200, verbose=False):
+  def __init__(self, func, ci_type='percentile', n=200, verbose=False,
+    seed=None):
     """
     Parameters:
      - n: bootstrap how many times
      - func: function to compute the statistic of interest
      - ci_type: one of ['basic', 'percentile', 'bca', 'bc']
      - verbose: if true, print elapsed time
+     - seed: if given, the resamples are drawn from a generator with this
+       seed, so the result is reproducible
     """
     self.n = n
     self.stat = func
     self.ci_type = ci_type
     self.verbose = verbose
+    self.seed = seed
 
 
   def fit(self, data, *args, **kwargs):
@@ -39,9 +42,11 @@ class bootstrap():
     self.sample_stat = self.stat(data, *args, **kwargs)
 
     # fit bootstrap
+    rng = np.random if self.seed is None else \
+      np.random.default_rng(self.seed)
     self.bootstrap_stats = []
     for i in range(self.n):
-      d = np.random.choice(data, size=len(data), replace=True, p=p)
+      d = rng.choice(data, size=len(data), replace=True, p=p)
       self.bootstrap_stats.append(self.stat(d, *args, **kwargs))
 
     # jackknife
@@ -75,6 +80,7 @@ class bootstrap():
 
   def _get_ci_bc(self, arr, alpha):
     """ BCa bootstrap CI with the acceleration term set to 0 """
+    from scipy import stats
     # bias-correction factor
     z0 = stats.norm.ppf(np.mean(np.asarray(arr) < self.sample_stat))
 
@@ -87,6 +93,7 @@ class bootstrap():
 
   def _get_ci_bca(self, arr, alpha):
     """ Bias corrected and accelerated bootstrap CI """
+    from scipy import stats
     # bias-correction factor
     z0 = stats.norm.ppf(np.mean(np.asarray(arr) < self.sample_stat))
     z0 = np.sign(z0) * 5 if np.isinf(z0) else z0  # handle infinity
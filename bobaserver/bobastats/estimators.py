@@ -0,0 +1,137 @@
+import numpy as np
+from statistics import NormalDist
+
+# ways to compute the CI of the outcome mean; bootstrap resamples, and the
+# others are closed-form normal approximations that take O(n)
+ESTIMATORS = ('bootstrap', 'delta', 'snis', 'stratified')
+
+
+def _z (alpha):
+  # the two-sided standard normal quantile
+  return NormalDist().inv_cdf(1 - alpha / 2)
+
+
+def _ci (mean, var, alpha):
+  # a normal CI as floats, NaN if the variance is unknown
+  if not np.isfinite(mean):
+    return [np.nan, np.nan, np.nan]
+  h = _z(alpha) * np.sqrt(var) if np.isfinite(var) else np.nan
+  return [float(mean), float(mean - h), float(mean + h)]
+
+
+def delta_ci (y, indices, weights=None, alpha=0.05):
+  """
+  CI of the outcome mean estimated as in sampling.get_outcome_mean, the
+  mean of y (times the likelihood ratio, if weighted) over the sample, from
+  the sample variance of its terms.
+
+  Parameters:
+   - y: the outcome of every universe
+   - indices: sample index into y
+   - weights: likelihood ratio f(x)/g(x) of every universe, if applicable
+   - alpha: 1 - the confidence level
+
+  Returns: [mean, lower, upper]
+  """
+  arr = np.asarray(y, dtype=float)[indices]
+  if weights is not None:
+    arr = np.asarray(weights)[indices] * arr
+  arr = arr[~np.isnan(arr)]
+  if not len(arr):
+    return _ci(np.nan, np.nan, alpha)
+  var = np.var(arr, ddof=1) / len(arr) if len(arr) > 1 else np.nan
+  return _ci(np.mean(arr), var, alpha)
+
+
+def snis_ci (y, indices, weights=None, alpha=0.05):
+  """
+  CI of the self-normalized importance sampling mean, sum(w y) / sum(w),
+  with the delta-method variance sum(w^2 (y - mean)^2) / sum(w)^2. Unlike
+  the mean of w y, it does not need the likelihood ratios to be normalized,
+  and it is bounded by the sampled outcomes. Without weights, it is the
+  sample mean with the usual standard error.
+
+  Returns: [mean, lower, upper]
+  """
+  y = np.asarray(y, dtype=float)[indices]
+  w = np.ones(len(y)) if weights is None else \
+    np.asarray(weights, dtype=float)[indices]
+  ok = ~np.isnan(y) & ~np.isnan(w)
+  y, w = y[ok], w[ok]
+  n = len(y)
+  if not n or w.sum() <= 0:
+    return _ci(np.nan, np.nan, alpha)
+
+  mean = np.dot(w, y) / w.sum()
+  var = np.dot(w**2, (y - mean)**2) / w.sum()**2 * n / (n - 1) \
+    if n > 1 else np.nan
+  return _ci(mean, var, alpha)
+
+
+def stratified_ci (y, indices, strata, alpha=0.05):
+  """
+  CI of the stratified mean: the sample mean of each stratum weighted by
+  its share of all universes, with the variance of sampling without
+  replacement within each stratum. Strata without a sampled outcome are
+  left out and the shares of the others rescaled. A stratum with one
+  sampled outcome borrows the pooled variance of the other strata. The
+  stratum shares take the place of importance weights.
+
+  Parameters:
+   - y: the outcome of every universe
+   - indices: sample index into y
+   - strata: the stratum of every universe, such as the option of a
+     decision from round_robin_strata
+
+  Returns: [mean, lower, upper]
+  """
+  y = np.asarray(y, dtype=float)
+  labels, strata = np.unique(np.asarray(strata), return_inverse=True)
+  k = len(labels)
+  pop = np.bincount(strata, minlength=k)
+
+  idx = np.asarray(indices, dtype=int)
+  idx = idx[~np.isnan(y[idx])]
+  if not len(idx):
+    return _ci(np.nan, np.nan, alpha)
+  s, v = strata[idx], y[idx]
+
+  n = np.bincount(s, minlength=k)
+  sampled = n > 0
+  means = np.zeros(k)
+  means[sampled] = np.bincount(s, weights=v, minlength=k)[sampled] / \
+    n[sampled]
+  m2 = np.bincount(s, weights=(v - means[s])**2, minlength=k)
+
+  # within-stratum variances, pooled where a stratum has one outcome
+  var = np.full(k, np.nan)
+  var[n > 1] = m2[n > 1] / (n[n > 1] - 1)
+  dof = (n[n > 1] - 1).sum()
+  pooled = m2[n > 1].sum() / dof if dof > 0 else \
+    (np.var(v, ddof=1) if len(v) > 1 else np.nan)
+  var[n == 1] = pooled
+
+  share = pop[sampled] / pop[sampled].sum()
+  fpc = 1 - n[sampled] / pop[sampled]
+  mean = np.dot(share, means[sampled])
+  total = np.sum(share**2 * fpc * var[sampled] / n[sampled])
+  return _ci(mean, total, alpha)
+
+
+def round_robin_strata (codes):
+  """
+  The strata of round robin sampling, which draws from every option of
+  every decision in turn: the options of the decision with the most of
+  them, so each stratum has a universe after the first round.
+
+  Parameters:
+   - codes: the option of every universe in every decision, as from
+     accumulator.decision_codes
+
+  Returns: the stratum of every universe
+  """
+  codes = np.asarray(codes)
+  if not codes.shape[1]:
+    return np.zeros(codes.shape[0], dtype=int)
+  n_options = [len(np.unique(codes[:, d])) for d in range(codes.shape[1])]
+  return codes[:, int(np.argmax(n_options))]
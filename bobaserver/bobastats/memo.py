@@ -0,0 +1,127 @@
+import os
+import json
+import hashlib
+import threading
+import numpy as np
+
+# bump to invalidate the entries written by an older computation
+VERSION = 1
+
+
+class BootstrapCache:
+  """
+  A content-addressed cache of bootstrap results on disk. An entry is keyed
+  by a hash of everything the result depends on: the statistic, the sample,
+  the weights, the CI type, the number of replicates and the seed. The least
+  recently used entries are deleted once the folder exceeds a size limit.
+  """
+
+  def __init__(self, folder, max_bytes=64 << 20):
+    """
+    Parameters:
+     - folder: where the entries are written, created on first write
+     - max_bytes: the size limit of the folder
+    """
+    self.folder = folder
+    self.max_bytes = max_bytes
+    self.size = None  # computed on first write
+    self.hits = 0
+    self.misses = 0
+    self.lock = threading.Lock()
+
+
+  @staticmethod
+  def key(statistic, **parts):
+    """ Hash a statistic name and named arrays, numbers or strings """
+    h = hashlib.sha256(f'v{VERSION}:{statistic}'.encode('utf-8'))
+    for name in sorted(parts):
+      h.update(f'|{name}:'.encode('utf-8'))
+      _update(h, parts[name])
+    return h.hexdigest()
+
+
+  def get(self, key):
+    """ The cached value of key, or None """
+    fn = self._path(key)
+    try:
+      with open(fn, 'r') as f:
+        value = json.load(f)
+      os.utime(fn)  # mark as recently used
+    except (OSError, ValueError):
+      return None
+    return value
+
+
+  def put(self, key, value):
+    """ Write a JSON-serializable value, then evict if over the limit """
+    fn = self._path(key)
+    data = json.dumps(value).encode('utf-8')
+    with self.lock:
+      os.makedirs(self.folder, exist_ok=True)
+      tmp = f'{fn}.{threading.get_ident()}.tmp'
+      with open(tmp, 'wb') as f:
+        f.write(data)
+      os.replace(tmp, fn)
+      if self.size is None:
+        self.size = sum([e.stat().st_size for e in self._entries()])
+      else:
+        self.size += len(data)
+      if self.size > self.max_bytes:
+        self._evict()
+
+
+  def get_or_compute(self, key, func):
+    """ Return the cached value of key, or call func and cache the result """
+    value = self.get(key)
+    if value is not None:
+      self.hits += 1
+      return value
+    self.misses += 1
+    value = func()
+    try:
+      self.put(key, value)
+    except OSError:
+      pass  # the cache is only an optimization
+    return value
+
+
+  def _path(self, key):
+    return os.path.join(self.folder, key + '.json')
+
+
+  def _entries(self):
+    try:
+      return [e for e in os.scandir(self.folder) if e.name.endswith('.json')]
+    except OSError:
+      return []
+
+
+  def _evict(self):
+    # delete the least recently used entries, down to 3/4 of the limit
+    entries = sorted([(e.stat().st_mtime_ns, e.stat().st_size, e.path)
+      for e in self._entries()])
+    self.size = sum([s for t, s, p in entries])
+    for t, s, p in entries:
+      if self.size <= self.max_bytes * 3 // 4:
+        break
+      try:
+        os.remove(p)
+        self.size -= s
+      except OSError:
+        pass
+
+
+def _update(h, v):
+  # feed a value into a hash, along with its type and shape
+  if isinstance(v, np.generic):
+    v = v.item()
+  if v is None or isinstance(v, (str, int, float, bool)):
+    h.update(repr(v).encode('utf-8'))
+    return
+  arr = np.asarray(v)
+  if arr.dtype.kind in 'OUS':
+    h.update(f'str{arr.shape}'.encode('utf-8'))
+    h.update('\x1f'.join(map(str, arr.ravel().tolist())).encode('utf-8'))
+  else:
+    h.update(f'{arr.dtype.str}{arr.shape}'.encode('utf-8'))
+    h.update(np.ascontiguousarray(arr).tobytes())
@@ -1,9 +1,12 @@
 import numpy as np
 import pandas as pd
 import itertools
-from sklearn.linear_model import LinearRegression
 from .bootstrap import bootstrap
 from .sensitivity import ad_wrapper
+from . import estimators
+
+# number of bootstrap replicates of the outcome mean and sensitivity CIs
+N_BOOTSTRAP = 200
 
 
 def round_robin (df, n=50):
@@ -114,7 +117,8 @@ def get_outcome_mean (y, indices, weights=None, ignore_na=True):
   return np.mean(arr)
 
 
-def bootstrap_outcome (df, COL, indices, weights=None, ignore_na=True):
+def bootstrap_outcome (df, COL, indices, weights=None, ignore_na=True,
+  seed=None, cache=None):
   """
   Given a sample, compute the bootstrapped CI around outcome mean.
 
@@ -123,23 +127,67 @@ def bootstrap_outcome (df, COL, indices, weights=None, ignore_na=True):
    - COL: the column in df
    - indices: sample index into the multiverse df
    - weights: importance sampling weights, if applicable
+   - seed: seed of the bootstrap resamples
+   - cache: a BootstrapCache to reuse an earlier result for the same sample
   """
   y = df[COL].to_numpy()
-  mean = get_outcome_mean(y, indices, weights)
 
-  # we will pass the index array to bootstrap, so here we adjust the func API
-  stat = lambda idx, w: get_outcome_mean(y, idx, w)
+  def compute ():
+    mean = get_outcome_mean(y, indices, weights)
+
+    # we will pass the index array to bootstrap, so here we adjust the func API
+    stat = lambda idx, w: get_outcome_mean(y, idx, w)
+
+    # bootstrap
+    bs = bootstrap(stat, ci_type='percentile', n=N_BOOTSTRAP, seed=seed)
+    bs.fit(indices, weights)  # sample uniformly, weighted mean
+    lower, upper = bs.get_ci()
 
-  # bootstrap
-  bs = bootstrap(stat, ci_type='percentile', n=200)
-  bs.fit(indices, weights)  # sample uniformly, weighted mean
-  lower, upper = bs.get_ci()
+    return [float(mean), float(lower), float(upper)]
 
-  return [mean, lower, upper]
+  if cache is None:
+    return compute()
+  key = cache.key('outcome_mean', indices=indices, values=y[indices],
+    weights=None if weights is None else np.asarray(weights)[indices],
+    ci_type='percentile', n=N_BOOTSTRAP, seed=seed)
+  return cache.get_or_compute(key, compute)
 
 
-def bootstrap_sensitivity (df, COL, indices, decs=None):
-  """ Sensitivity and bootstrapped CI for all decisions. """
+def estimate_outcome (df, COL, indices, weights=None, estimator='bootstrap',
+  strata=None, seed=None, cache=None):
+  """
+  The outcome mean and its CI with one of estimators.ESTIMATORS: the
+  bootstrap of bootstrap_outcome, or a closed-form estimator, which does
+  not need the seed and the cache.
+
+  Parameters:
+   - df, COL, indices, weights, seed, cache: as in bootstrap_outcome
+   - estimator: 'bootstrap', 'delta', 'snis' or 'stratified'
+   - strata: the stratum of every row of df, for 'stratified'
+
+  Returns: [mean, lower, upper]
+  """
+  if estimator == 'bootstrap':
+    return bootstrap_outcome(df, COL, indices, weights, seed=seed,
+      cache=cache)
+
+  y = pd.to_numeric(df[COL], errors='coerce').to_numpy(dtype=float)
+  if estimator == 'delta':
+    return estimators.delta_ci(y, indices, weights)
+  if estimator == 'snis':
+    return estimators.snis_ci(y, indices, weights)
+  if estimator == 'stratified':
+    return estimators.stratified_ci(y, indices, strata)
+  raise ValueError(f'Unknown estimator "{estimator}"')
+
+
+def bootstrap_sensitivity (df, COL, indices, decs=None, seed=None,
+  cache=None):
+  """
+  Sensitivity and bootstrapped CI for all decisions. With a cache, the
+  result of each decision is reused if it was computed for the same sample
+  and seed.
+  """
   if decs is None:
     # assuming all columns except "outcome" is a decision
     decs = list(df.columns)
@@ -153,20 +201,31 @@ def bootstrap_sensitivity (df, COL, indices, decs=None):
 
   # loop over all decisions
   for d in decs:
-    # sample stats
-    score, pval = ad_wrapper(df.iloc[indices], d, COL)
-    row = [d, score, pval]
-
-    # bootstrap
-    if not np.isnan(score):
-      bs = bootstrap(stat, ci_type='bc', n=200)
-      bs.fit(indices, d)
-      lower, upper = bs.get_ci()
-      row += [lower, upper]
-
-    # pad with NaN if we did not bootstrap
-    row += [np.nan] * (len(header) - len(row))
-    out.append(row)
+    def compute ():
+      # sample stats
+      score, pval = ad_wrapper(df.iloc[indices], d, COL)
+      row = [float(score), float(pval)]
+
+      # bootstrap
+      if not np.isnan(score):
+        bs = bootstrap(stat, ci_type='bc', n=N_BOOTSTRAP, seed=seed)
+        bs.fit(indices, d)
+        lower, upper = bs.get_ci()
+        row += [float(lower), float(upper)]
+
+      # pad with NaN if we did not bootstrap
+      return row + [np.nan] * (len(header) - 1 - len(row))
+
+    if cache is None:
+      row = compute()
+    else:
+      sample = df.iloc[indices]
+      key = cache.key('ad_score', decision=d, indices=indices,
+        options=sample[d].astype(str).to_numpy(),
+        values=sample[COL].to_numpy(), ci_type='bc', n=N_BOOTSTRAP,
+        seed=seed)
+      row = cache.get_or_compute(key, compute)
+    out.append([d] + row)
 
   return pd.DataFrame(out, columns = header)
 
@@ -1,7 +1,15 @@
-from scipy import stats
 import numpy as np
 import warnings
 
+# ks_2samp computes the exact p-value up to this sample size
+KS_MAX_EXACT_N = 10000
+
+
+def _stats ():
+  # scipy.stats takes most of the import time, so load it on first use
+  from scipy import stats
+  return stats
+
 
 def sensitivity_ad (df, dec, options, col):
   """ use the k-sample Anderson-Darling test to compute sensitivity """
@@ -16,12 +24,17 @@ def sensitivity_ad (df, dec, options, col):
   # the decision column would have empty value in summary.csv
   # groups = df.groupby(dec)[col].apply(list).tolist()
 
+  return ad_groups(groups)
+
+
+def ad_groups (groups):
+  """ k-sample Anderson-Darling test on a list of samples """
   with warnings.catch_warnings():
     # suppress the warning "p-value capped: true value larger than 0.25"
     warnings.simplefilter('ignore')
 
     # run the test
-    ad = stats.anderson_ksamp(groups)
+    ad = _stats().anderson_ksamp(groups)
 
   # normalized test statistics and p-value
   return ad.statistic, ad.significance_level
@@ -57,15 +70,80 @@ def sensitivity_ks (df, dec, options, col):
   if len(options) < 2:
     return 0
 
-  groups = []
-  for opt in options:
-      groups.append(df.loc[df[dec] == opt][col].to_numpy())
+  codes = _option_codes(df, dec, options)
+  return ks_codes(df[col].to_numpy(), codes, len(options))
+
+
+def ks_groups (groups):
+  """ median KS statistic over all pairs of samples in a list """
+  codes = np.repeat(np.arange(len(groups)), [len(g) for g in groups])
+  return ks_codes(np.concatenate(groups), codes, len(groups))
+
+
+def ks_codes (values, codes, k):
+  """
+  Median KS statistic over all pairs of integer-coded groups, the same as
+  calling stats.ks_2samp on each pair. The values are sorted once and the
+  empirical CDF of every group is evaluated at each distinct value. The CDFs
+  of a pair only differ where one of the two groups steps, so the statistic
+  of every pair is the largest difference at the values of its two groups,
+  gathered for all pairs at once.
+
+  Parameters:
+   - values: a 1D array
+   - codes: the group of each value, from 0 to k - 1, or negative for none
+   - k: the number of groups
+  """
+  values = np.asarray(values)
+  codes = np.asarray(codes)
+  ok = codes >= 0
+  values, codes = values[ok], codes[ok]
+
+  order = np.argsort(values, kind='stable')
+  return _ks_sorted(_distinct_ranks(values[order]), codes[order], k)
+
+
+def _distinct_ranks (values):
+  # the rank among distinct values of each element of a sorted array
+  return np.cumsum(np.append(True, values[1:] != values[:-1])) - 1
 
-  kss = []
-  for i in range(len(groups)):
-      for j in range(i + 1, len(groups)):
-          ks = stats.ks_2samp(groups[i], groups[j])
-          kss.append(ks.statistic)  # ks.pvalue gives p-value
+
+def _ks_sorted (distinct, codes, k):
+  # ks_codes, given the distinct rank and group of each value in sorted order
+  ok = codes >= 0
+  distinct, codes = distinct[ok], codes[ok]
+  n = np.bincount(codes, minlength=k)
+  if (n == 0).any():
+    raise ValueError('Data passed to ks_2samp must not be empty')
+  steps = [distinct[codes == g] for g in range(k)]
+
+  # the CDF of each group at each distinct value, one group after another
+  m = distinct[-1] + 1
+  flat = np.concatenate([np.cumsum(np.bincount(st, minlength=m)) / c
+    for st, c in zip(steps, n)])
+
+  # all pairs, in chunks to bound the memory of the differences
+  i, j = np.triu_indices(k, 1)
+  size = n[i] + n[j]
+  kss = np.empty(len(i))
+  s = 0
+  while s < len(i):
+    e = s + max(1, np.searchsorted(np.cumsum(size[s:]), 1 << 22))
+    pts = np.concatenate([steps[g] for a, b in zip(i[s:e], j[s:e])
+      for g in (a, b)])
+    a = np.repeat(i[s:e], size[s:e])
+    b = np.repeat(j[s:e], size[s:e])
+    starts = np.append(0, np.cumsum(size[s:e])[:-1])
+    diff = flat[pts + a * m] - flat[pts + b * m]
+    kss[s:e] = np.maximum.reduceat(np.abs(diff, out=diff), starts)
+    s = e
+
+  # like ks_2samp, round to a multiple of 1 / lcm(n1, n2) for the sizes
+  # where it computes the exact p-value
+  n1, n2 = n[i], n[j]
+  exact = np.maximum(n1, n2) <= KS_MAX_EXACT_N
+  lcm = n1 // np.gcd(n1, n2) * n2
+  kss[exact] = np.round(kss[exact] * lcm[exact]) / lcm[exact]
 
   # median KS stat
   return np.median(kss)
@@ -76,23 +154,117 @@ def sensitivity_f (df, dec, options, col):
   if len(options) < 2:
     return 0
 
-  x_mean = df[col].mean()
+  # an option without universes has an undefined mean
+  codes = _option_codes(df, dec, options)
+  if (np.bincount(codes[codes >= 0], minlength=len(options)) == 0).any():
+    return np.nan
 
-  groups = []
-  for opt in options:
-      groups.append(df.loc[df[dec] == opt][['uid', col]])
-
-  # ms between
-  ms_b = 0
-  for g in groups:
-      ms_b += len(g) * (g[col].mean() - x_mean)**2
-  ms_b /= len(groups) - 1
-
-  # ms within
-  ms_w = 0
-  for g in groups:
-      g_mean = g[col].mean()
-      ms_w += sum((g[col] - g_mean)**2)
-  ms_w /= len(df) - len(groups)
-
-  return ms_b / ms_w
+  return f_codes(df[col].to_numpy(), codes, len(options))
+
+
+def _option_codes (df, dec, options):
+  # the index of the option of each row, or -1 if it has none of them
+  codes = np.full(len(df), -1)
+  for j, opt in enumerate(options):
+      codes[(df[dec] == opt).to_numpy()] = j
+  return codes
+
+
+def f_codes (values, codes, k):
+  """
+  One-way F-test on integer-coded groups, as in sensitivity_f: the grand
+  mean and the degrees of freedom count all values, including those with a
+  negative code, which belong to no group. Groups without values are left
+  out.
+
+  Parameters:
+   - values: a 1D float array
+   - codes: the group of each value, from 0 to k - 1, or negative for none
+   - k: the number of groups
+  """
+  values = np.asarray(values, dtype=float)
+  codes = np.asarray(codes)
+  ok = codes >= 0
+  n = np.bincount(codes[ok], minlength=k)
+  present = n > 0
+  n_groups = int(present.sum())
+  if n_groups < 2:
+    return 0
+
+  means = np.bincount(codes[ok], weights=values[ok], minlength=k)
+  means[present] /= n[present]
+  ms_b = (n[present] * (means[present] - values.mean())**2).sum()
+  ms_b /= n_groups - 1
+
+  dev = values[ok] - means[codes[ok]]
+  ms_w = (dev**2).sum() / (len(values) - n_groups)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    return ms_b / ms_w
+
+
+def sensitivity_matrix (values, codes, ks, method='f'):
+  """
+  Sensitivity of every decision for several outcomes at once, the same as
+  calling sensitivity_f, sensitivity_ks or sensitivity_ad per pair, but
+  coding the options once. The rows of each option are gathered once per
+  decision for all outcomes (F), and each outcome is sorted once for all
+  decisions (KS).
+
+  Parameters:
+   - values: a 2D float array with one column per outcome, NaN where the
+     outcome of a row is missing
+   - codes: a 2D int array with the option of each row in each decision, or
+     -1 for none, as from accumulator.decision_codes
+   - ks: the number of options of each decision
+   - method: 'f', 'ks' or 'ad'
+
+  Returns: a (decisions, outcomes) array, with 0 for a decision with fewer
+    than 2 options, and NaN where an option has no rows or the test fails
+  """
+  values = np.asarray(values, dtype=float)
+  codes = np.asarray(codes)
+  res = np.zeros((codes.shape[1], values.shape[1]))
+  if method == 'f':
+    for d, k in enumerate(ks):
+      if k >= 2:
+        res[d] = _f_columns(values, codes[:, d], k)
+    return res
+
+  for o in range(values.shape[1]):
+    # each outcome is sorted once, and its missing rows dropped
+    ok = ~np.isnan(values[:, o])
+    order = np.argsort(values[ok, o], kind='stable')
+    v, c = values[ok, o][order], codes[ok][order]
+    distinct = _distinct_ranks(v) if method == 'ks' else None
+    for d, k in enumerate(ks):
+      if k < 2:
+        continue
+      try:
+        if method == 'ks':
+          res[d, o] = _ks_sorted(distinct, c[:, d], k)
+        else:
+          res[d, o] = ad_groups([v[c[:, d] == j] for j in range(k)])[0]
+      except (ValueError, IndexError):
+        res[d, o] = np.nan
+  return res
+
+
+def _f_columns (values, codes, k):
+  # sensitivity_f of one decision for every column, skipping NaN per column
+  valid = ~np.isnan(values)
+  v = np.where(valid, values, 0)
+  ok = codes >= 0
+  onehot = (codes[ok] == np.arange(k)[:, None]).astype(float)
+
+  # per option counts and means, for all columns in one product
+  n = onehot @ valid[ok]
+  with np.errstate(divide='ignore', invalid='ignore'):
+    means = (onehot @ v[ok]) / n
+    total = valid.sum(axis=0)
+    grand = v.sum(axis=0) / total
+    ms_b = (n * (means - grand)**2).sum(axis=0) / (k - 1)
+    dev = np.where(valid[ok], v[ok] - means[codes[ok]], 0)
+    ms_w = (dev**2).sum(axis=0) / (total - k)
+    res = ms_b / ms_w
+  # an option without universes has an undefined mean
+  return np.where((n == 0).any(axis=0), np.nan, res)
@@ -0,0 +1,100 @@
+import numpy as np
+
+
+class QuantileSketch:
+  """
+  A mergeable quantile sketch in the style of KLL (Karnin, Lang and Liberty,
+  2016), for streams too large to keep in memory. Values enter the first
+  level of compactors; a level over its capacity is sorted and every other
+  value, from a random offset, moves up one level, where each value stands
+  for twice as many. Lower levels have geometrically smaller capacities, so
+  the sketch keeps O(k log(n / k)) values, and the rank error of a quantile
+  is a small multiple of n / k with high probability.
+
+  Until the first compaction the sketch holds every value, and quantiles are
+  exactly those of np.quantile. The minimum and maximum are always exact.
+  """
+
+  def __init__(self, k=200, seed=0):
+    """
+    Parameters:
+     - k: the capacity of the top level; a larger k is more accurate
+     - seed: seed of the compaction offsets, so results are reproducible
+    """
+    self.k = k
+    self.levels = [np.empty(0)]
+    self.count = 0
+    self.min = np.inf
+    self.max = -np.inf
+    self.rng = np.random.default_rng(seed)
+
+
+  def _capacity(self, h):
+    # capacities shrink by 2/3 per level below the top
+    depth = len(self.levels) - 1 - h
+    return max(2, int(np.ceil(self.k * (2 / 3)**depth)))
+
+
+  def update(self, values):
+    """ Add an array of values; NaN is skipped """
+    values = np.asarray(values, dtype=float).ravel()
+    values = values[~np.isnan(values)]
+    if not len(values):
+      return
+    self.count += len(values)
+    self.min = min(self.min, float(values.min()))
+    self.max = max(self.max, float(values.max()))
+    self.levels[0] = np.concatenate([self.levels[0], values])
+    self._compress()
+
+
+  def merge(self, other):
+    """ Add the values summarized by another sketch """
+    for h, level in enumerate(other.levels):
+      if h == len(self.levels):
+        self.levels.append(np.empty(0))
+      self.levels[h] = np.concatenate([self.levels[h], level])
+    self.count += other.count
+    self.min = min(self.min, other.min)
+    self.max = max(self.max, other.max)
+    self._compress()
+    return self
+
+
+  def _compress(self):
+    h = 0
+    while h < len(self.levels):
+      level = self.levels[h]
+      if len(level) > self._capacity(h):
+        if h + 1 == len(self.levels):
+          self.levels.append(np.empty(0))
+        level = np.sort(level)
+        # an odd value out stays at this level
+        keep, level = level[:len(level) % 2], level[len(level) % 2:]
+        up = level[self.rng.integers(2)::2]
+        self.levels[h + 1] = np.concatenate([self.levels[h + 1], up])
+        self.levels[h] = keep
+      h += 1
+
+
+  def quantile(self, q):
+    """ Approximate quantiles, for an array of q between 0 and 1 """
+    q = np.asarray(q, dtype=float)
+    if not self.count:
+      return np.full(q.shape, np.nan)
+    if len(self.levels) == 1:
+      return np.quantile(self.levels[0], q)
+
+    values = np.concatenate(self.levels)
+    weights = np.concatenate([np.full(len(l), 2**h, dtype=np.int64)
+      for h, l in enumerate(self.levels)])
+    order = np.argsort(values, kind='stable')
+    values, cum = values[order], np.cumsum(weights[order])
+    i = np.searchsorted(cum, q * cum[-1], side='left')
+    res = values[np.minimum(i, len(values) - 1)]
+    res = np.where(q <= 0, self.min, np.where(q >= 1, self.max, res))
+    return res
+
+
+  def nbytes(self):
+    return sum([l.nbytes for l in self.levels])
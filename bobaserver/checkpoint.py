@@ -0,0 +1,118 @@
+# append-only binary checkpoint logs for the boba monitor
+
+import os
+import json
+import time
+import struct
+import threading
+import numpy as np
+
+MAGIC = b'BOBALOG1'
+
+
+class CheckpointLog:
+  """
+  An append-only log of fixed-width typed records. The file starts with a
+  small JSON header describing the record layout, followed by the records
+  packed back to back, so a resume can memory map the whole log at once.
+  """
+
+  def __init__(self, fn, fields, flush_size=64, flush_interval=10):
+    """
+    Parameters:
+     - fn: path to the log file
+     - fields: a list of (name, dtype) tuples describing a record
+     - flush_size: write to disk once this many records are buffered
+     - flush_interval: write to disk if the last write is older than this
+       many seconds
+    """
+    self.fn = fn
+    self.dtype = np.dtype(fields)
+    self.flush_size = flush_size
+    self.flush_interval = flush_interval
+    self.buffer = []
+    self.last_flush = time.time()
+    # the monitor jobs append from several threads; the buffer is guarded by
+    # lock, and writes are kept in order by write_lock
+    self.lock = threading.Lock()
+    self.write_lock = threading.Lock()
+
+
+  def append(self, rows):
+    """ Buffer the rows, and flush if the buffer is large or stale. """
+    with self.lock:
+      self.buffer += [tuple(r) for r in rows]
+      stale = time.time() - self.last_flush > self.flush_interval
+      full = len(self.buffer) >= self.flush_size
+    if full or stale:
+      self.flush()
+
+
+  def flush(self):
+    """ Write all buffered records to disk in one go. """
+    with self.write_lock:
+      # take the buffer out, so rows appended meanwhile wait for the next
+      with self.lock:
+        self.last_flush = time.time()
+        buffer, self.buffer = self.buffer, []
+      if not len(buffer):
+        return
+
+      arr = np.array(buffer, dtype=self.dtype)
+      with open(self.fn, 'ab') as f:
+        if f.tell() == 0:
+          f.write(_make_header(self.dtype))
+        f.write(arr.tobytes())
+
+
+def _make_header(dtype):
+  # magic, header length, and the JSON layout padded to 8-byte alignment
+  fields = [[name, dtype.fields[name][0].str] for name in dtype.names]
+  meta = json.dumps({'fields': fields}).encode('utf-8')
+  size = len(MAGIC) + 4 + len(meta)
+  meta += b' ' * (-size % 8)
+  return MAGIC + struct.pack('<I', len(meta)) + meta
+
+
+def read_log(fn):
+  """
+  Memory map a checkpoint log. Returns a read-only structured array, or None
+  if the file does not exist. A partially written trailing record is ignored.
+  """
+  if not os.path.exists(fn):
+    return None
+
+  with open(fn, 'rb') as f:
+    if f.read(len(MAGIC)) != MAGIC:
+      raise ValueError(f'{fn} is not a checkpoint log')
+    n, = struct.unpack('<I', f.read(4))
+    meta = json.loads(f.read(n).decode('utf-8'))
+
+  dtype = np.dtype([tuple(d) for d in meta['fields']])
+  offset = len(MAGIC) + 4 + n
+  count = (os.path.getsize(fn) - offset) // dtype.itemsize
+  if count < 1:
+    return np.empty(0, dtype=dtype)
+  return np.memmap(fn, dtype=dtype, mode='r', offset=offset, shape=(count,))
+
+
+def to_rows(arr):
+  """ Convert records to a 2D list, decoding bytes and keeping NaN as 'nan' """
+  res = []
+  for r in arr.tolist():
+    res.append([v.decode('utf-8') if isinstance(v, bytes) else \
+      ('nan' if isinstance(v, float) and np.isnan(v) else v) for v in r])
+  return res
+
+
+def export_csv(fn, out):
+  """ Export a checkpoint log to a CSV file. Returns the number of rows. """
+  arr = read_log(fn)
+  if arr is None:
+    return 0
+
+  with open(out, 'w') as f:
+    f.write(','.join(arr.dtype.names) + '\n')
+    for r in to_rows(arr):
+      f.write(','.join([str(i) for i in r]) + '\n')
+  return arr.shape[0]
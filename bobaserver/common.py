@@ -2,56 +2,73 @@ import pandas as pd
 import numpy as np
 import os
 import re
-from bobaserver import app
+from .dataset import current
 from .bobastats import sensitivity
-from .util import print_warn, remove_na, group_by
+from .util import print_warn, print_fail, remove_na, group_by, read_csv, \
+  read_key_safe
+from .metrics import timed
+from .index import DecisionIndex
+from .lod import LevelOfDetail
+from .subset import SubsetSensitivity
+from .bobastats.sketch import QuantileSketch
+from .bobastats.accumulator import decision_codes
+
+# prediction files larger than this are parsed in chunks into sketches
+RAW_STREAM_BYTES = 32 << 20
+RAW_CHUNK_ROWS = 1 << 18
+
+# per-universe outcomes in the sensitivity matrix, where in the schema
+MATRIX_OUTCOMES = ('point_estimate', 'p_value', 'fit', 'standard_error',
+  'stacking_weight')
 
 
 def get_decision_list ():
   # get a list of decision names
-  return sorted([d['var'] for d in app.decisions])
+  return sorted([d['var'] for d in current.decisions])
 
 
 def get_decision_df ():
   # get the summary.csv without any non-decision columns
-  dec = [d['var'] for d in app.decisions]
+  dec = [d['var'] for d in current.decisions]
   return read_summary()[dec]
 
 
 def get_field_name (field):
   # get the column name of the field in df
-  return app.schema[field]['field']
+  return current.schema[field]['field']
 
 
 def read_summary ():
   """ read summary.csv """
-  if hasattr(app, 'summary'):
-    return app.summary
-
-  fn = os.path.join(app.data_folder, 'summary.csv')
-  smr = pd.read_csv(fn, na_filter=False)
-  smr['uid'] = smr.apply(lambda r: r.name + 1, axis=1).astype(int)
-  return smr
+  if current.summary is None:
+    current.load()
+  return current.summary
 
 
 def read_results (field, dtype=str):
   """ read a result field """
   # read the result file
-  info = app.schema[field]
-  fn = os.path.join(app.data_folder, info['file'])
-  df = pd.read_csv(fn, na_filter=False)
+  info = current.schema[field]
+  fn = os.path.join(current.data_folder, info['file'])
+  with timed('parse'):
+    df = pd.read_csv(fn, na_filter=False)
   col = info['field']
   return df[['uid', col]]
 
 
-def read_results_batch (field_list):
-  """ read multiple fields at once, minimizing file IO """
-  fields = [app.schema[f] for f in field_list if f in app.schema]
+def read_results_batch (field_list, folder=None):
+  """
+  read multiple fields at once, minimizing file IO, from the data folder or
+  another folder with the same layout
+  """
+  folder = current.data_folder if folder is None else folder
+  fields = [current.schema[f] for f in field_list if f in current.schema]
   groups = group_by(fields, lambda x: x['file'])
 
   res = None
   for fn in groups:
-    df = pd.read_csv(os.path.join(app.data_folder, fn), na_filter=False)
+    with timed('parse'):
+      df = pd.read_csv(os.path.join(folder, fn), na_filter=False)
     names = ['uid'] + [d['name'] for d in groups[fn]]
     cols = ['uid'] + [d['field'] for d in groups[fn]]
     df = df[cols].rename(columns=dict(zip(cols, names)))
@@ -60,12 +77,186 @@ def read_results_batch (field_list):
   return res
 
 
+def read_pred ():
+  """ read the point estimates and other per-universe fields, without NA """
+  fields = ['point_estimate', 'p_value', 'fit', 'stacking_weight',
+    'annotation', 'standard_error']
+  res = read_results_batch(fields)
+  header = res.columns.tolist()
+
+  # remove Inf and NA in point estimates
+  res = remove_na(res, 'point_estimate', dtype=float)
+  return [res[n].values.tolist() for n in header], header
+
+
+def build_index ():
+  """ build the bitmap index of decision options and point estimates """
+  if current.store is not None and 'index/meta' in current.store:
+    return DecisionIndex.load(current.store, 'index')
+
+  smr = read_summary()
+  est = read_results('point_estimate')
+  col = get_field_name('point_estimate')
+  df = pd.merge(smr[['uid']], est, on='uid', how='left')
+  values = pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=float,
+    copy=True)
+  values[np.isinf(values)] = np.nan
+  with timed('compute', 'build_index'):
+    return DecisionIndex(smr, current.decisions, values)
+
+
+def build_subset ():
+  """ code the decisions of each universe to compute subset sensitivity """
+  df = read_results_with_summary('point_estimate', dtype=float,
+    diagnostics=False)
+  col = get_field_name('point_estimate')
+  with timed('compute', 'build_subset'):
+    return SubsetSensitivity(df, current.decisions, df[col].to_numpy())
+
+
+def build_lod (field):
+  """ build the level-of-detail summaries of a field with many samples """
+  if current.store is not None and f'lod/{field}/levels' in current.store:
+    return LevelOfDetail.load(current.store, f'lod/{field}')
+
+  info = current.schema[field]
+  fn = os.path.join(current.data_folder, info['file'])
+  with timed('parse'):
+    df = pd.read_csv(fn, usecols=['uid', info['field']])
+  values = pd.to_numeric(df[info['field']], errors='coerce')
+  with timed('compute', 'build_lod'):
+    return LevelOfDetail(df['uid'].to_numpy(), values.to_numpy(dtype=float))
+
+
+def read_raw (uid):
+  """ read and sample the actual and predicted data of a universe """
+  data = _read_raw_store(uid)
+  if data is not None:
+    return None, data
+
+  # fixme: prediction might not exist
+  # fixme: now we assume specific column order, should use field name
+  f = current.schema['prediction']
+  m = 100
+  qt = np.append(np.arange(0, 1, 1 / m), 1.0)
+  data = _read_raw_sketch(f['file'], uid, m, qt)
+  if data is None:
+    err, res = read_multi(f['file'], uid)
+    if err:
+      return err, None
+
+    # sampling
+    data = []
+    with timed('compute', 'quantile'):
+      for i in range(2):
+        long = res[:, i].tolist() if isinstance(res, np.ndarray) else \
+          list(map(lambda d: float(d[i]), res))
+        if len(long) > m:
+          # quantile dot plot
+          data.append(np.quantile(long, qt).tolist())
+        else:
+          data.append(long)
+
+  # apply transform
+  trans = read_key_safe(f, ['transform'], None)
+  if trans:
+    trans = trans.format('x')
+    for i in range(2):
+      data[i] = [eval(trans) for x in data[i]]
+
+  return None, data
+
+
+def read_multi (template, uid):
+  """
+  read the rows of a per-universe file, without its header, from the pack if
+  it is there, otherwise from the file. Numeric rows from the pack are a
+  2D float array.
+  """
+  if current.pack is not None:
+    res = current.pack.read(template, uid)
+    if res is not None:
+      return None, res[1]
+  fn = os.path.join(current.data_folder, template.format(uid))
+  return read_csv(fn, 1)
+
+
+def _read_raw_sketch (template, uid, m, qt):
+  """
+  sample a large prediction file that is not in the pack: parse it in chunks
+  of typed columns and feed a quantile sketch per column, so the memory does
+  not grow with the file. Returns None for other files.
+  """
+  if current.pack is not None and current.pack.contains(template, uid):
+    return None
+  fn = os.path.join(current.data_folder, template.format(uid))
+  try:
+    if os.path.getsize(fn) <= RAW_STREAM_BYTES:
+      return None
+  except OSError:
+    return None
+
+  sketches = [QuantileSketch(), QuantileSketch()]
+  with timed('compute', 'quantile_sketch'):
+    # round_trip parses the same floats as float() in read_csv
+    reader = pd.read_csv(fn, usecols=[0, 1], dtype=float,
+      float_precision='round_trip', chunksize=RAW_CHUNK_ROWS)
+    for chunk in reader:
+      arr = chunk.to_numpy()
+      for i in range(2):
+        sketches[i].update(arr[:, i])
+
+  # a sketch keeps every value, in order, until it is over its capacity
+  return [s.quantile(qt).tolist() if s.count > m else s.levels[0].tolist()
+    for s in sketches]
+
+
+def _read_raw_store (uid):
+  # the sampled raw data of a universe in the bundle, or None
+  store = current.store
+  if store is None or 'raw/uids' not in store:
+    return None
+  try:
+    uid = int(uid)
+  except (TypeError, ValueError):
+    return None
+  uids = store.get('raw/uids')
+  i = np.searchsorted(uids, uid)
+  if i >= len(uids) or uids[i] != uid:
+    return None
+  start, mid, end = store.get('raw/bounds')[i].tolist()
+  values = store.get('raw/values')
+  return [values[start:mid].tolist(), values[mid:end].tolist()]
+
+
+def read_raw_all ():
+  """
+  sample the raw data of every universe, as sorted uids, [start, mid, end]
+  bounds of the actual and predicted values of each, and the values
+  """
+  uids = []
+  bounds = []
+  values = []
+  n = 0
+  for uid in sorted(read_summary()['uid'].tolist()):
+    err, data = read_raw(uid)
+    if err:
+      continue
+    uids.append(uid)
+    bounds.append([n, n + len(data[0]), n + len(data[0]) + len(data[1])])
+    values += data[0] + data[1]
+    n = bounds[-1][2]
+  return np.asarray(uids, dtype=np.int64), \
+    np.asarray(bounds, dtype=np.int64).reshape(-1, 3), \
+    np.asarray(values, dtype=float)
+
+
 def read_results_with_summary (field, dtype=str, diagnostics=True):
   """ read a result field and join with summary """
   # read results and join with summary
   smr = read_summary()
   results = read_results(field, dtype)
-  col = app.schema[field]['field']
+  col = current.schema[field]['field']
   df = pd.merge(smr, results, on='uid')
 
   # convert data type, remove Inf and NA
@@ -129,7 +320,7 @@ def sensitivity_f_test (df, col):
     """ Compute one-way F-test to estimate decision sensitivity """
     # compute one-way F-test
     res = {d['var']: sensitivity.sensitivity_f(df, d['var'], d['options'],
-        col) for d in app.decisions}
+        col) for d in current.decisions}
 
     # check NaN
     for d in res:
@@ -144,13 +335,13 @@ def sensitivity_f_test (df, col):
 def sensitivity_ks (df, col):
     """ compute Kolmogorov-Smirnov statistic """
     return {d['var']: sensitivity.sensitivity_ks(df, d['var'], d['options'],
-        col) for d in app.decisions}
+        col) for d in current.decisions}
 
 
 def sensitivity_ad (df, col):
     """ use k-samples Anderson-Darling test to compute sensitivity """
     return {d['var']: sensitivity.sensitivity_ad(df, d['var'], d['options'],
-         col)[0] for d in app.decisions}
+         col)[0] for d in current.decisions}
 
 
 def cal_sensitivity(df=None):
@@ -158,17 +349,50 @@ def cal_sensitivity(df=None):
     # read the prediction and join with summary
     if df is None:
       df = read_results_with_summary('point_estimate', dtype=float)
-    col = app.schema['point_estimate']['field']
-    method = app.visualizer['sensitivity']
-
-    if method == 'f':
-        # one-way F-test
-        score = sensitivity_f_test(df, col)
-    if method == 'ks':
-        # Kolmogorov-Smirnov statistic
-        score = sensitivity_ks(df, col)
-    if method == 'ad':
-        # k-samples Anderson-Darling test
-        score = sensitivity_ad(df, col)
+    col = current.schema['point_estimate']['field']
+    method = current.visualizer['sensitivity']
+
+    with timed('compute', f'sensitivity_{method}'):
+        if method == 'f':
+            # one-way F-test
+            score = sensitivity_f_test(df, col)
+        if method == 'ks':
+            # Kolmogorov-Smirnov statistic
+            score = sensitivity_ks(df, col)
+        if method == 'ad':
+            # k-samples Anderson-Darling test
+            score = sensitivity_ad(df, col)
 
     return score
+
+
+def cal_sensitivity_matrix (fields=None, method=None):
+  """
+  Sensitivity of every decision for several outcome fields at once, by
+  default the per-universe numeric fields in the schema. Each outcome skips
+  the universes where it is NA or Inf.
+
+  Returns: a dict with the method, the decisions, the outcomes and the
+    scores, with a row per decision and a column per outcome, and None where
+    a score cannot be computed
+  """
+  fields = [f for f in (fields or MATRIX_OUTCOMES) if f in current.schema
+    and not current.schema[f]['multi']]
+  method = method or current.visualizer['sensitivity']
+  df = pd.merge(read_summary(), read_results_batch(fields), on='uid')
+
+  # convert data type as in remove_na, with NaN in place of NA and Inf
+  values = np.column_stack([pd.to_numeric(df[f], errors='coerce',
+    downcast='float').to_numpy(dtype=float) for f in fields])
+  values[np.isinf(values)] = np.nan
+
+  decs = current.decisions
+  with timed('compute', f'sensitivity_matrix_{method}'):
+    codes = decision_codes(df, decs)
+    scores = sensitivity.sensitivity_matrix(values, codes,
+      [len(d['options']) for d in decs], method)
+
+  return {'method': method, 'decisions': [d['var'] for d in decs],
+    'outcomes': fields,
+    'scores': [[float(v) if np.isfinite(v) else None for v in row]
+      for row in scores]}
@@ -0,0 +1,659 @@
+# a data folder and its derived state, and a registry to serve many of them
+
+import os
+import sys
+import glob
+import threading
+import contextvars
+from time import perf_counter
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from flask import g, has_request_context
+from werkzeug.local import LocalProxy
+import bobaserver
+from .util import read_csv, read_json, write_json, read_key_safe, print_warn
+from .store import Store, StoreWriter
+from .pack import PACK, MultiReader
+from .metrics import timed
+from .watch import FileWatcher
+
+# the dataset explicitly activated in this context, see Dataset.activate
+_active = contextvars.ContextVar('dataset', default=None)
+
+# the bundle written by `boba-server build` into the data folder
+BUNDLE = 'bundle.boba'
+BUNDLE_VERSION = 2
+
+
+class DatasetError(Exception):
+  """ The data folder is missing files or has an invalid overview.json """
+  pass
+
+
+def sizeof(obj):
+  """ Estimate the memory footprint of a cached object in bytes """
+  if isinstance(obj, pd.DataFrame):
+    return int(obj.memory_usage(deep=True).sum())
+  if isinstance(obj, np.ndarray):
+    return obj.nbytes
+  if isinstance(obj, (bytes, str)):
+    return len(obj)
+  if isinstance(obj, dict):
+    return sys.getsizeof(obj) + sum([sizeof(v) for v in obj.values()])
+  if isinstance(obj, (list, tuple)):
+    return sys.getsizeof(obj) + sum([sizeof(v) for v in obj])
+  if callable(getattr(obj, 'nbytes', None)):
+    return obj.nbytes()
+  return sys.getsizeof(obj)
+
+
+class Dataset:
+  """
+  A multiverse data folder, with its meta data, derived state such as the
+  summary table and sensitivity, and a cache of request results.
+  """
+
+  def __init__(self, data_folder, name='', monitor=False, use_bundle=True):
+    """
+    Parameters:
+     - data_folder: path to the folder with overview.json and summary.csv
+     - name: the URL prefix of this dataset
+     - monitor: if true, the results are still being written, so we skip
+       the sensitivity and the bundle, and do not cache results
+     - use_bundle: if true, load from an up-to-date bundle if there is one
+    """
+    self.name = name
+    self.data_folder = os.path.realpath(data_folder)
+    self.monitor = monitor
+    self.use_bundle = use_bundle and not monitor
+    self.files = []
+    self.schema = {}
+    self.decisions = []
+    self.visualizer = {}
+    self.summary = None
+    self.sensitivity = None
+    self.store = None
+    self.pack = None
+    self.cache = {}
+    self.cache_size = {}  # bytes, or None for objects measured as they grow
+    self.cache_sources = {}  # signature of the files a value depends on
+    self.summary_size = (None, 0)  # the summary last measured, and its size
+    self.pending = {}  # a lock per key being computed by cached()
+    self.lock = threading.RLock()
+
+
+  def activate(self):
+    """ Context manager to make this the current dataset. """
+    return _Activation(self)
+
+
+  def is_loaded(self):
+    return self.summary is not None
+
+
+  def load(self):
+    """ Read and verify the data folder, if it is not yet in memory. """
+    with self.lock:
+      if self.is_loaded():
+        return self
+
+      with self.activate():
+        self._open_pack()
+        if self._load_bundle():
+          return self
+        self._read_meta()
+        if self.sensitivity is None and not self.monitor:
+          self._check_result_files()
+          self._cal_sensitivity()
+    return self
+
+
+  def unload(self):
+    """ Release the summary and cached results, but keep small meta data. """
+    with self.lock:
+      self.summary = None
+      self.store = None
+      self.pack = None
+      self.cache = {}
+      self.cache_size = {}
+      self.cache_sources = {}
+
+
+  def nbytes(self):
+    """ Approximate memory used by this dataset """
+    with self.lock:
+      # measuring a table is slow, so it is done once per summary
+      summary = self.summary
+      if self.summary_size[0] is not summary:
+        n = sizeof(summary) if summary is not None else 0
+        self.summary_size = (summary, n)
+      cached = sum([self.cache[k].nbytes() if n is None else n
+        for k, n in self.cache_size.items()])
+      return self.summary_size[1] + cached
+
+
+  def cached(self, key, func, keep=None, files=None):
+    """
+    Return the cached value of key, or call func and cache the result.
+    Concurrent calls for the same key wait for the first one. If keep is
+    given, only results for which keep(result) is true are cached, so for
+    example a failed read is tried again by the next request. If files is
+    given, a list of data files the value is derived from, the value is
+    computed again when one of them changes, and it is cached even while
+    monitoring.
+    """
+    sig = None if files is None else self._sources(files)
+    if key in self.cache and self.cache_sources.get(key) == sig:
+      return self.cache[key]
+
+    with self.lock:
+      lock = self.pending.setdefault(key, threading.Lock())
+    with lock:
+      if key in self.cache and self.cache_sources.get(key) == sig:
+        return self.cache[key]
+      value = func()
+      if (not self.monitor or files is not None) and \
+        (keep is None or keep(value)):
+        # objects that report their size may grow, so measure them live
+        size = None if callable(getattr(value, 'nbytes', None)) \
+          else sizeof(value)
+        with self.lock:
+          self.cache[key] = value
+          self.cache_size[key] = size
+          self.cache_sources[key] = sig
+    with self.lock:
+      self.pending.pop(key, None)
+    return value
+
+
+  def build_store(self, fn, raw=True):
+    """
+    Write the meta data, the summary, the result columns, the sensitivity,
+    the decision index, the summaries of the uncertainty and null
+    distribution, and if raw, the sampled raw data of every universe into a
+    memory-mapped store, and serve from the store from now on.
+    """
+    import bobaserver.common as common
+    self.load()
+    with self.activate():
+      err, rows = read_csv(os.path.join(self.data_folder, 'summary.csv'), 0)
+      cols, header = common.read_pred()
+      index = common.build_index()
+      lods = {f: common.build_lod(f) for f in
+        ['uncertainty', 'null_distribution'] if f in self.schema}
+      raw = common.read_raw_all() if raw and 'prediction' in self.schema \
+        else None
+
+    meta = {'version': BUNDLE_VERSION, 'files': self.files,
+      'schema': self.schema, 'decisions': self.decisions,
+      'visualizer': self.visualizer, 'sources': self._sources()}
+    with StoreWriter(fn) as w:
+      w.add_json('meta', meta)
+      w.add_table('summary', rows[0], list(zip(*rows[1:])))
+      w.add_table('frame', self.summary.columns.tolist(),
+        [self.summary[c].to_numpy() for c in self.summary.columns])
+      w.add_table('pred', header, cols)
+      w.add_json('sensitivity', self.sensitivity)
+      index.save(w, 'index')
+      for f in lods:
+        lods[f].save(w, f'lod/{f}')
+      if raw is not None:
+        w.add('raw/uids', raw[0])
+        w.add('raw/bounds', raw[1])
+        w.add('raw/values', raw[2])
+    self.store = Store(fn)
+
+
+  def watched_files(self):
+    """ The files whose changes affect the derived state """
+    return ['overview.json', 'summary.csv'] + [f['path'] for f in self.files
+      if not f['multi']]
+
+
+  def refresh(self, changed):
+    """
+    Return a new dataset for the same folder after some files changed,
+    recomputing only the state derived from them and sharing the rest. A
+    change to overview.json reloads everything. The bundle is not used, as
+    it is stale now. This dataset is left untouched, so requests still using
+    it are not disturbed.
+
+    Parameters:
+     - changed: paths of the changed files
+    """
+    rel = set([os.path.relpath(os.path.realpath(p), self.data_folder)
+      for p in changed])
+    new = Dataset(self.data_folder, self.name, self.monitor, self.use_bundle)
+    if 'overview.json' in rel or not self.is_loaded():
+      return new.load() if self.is_loaded() else new
+
+    new.use_bundle = False
+    new.files = self.files
+    new.schema = self.schema
+    new.decisions = self.decisions
+    new.visualizer = self.visualizer
+    with new.activate():
+      if 'summary.csv' in rel:
+        new.summary = _read_summary(self.data_folder)
+        new._open_pack()
+      else:
+        new.summary = self.summary
+        new.pack = self.pack
+
+      # keep the cached results that do not depend on the changed files
+      for key, value in list(self.cache.items()):
+        deps = _cache_deps(key, self.schema)
+        if deps is not None and not len(deps & rel):
+          new.cache[key] = value
+          new.cache_size[key] = self.cache_size[key]
+          if key in self.cache_sources:
+            new.cache_sources[key] = self.cache_sources[key]
+
+      pe = self.schema['point_estimate']['file']
+      if self.monitor or not len({'summary.csv', pe} & rel):
+        new.sensitivity = self.sensitivity
+      else:
+        new._check_result_files()
+        new._cal_sensitivity()
+    return new
+
+
+  def _sources(self, fs=None):
+    """
+    Modification time and size of the files the bundle is built from, or
+    None for a missing file. The per-universe files of a template such as
+    raw/pred_{}.csv are summarized by their number, latest modification
+    time and total size.
+    """
+    if fs is None:
+      fs = ['overview.json', 'summary.csv'] + [f['path'] for f in self.files]
+    res = {}
+    for f in fs:
+      fn = os.path.join(self.data_folder, f)
+      if '{}' in f:
+        st = [os.stat(p) for p in glob.glob(glob.escape(fn).format('*'))]
+        res[f] = [len(st), max([s.st_mtime_ns for s in st] + [0]),
+          sum([s.st_size for s in st])]
+        continue
+      try:
+        st = os.stat(fn)
+        res[f] = [st.st_mtime_ns, st.st_size]
+      except OSError:
+        res[f] = None
+    return res
+
+
+  def _open_pack(self):
+    """ Memory map the pack of per-universe files, if there is one. """
+    fn = os.path.join(self.data_folder, PACK)
+    if not self.use_bundle or self.pack is not None or \
+      not os.path.exists(fn):
+      return
+    try:
+      pack = MultiReader(fn)
+    except (OSError, ValueError, KeyError):
+      print_warn(f'Ignoring the unreadable pack {fn}')
+      return
+
+    # the universes are listed in summary.csv, which a new run rewrites, and
+    # the packed files are summarized per template
+    now = self._sources(list(pack.sources))
+    changed = [f for f, sig in pack.sources.items() if now[f] != sig]
+    if len(changed):
+      print_warn(f'Ignoring the pack {fn}, as {changed[0]} changed after it ' +
+        'was written. Run "boba-server pack" again to refresh it.')
+      return
+    self.pack = pack
+
+
+  def _load_bundle(self):
+    """
+    Memory map the bundle if it exists and none of its sources changed.
+    Returns whether the dataset is loaded.
+    """
+    fn = os.path.join(self.data_folder, BUNDLE)
+    if not self.use_bundle or not os.path.exists(fn):
+      return False
+
+    try:
+      store = Store(fn)
+      meta = store.get_json('meta')
+    except (OSError, ValueError, KeyError):
+      print_warn(f'Ignoring the unreadable bundle {fn}')
+      return False
+    if meta.get('version') != BUNDLE_VERSION:
+      print_warn(f'Ignoring the bundle {fn} from another version')
+      return False
+    now = self._sources(list(meta['sources']))
+    for f, sig in meta['sources'].items():
+      if now[f] != sig:
+        print_warn(f'Ignoring the bundle {fn}, as {f} has changed')
+        return False
+
+    self.files = meta['files']
+    self.schema = meta['schema']
+    self.decisions = meta['decisions']
+    self.visualizer = meta['visualizer']
+    self.sensitivity = store.get_json('sensitivity')
+    self.summary = store.get_frame('frame')
+    self.store = store
+    return True
+
+
+  def _read_meta(self):
+    """ Read overview.json, verify, and store the meta data. """
+    fn = os.path.join(self.data_folder, 'overview.json')
+    err, res = read_json(fn)
+    if (err):
+      raise DatasetError(err['message'])
+
+    # check summary.csv
+    _check_path(os.path.join(self.data_folder, 'summary.csv'))
+
+    # check file definition
+    vis = read_key_safe(res, ['visualizer'], {})
+    fs = read_key_safe(vis, ['files'], [])
+    lookup = {}
+    prefix = 'In parsing visualizer.files in overview.json:\n'
+    for f in fs:
+      _check_required_field(f, 'id', prefix)
+      _check_required_field(f, 'path', prefix)
+      f['multi'] = read_key_safe(f, ['multi'], False)
+      lookup[f['id']] = f
+
+    # read schema and join file
+    schema = read_key_safe(vis, ['schema'], {})
+    prefix = 'In parsing visualizer.schema in overview.json:\n'
+    _check_required_field(schema, 'point_estimate', prefix)
+    for key in schema:
+      s = schema[key]
+      _check_required_field(s, 'file', prefix)
+      # check_required_field(s, 'field', prefix)
+      # todo: verify if file is valid CSV and if field exist in file
+      fid = s['file']
+      if fid not in lookup:
+        msg = 'In parsing visualizer.schema in overview.json:\n'
+        msg += '{}\n'.format(s)
+        msg += 'Error: file id "{}" is not defined.'.format(fid)
+        raise DatasetError(msg)
+      s['file'] = lookup[fid]['path']
+      s['multi'] = lookup[fid]['multi']
+      s['name'] = key
+
+    # check sensitivity flag
+    sen = read_key_safe(vis, ['sensitivity'], 'ad')
+    if sen not in ('f', 'ks', 'ad'):
+      msg = f'Invalid sensitivity flag "{sen}". Available values:\n'
+      msg += ' - "f": algorithm based on the F-test\n'
+      msg += ' - "ks": algorithm based on Kolmogorov–Smirnov statistic'
+      msg += ' - "ad": k-samples Anderson-Darling test'
+      raise DatasetError(msg)
+
+    # store meta data
+    self.files = fs
+    self.schema = schema
+    self.decisions = read_key_safe(res, ['decisions'], {})
+    self.visualizer = {
+      "sensitivity": sen,
+      "labels": read_key_safe(vis, ['labels'], {}),
+      "graph": read_key_safe(res, ['graph'], {})
+    }
+    self.summary = _read_summary(self.data_folder)
+
+
+  def _check_result_files(self):
+    """ check if result files exists """
+    for f in self.files:
+      if not f['multi']:
+        _check_path(os.path.join(self.data_folder, f['path']))
+
+
+  def _cal_sensitivity(self):
+    """ compute sensitivity and write scores to file """
+    import bobaserver.common as common
+    self.sensitivity = common.cal_sensitivity()
+    d = {'method': self.visualizer['sensitivity'], 'scores': self.sensitivity}
+    write_json(d, os.path.join(self.data_folder, 'sensitivity.json'),
+      nice=True)
+
+
+class _Activation:
+  def __init__(self, dataset):
+    self.dataset = dataset
+    self.token = None
+
+  def __enter__(self):
+    self.token = _active.set(self.dataset)
+    return self.dataset
+
+  def __exit__(self, *args):
+    _active.reset(self.token)
+
+
+def _cache_deps(key, schema):
+  """
+  The files a cached result is derived from, relative to the data folder,
+  or None if unknown. Results read from per-universe files depend on none
+  of the watched files.
+  """
+  results = set([s['file'] for s in schema.values() if not s['multi']])
+  if key == 'get_universes':
+    return {'summary.csv'}
+  if key == 'get_pred':
+    return results
+  if key.startswith('sensitivity_matrix_'):
+    return {'summary.csv'} | results
+  if key in ('index', 'subset'):
+    return {'summary.csv', schema['point_estimate']['file']}
+  if key.startswith('raw_'):
+    return set()
+  for prefix in ('lod_', 'get_'):
+    field = key[len(prefix):]
+    if key.startswith(prefix) and field in schema:
+      return {schema[field]['file']}
+  return None
+
+
+class DatasetWatcher:
+  """
+  Watch the files of a dataset, and when they change, build a refreshed
+  dataset in the background and hand it to a swap function.
+  """
+
+  def __init__(self, dataset, swap):
+    """
+    Parameters:
+     - dataset: the dataset to watch
+     - swap: called with the refreshed dataset, to replace the old one
+    """
+    self.dataset = dataset
+    self.swap = swap
+    self.watcher = None
+    self.seen = {}
+
+
+  def _signatures(self):
+    ds = self.dataset
+    res = {}
+    for f in ds.watched_files():
+      p = os.path.join(ds.data_folder, f)
+      try:
+        st = os.stat(p)
+        res[p] = (st.st_mtime_ns, st.st_size)
+      except OSError:
+        res[p] = None
+    return res
+
+
+  def start(self):
+    self.seen = self._signatures()
+    self.watcher = FileWatcher(list(self.seen.keys()), self.on_change)
+    self.watcher.start()
+
+
+  def stop(self):
+    if self.watcher is not None:
+      self.watcher.stop()
+
+
+  def on_change(self, changed):
+    # skip events of files that are as they were at the last load
+    now = self._signatures()
+    changed = [p for p in changed if now.get(p) != self.seen.get(p)]
+    if not len(changed):
+      return
+
+    t = perf_counter()
+    try:
+      new = self.dataset.refresh(changed)
+    except (DatasetError, OSError, ValueError, KeyError) as e:
+      # such as a file caught in the middle of a write; the next write
+      # triggers another try
+      print_warn(f'Keeping the previous data of {self.dataset.data_folder}, '
+        + f'as reloading failed: {e}')
+      return
+
+    files = set(new.watched_files()) != set(self.dataset.watched_files())
+    self.dataset = new
+    self.seen = now
+    self.swap(new)
+    names = ', '.join(sorted([os.path.basename(p) for p in changed]))
+    print_warn(f'Reloaded {new.data_folder} after {names} changed, in ' +
+      f'{perf_counter() - t:.2f}s')
+    if files:
+      # overview.json lists other files now
+      self.stop()
+      self.start()
+
+
+def _check_path(p):
+  if not os.path.exists(p):
+    raise DatasetError('Error: {} does not exist.'.format(p))
+
+
+def _check_required_field(obj, key, prefix=''):
+  if key not in obj:
+    err = 'Error: cannot find required field "{}" in {}'.format(key, obj)
+    raise DatasetError(prefix + err)
+
+
+def _read_summary(folder):
+  fn = os.path.join(folder, 'summary.csv')
+  with timed('parse'):
+    smr = pd.read_csv(fn, na_filter=False)
+  smr['uid'] = smr.apply(lambda r: r.name + 1, axis=1).astype(int)
+  return smr
+
+
+def get_current():
+  """
+  The dataset activated in this context, or the dataset of the current
+  request, or the default dataset of the app.
+  """
+  ds = _active.get()
+  if ds is not None:
+    return ds
+  if has_request_context() and 'dataset' in g:
+    return g.dataset
+  return bobaserver.app.dataset
+
+current = LocalProxy(get_current)
+
+
+class DatasetRegistry:
+  """
+  Datasets served under /d/<name>/. They are loaded on first use, and the
+  least recently used ones are unloaded when the total memory exceeds the
+  budget.
+  """
+
+  def __init__(self, budget=0):
+    """
+    Parameters:
+     - budget: memory budget in bytes, or 0 for no limit
+    """
+    self.budget = budget
+    self.datasets = OrderedDict()
+    self.lock = threading.Lock()
+
+
+  def add(self, dataset):
+    with self.lock:
+      self.datasets[dataset.name] = dataset
+
+
+  def names(self):
+    return list(self.datasets.keys())
+
+
+  def get(self, name):
+    """ Return the loaded dataset, or None if the name is unknown. """
+    with self.lock:
+      ds = self.datasets.get(name)
+      if ds is None:
+        return None
+      self.datasets.move_to_end(name)
+
+    ds.load()
+    self.evict(keep=ds)
+    return ds
+
+
+  def nbytes(self):
+    return sum([ds.nbytes() for ds in list(self.datasets.values())])
+
+
+  def evict(self, keep=None):
+    """ Unload least recently used datasets until we are within budget. """
+    if not self.budget:
+      return
+
+    with self.lock:
+      total = self.nbytes()
+      for ds in list(self.datasets.values()):
+        if total <= self.budget:
+          break
+        if ds is not keep and ds.is_loaded():
+          total -= ds.nbytes()
+          ds.unload()
+
+
+def register_prefix_routes(app):
+  """
+  Serve every visualizer route also under /d/<dataset>/, so one server can
+  host many data folders. Monitor routes only apply to the default dataset.
+  """
+  app.url_value_preprocessor(pull_dataset)
+  app.before_request(pin_dataset)
+
+  rules = [r for r in app.url_map.iter_rules() if r.rule.startswith('/api/')
+    and not r.rule.startswith('/api/monitor/')
+    and r.rule not in ('/api/metrics', '/api/profiles')]
+  for r in rules:
+    app.add_url_rule('/d/<dataset>' + r.rule, r.endpoint,
+      methods=r.methods)
+
+  app.add_url_rule('/d/<dataset>/', 'index')
+  app.add_url_rule('/d/<dataset>/<path:filename>', 'static')
+
+
+def pull_dataset(endpoint, values):
+  if values is None or 'dataset' not in values:
+    return
+  name = values.pop('dataset')
+  # this runs before the request timer, and may load the dataset, so start
+  # the clock here to count the load in the total
+  g.setdefault('start_time', perf_counter())
+  if endpoint != 'static':
+    ds = bobaserver.app.datasets.get(name)
+    if ds is None:
+      raise DatasetError(f'Error: dataset "{name}" does not exist.')
+    g.dataset = ds
+
+
+def pin_dataset():
+  # pin the default dataset for the whole request, even if it is swapped
+  app = bobaserver.app
+  if 'dataset' not in g and hasattr(app, 'dataset'):
+    g.dataset = app.dataset
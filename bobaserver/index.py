@@ -0,0 +1,145 @@
+# a bitmap index of decision options, to aggregate subsets of universes
+
+import numpy as np
+
+# number of set bits in each byte, for numpy without bitwise_count
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def popcount(bits):
+  """ Count the set bits in a packed uint8 array """
+  if hasattr(np, 'bitwise_count'):
+    return int(np.bitwise_count(bits).sum(dtype=np.int64))
+  return int(_POPCOUNT[bits].sum(dtype=np.int64))
+
+
+class DecisionIndex:
+  """
+  One bitset per (decision, option) over the rows of summary.csv, along with
+  the point estimate of each row. A filter picks options per decision; rows
+  must match one of the options (OR) of every filtered decision (AND).
+  """
+
+  def __init__(self, summary, decisions, estimates):
+    """
+    Parameters:
+     - summary: the summary table, one row per universe
+     - decisions: a list of {'var': name, 'options': [...]}
+     - estimates: the point estimate of each row, NaN if missing
+    """
+    self.size = summary.shape[0]
+    self.estimates = np.asarray(estimates, dtype=float)
+    self.valid = np.packbits(np.isfinite(self.estimates))
+    self.all = np.packbits(np.ones(self.size, dtype=bool))
+    self.decisions = []
+    self.bits = {}
+    for d in decisions:
+      col = summary[d['var']].astype(str).to_numpy()
+      opts = [str(o) for o in d['options']]
+      self.decisions.append((d['var'], opts))
+      self.bits[d['var']] = {o: np.packbits(col == o) for o in opts}
+
+    # estimate range of the whole multiverse, so histograms of different
+    # subsets share their bins
+    est = self.estimates[np.isfinite(self.estimates)]
+    self.range = (float(est.min()), float(est.max())) if len(est) else (0, 1)
+
+
+  def save(self, writer, prefix):
+    """ Write the index into a store """
+    writer.add_json(f'{prefix}/meta', {'size': self.size,
+      'range': list(self.range), 'decisions': self.decisions})
+    writer.add(f'{prefix}/estimates', self.estimates)
+    for i, (dec, opts) in enumerate(self.decisions):
+      for j, o in enumerate(opts):
+        writer.add(f'{prefix}/bits/{i}/{j}', self.bits[dec][o])
+
+
+  @classmethod
+  def load(cls, store, prefix):
+    """ Read an index from a store, without copying the bitsets """
+    meta = store.get_json(f'{prefix}/meta')
+    index = cls.__new__(cls)
+    index.size = meta['size']
+    index.range = tuple(meta['range'])
+    index.decisions = [(dec, opts) for dec, opts in meta['decisions']]
+    index.estimates = store.get(f'{prefix}/estimates')
+    index.valid = np.packbits(np.isfinite(index.estimates))
+    index.all = np.packbits(np.ones(index.size, dtype=bool))
+    index.bits = {dec: {o: store.get(f'{prefix}/bits/{i}/{j}')
+      for j, o in enumerate(opts)}
+      for i, (dec, opts) in enumerate(index.decisions)}
+    return index
+
+
+  def nbytes(self):
+    n = self.estimates.nbytes + self.valid.nbytes + self.all.nbytes
+    return n + sum([b.nbytes for d in self.bits.values() for b in d.values()])
+
+
+  def select(self, filters):
+    """
+    Return the packed bitset of rows matching the filters, a dict from
+    decision name to a list of options. Raises KeyError on an unknown
+    decision or option.
+    """
+    res = self.all.copy()
+    for dec, opts in filters.items():
+      lookup = self.bits[dec]
+      if not len(opts):
+        continue
+      sub = np.zeros_like(res)
+      for o in opts:
+        sub |= lookup[str(o)]
+      res &= sub
+    return res
+
+
+  def mask(self, bits):
+    return np.unpackbits(bits, count=self.size).astype(bool)
+
+
+  def aggregate(self, filters, bins=20, bounds=None):
+    """
+    Aggregate the point estimates of the rows matching the filters, in a
+    histogram with the given number of bins between bounds (lo, hi), by
+    default the range of the whole multiverse. Raises ValueError if the
+    bounds are not finite or lo is not below hi.
+
+    Returns: a dict with the number of matching rows, the number with a
+      valid estimate, their mean, a histogram, and the count and mean of each
+      option of each decision within the matching rows
+    """
+    if bounds is not None:
+      lo, hi = bounds
+      if not (np.isfinite(lo) and np.isfinite(hi) and lo < hi):
+        raise ValueError('Expecting a finite range [min, max] with min < max')
+    else:
+      lo, hi = self.range
+
+    bits = self.select(filters)
+    valid = bits & self.valid
+    m = self.mask(valid)
+    est = self.estimates[m]
+
+    counts, edges = np.histogram(est, bins=bins, range=(lo, hi))
+    width = edges[1] - edges[0]
+    density = counts / (len(est) * width) if len(est) and width > 0 \
+      else np.zeros(bins)
+
+    decs = []
+    for dec, opts in self.decisions:
+      res = []
+      for o in opts:
+        sub = valid & self.bits[dec][o]
+        n = popcount(sub)
+        mean = float(self.estimates[self.mask(sub)].mean()) if n else None
+        res.append({'option': o, 'count': popcount(bits & self.bits[dec][o]),
+          'valid': n, 'mean': mean})
+      decs.append({'var': dec, 'options': res})
+
+    return {'total': self.size, 'count': popcount(bits), 'valid': len(est),
+      'mean': float(est.mean()) if len(est) else None,
+      'histogram': {'edges': edges.tolist(), 'counts': counts.tolist(),
+        'density': density.tolist()},
+      'decisions': decs}
@@ -0,0 +1,111 @@
+# level-of-detail summaries of per-universe sample distributions
+
+import numpy as np
+
+# quantiles per universe at each level of detail
+LEVELS = (16, 64, 256)
+# bins of the fixed-bin histograms
+BINS = 32
+
+
+class LevelOfDetail:
+  """
+  Summaries of many samples per universe, such as the uncertainty draws or
+  the null distribution: quantiles at a few resolutions, and histograms over
+  bins shared by all universes. A universe with fewer samples than a
+  resolution gets as many quantiles as it has samples. The quantiles include
+  the minimum and the maximum, so the extremes of a distribution are kept.
+  """
+
+  def __init__(self, uids, values, levels=LEVELS, bins=BINS):
+    """
+    Parameters:
+     - uids: the universe of each sample
+     - values: the samples, as numbers; NaN and Inf are dropped
+     - levels: the number of quantiles per universe at each resolution
+     - bins: the number of histogram bins
+    """
+    uids = np.asarray(uids)
+    values = np.asarray(values, dtype=float)
+    ok = np.isfinite(values)
+    uids, values = uids[ok], values[ok]
+
+    # sort by universe, then by value
+    order = np.lexsort((values, uids))
+    uids, values = uids[order], values[order]
+    self.uids, starts, self.counts = np.unique(uids, return_index=True,
+      return_counts=True)
+
+    self.quantiles = {}
+    for m in levels:
+      self.quantiles[m] = _quantiles(values, starts, self.counts, m)
+
+    lo, hi = (values.min(), values.max()) if len(values) else (0, 1)
+    self.edges = np.linspace(lo, hi, bins + 1)
+    group = np.repeat(np.arange(len(self.uids)), self.counts)
+    b = np.clip(np.searchsorted(self.edges, values, side='right') - 1, 0,
+      bins - 1)
+    self.histograms = np.bincount(group * bins + b,
+      minlength=len(self.uids) * bins).reshape(len(self.uids), bins)
+
+
+  def save(self, writer, prefix):
+    """ Write the summaries into a store """
+    writer.add_json(f'{prefix}/levels', sorted(self.quantiles.keys()))
+    writer.add(f'{prefix}/uids', self.uids)
+    writer.add(f'{prefix}/counts', self.counts)
+    writer.add(f'{prefix}/edges', self.edges)
+    writer.add(f'{prefix}/histograms', self.histograms)
+    for m, q in self.quantiles.items():
+      writer.add(f'{prefix}/quantiles/{m}', q)
+
+
+  @classmethod
+  def load(cls, store, prefix):
+    """ Read the summaries from a store, without copying """
+    lod = cls.__new__(cls)
+    lod.uids = store.get(f'{prefix}/uids')
+    lod.counts = store.get(f'{prefix}/counts')
+    lod.edges = store.get(f'{prefix}/edges')
+    lod.histograms = store.get(f'{prefix}/histograms')
+    lod.quantiles = {m: store.get(f'{prefix}/quantiles/{m}')
+      for m in store.get_json(f'{prefix}/levels')}
+    return lod
+
+
+  def nbytes(self):
+    n = self.uids.nbytes + self.counts.nbytes + self.histograms.nbytes
+    return n + sum([q.nbytes for q in self.quantiles.values()])
+
+
+  def level(self, resolution):
+    """ The smallest level with at least `resolution` quantiles """
+    levels = sorted(self.quantiles.keys())
+    for m in levels:
+      if m >= resolution:
+        return m
+    return levels[-1]
+
+
+  def rows(self, resolution):
+    """ The quantiles at a level, as [uid, value] rows """
+    q = self.quantiles[self.level(resolution)]
+    i, j = np.nonzero(~np.isnan(q))
+    return [list(r) for r in zip(self.uids[i].tolist(), q[i, j].tolist())]
+
+
+def _quantiles(values, starts, counts, m):
+  # m evenly spaced quantiles of each sorted group from its minimum to its
+  # maximum, or all its samples if it has no more than m, padded with NaN
+  c = counts[:, None]
+  k = np.minimum(c, m)
+  i = np.arange(m)[None, :]
+  pos = np.where(c <= m, i, i / max(m - 1, 1) * (c - 1))
+  lo = np.floor(pos).astype(int)
+  hi = np.minimum(lo + 1, c - 1)
+  frac = pos - lo
+  base = starts[:, None]
+  lo = np.minimum(lo, c - 1)
+  q = values[base + lo] * (1 - frac) + values[base + hi] * frac
+  q[np.broadcast_to(i >= k, q.shape)] = np.nan
+  return q
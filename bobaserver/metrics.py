@@ -0,0 +1,133 @@
+# latency histograms, exposed in the Prometheus text format
+
+import math
+import functools
+import threading
+from time import perf_counter
+from contextlib import contextmanager
+import flask
+from flask import g, has_request_context
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5,
+  10, 30, 60, math.inf)
+SIZE_BUCKETS = (1e2, 1e3, 1e4, 1e5, 1e6, 1e7, 1e8, math.inf)
+
+
+class Histogram:
+  """ A Prometheus-style histogram with labels """
+
+  def __init__(self, name, doc, labels=(), buckets=LATENCY_BUCKETS):
+    self.name = name
+    self.doc = doc
+    self.labels = tuple(labels)
+    self.buckets = tuple(buckets)
+    self.values = {}  # label values -> [bucket counts, sum, count]
+    self.lock = threading.Lock()
+
+
+  def observe(self, value, **labels):
+    key = tuple([str(labels.get(k, '')) for k in self.labels])
+    with self.lock:
+      if key not in self.values:
+        self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+      v = self.values[key]
+      for i, b in enumerate(self.buckets):
+        if value <= b:
+          v[0][i] += 1
+      v[1] += value
+      v[2] += 1
+
+
+  def render(self):
+    lines = [f'# HELP {self.name} {self.doc}', f'# TYPE {self.name} histogram']
+    with self.lock:
+      items = sorted(self.values.items())
+    for key, (counts, total, n) in items:
+      lb = ','.join([f'{k}="{_escape(v)}"' for k, v in zip(self.labels, key)])
+      sep = ',' if lb else ''
+      for b, c in zip(self.buckets, counts):
+        le = '+Inf' if math.isinf(b) else repr(float(b))
+        lines.append(f'{self.name}_bucket{{{lb}{sep}le="{le}"}} {c}')
+      lines.append(f'{self.name}_sum{{{lb}}} {total}')
+      lines.append(f'{self.name}_count{{{lb}}} {n}')
+    return '\n'.join(lines)
+
+
+def _escape(v):
+  return v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Registry:
+  def __init__(self):
+    self.metrics = []
+
+  def histogram(self, *args, **kwargs):
+    h = Histogram(*args, **kwargs)
+    self.metrics.append(h)
+    return h
+
+  def render(self):
+    return '\n'.join([m.render() for m in self.metrics]) + '\n'
+
+
+registry = Registry()
+request_seconds = registry.histogram('boba_request_seconds',
+  'Latency of HTTP requests', ['endpoint', 'status'])
+response_bytes = registry.histogram('boba_response_bytes',
+  'Size of HTTP response bodies', ['endpoint'], SIZE_BUCKETS)
+phase_seconds = registry.histogram('boba_phase_seconds',
+  'Time spent parsing CSV, computing and serializing', ['phase'])
+kernel_seconds = registry.histogram('boba_kernel_seconds',
+  'Duration of the statistical routines', ['kernel'])
+job_seconds = registry.histogram('boba_job_seconds',
+  'Duration of scheduler jobs', ['job', 'status'])
+startup_seconds = registry.histogram('boba_startup_seconds',
+  'Duration of the server startup phases', ['phase'])
+
+
+@contextmanager
+def timed(phase, kernel=None):
+  """
+  Time a block as one of the phases "parse", "compute" or "serialize", and
+  optionally as a named statistical kernel. Inside a request, the time is
+  also reported in the Server-Timing header.
+  """
+  t = perf_counter()
+  try:
+    yield
+  finally:
+    d = perf_counter() - t
+    phase_seconds.observe(d, phase=phase)
+    if kernel is not None:
+      kernel_seconds.observe(d, kernel=kernel)
+    if has_request_context():
+      timings = g.setdefault('timings', {})
+      timings[phase] = timings.get(phase, 0) + d
+
+
+def jsonify(*args, **kwargs):
+  """ flask.jsonify, timed as serialization """
+  with timed('serialize'):
+    return flask.jsonify(*args, **kwargs)
+
+
+def timed_job(name, func):
+  """ Wrap a scheduler job so its duration is recorded """
+  @functools.wraps(func)
+  def wrapper(*args, **kwargs):
+    t = perf_counter()
+    status = 'error'
+    try:
+      res = func(*args, **kwargs)
+      status = 'ok'
+      return res
+    finally:
+      job_seconds.observe(perf_counter() - t, job=name, status=status)
+  return wrapper
+
+
+def server_timing(total):
+  """ The Server-Timing header value of the current request """
+  timings = g.get('timings', {})
+  items = [f'{k};dur={v * 1000:.2f}' for k, v in timings.items()]
+  return ', '.join(items + [f'total;dur={total * 1000:.2f}'])
@@ -2,57 +2,123 @@
 
 import os
 import time
+import threading
 import pandas as pd
 import numpy as np
-from flask import jsonify, request
+from flask import request
+from flask_socketio import SocketIO
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.events import EVENT_JOB_EXECUTED, EVENT_JOB_ERROR
 from .util import read_csv, read_json, write_json
-from bobaserver import app, socketio, scheduler
+from .checkpoint import CheckpointLog, read_log, to_rows
+from .watch import FileWatcher
+from .serving import heavy
+from .metrics import jsonify, timed, timed_job
+from .profiling import profiled_job
+from .dataset import current
+from bobaserver import app
 from bobaserver.bobastats import sampling, sensitivity
+from bobaserver.bobastats.accumulator import OptionStats, decision_codes
+from bobaserver.bobastats.memo import BootstrapCache
+from bobaserver.bobastats.estimators import ESTIMATORS, round_robin_strata
 import bobaserver.common as common
 
+socketio = SocketIO(app)
+scheduler = BackgroundScheduler()
+
+
+def job(name, func):
+  # a scheduler job, timed and optionally profiled
+  return timed_job(name, profiled_job(name, func))
+
+
+def get_shards():
+  # the ShardSet of a run split across folders, or None
+  return getattr(app, 'shards', None)
+
 
 class BobaWatcher:
   # static attributes
   header_outcome = ['n_samples', 'mean', 'lower', 'upper']
 
-  def __init__(self, order, weights=None):
+  def __init__(self, order, weights=None, seed=None, estimator='bootstrap'):
     self.start_time = None
     self.prev_time = 0  # for resume
+    self.file_watcher = None
 
     # sampling order and weights
     self.order = [uid - 1 for uid in order]  # convert to 0-indexed
     self.weights = weights
 
+    # the bootstrap is seeded, so a resumed run can reuse cached results
+    self.seed = int(np.random.randint(2**31)) if seed is None else seed
+    self.bootstrap_cache = BootstrapCache(BobaWatcher.get_dir_cache())
+
+    # how the outcome CI is computed, one of ESTIMATORS
+    self.estimator = estimator
+
     # results
     self.last_merge_index = 0
     self.outcomes = []
     self.decision_scores = []
 
+    # per-option outcome statistics, the uids added to them, and the option
+    # codes and row of every universe
+    self.option_stats = None
+    self.accumulated = set()
+    self.codes = None
+    self.rows = None
+
+    # binary checkpoint logs
+    self.log_outcome = CheckpointLog(BobaWatcher.get_fn_outcome_log(),
+      BobaWatcher.get_fields_outcome())
+    self.log_sensitivity = CheckpointLog(
+      BobaWatcher.get_fn_sensitivity_log(),
+      BobaWatcher.get_fields_sensitivity())
+
 
   @staticmethod
   def get_fn_outcome():
     return os.path.join(app.bobarun.dir_log, 'outcomes.csv')
   @staticmethod
+  def get_fn_outcome_log():
+    return os.path.join(app.bobarun.dir_log, 'outcomes.bin')
+  @staticmethod
   def get_fn_save():
     return os.path.join(app.bobarun.dir_log, 'execution_plan.json')
   @staticmethod
+  def get_dir_cache():
+    return os.path.join(app.bobarun.dir_log, 'bootstrap_cache')
+  @staticmethod
   def get_fn_sensitivity():
     return os.path.join(app.bobarun.dir_log, 'sensitivity.csv')
   @staticmethod
+  def get_fn_sensitivity_log():
+    return os.path.join(app.bobarun.dir_log, 'sensitivity.bin')
+  @staticmethod
   def get_header_sensitivity():
     return ['n_samples', 'type'] + common.get_decision_list()
+  @staticmethod
+  def get_fields_outcome():
+    return [('n_samples', '<i8')] + \
+      [(h, '<f8') for h in BobaWatcher.header_outcome[1:]]
+  @staticmethod
+  def get_fields_sensitivity():
+    return [('n_samples', '<i8'), ('type', 'S8')] + \
+      [(d, '<f8') for d in common.get_decision_list()]
 
 
-  def _append_csv(self, fn, header, data):
-    # append to the csv if it exists, or create one
-    if os.path.exists(fn):
-      f = open(fn, 'a')
-    else:
-      f = open(fn, 'w')
-      f.write(','.join(header) + '\n')
-    for r in data:
-      f.write(','.join([str(i) for i in r]) + '\n')
-    f.close()
+  def _append_sensitivity(self, data):
+    # the type column is stored as bytes and NaN strings as float NaN
+    rows = [[r[0], r[1].encode('utf-8')] + [float(v) for v in r[2:]] \
+      for r in data]
+    self.log_sensitivity.append(rows)
+
+
+  def flush(self):
+    # write any buffered checkpoint records to disk
+    self.log_outcome.flush()
+    self.log_sensitivity.flush()
 
 
   def _impute_null_CI(self, data, previous, col=0):
@@ -74,7 +140,9 @@ class BobaWatcher:
 
   def _compute_dec_CI(self, df, col, indices, dec_list, i):
     """ Compute bootstrap CI of decision sensitivity """
-    res = sampling.bootstrap_sensitivity(df, col, indices, dec_list)
+    with timed('compute', 'bootstrap_sensitivity'):
+      res = sampling.bootstrap_sensitivity(df, col, indices, dec_list,
+        seed=self.seed, cache=self.bootstrap_cache)
     out = [[i, c] + res[f'score_{c}'].tolist() for c in ['lower', 'upper']]
 
     # convert NaN to string
@@ -82,25 +150,76 @@ class BobaWatcher:
     self.decision_scores += out
 
     # write results to disk
-    self._append_csv(BobaWatcher.get_fn_sensitivity(),
-      BobaWatcher.get_header_sensitivity(), out)
+    self._append_sensitivity(out)
+    if not app.bobarun.is_running():
+      self.flush()
 
     # send to client
     socketio.emit('update-sensitivity', {'data': self.decision_scores,
       'header': BobaWatcher.get_header_sensitivity()})
 
 
+  def _update_option_stats(self, df, col, done):
+    # add the universes finished since the last update, each once; one
+    # without a result yet is added once its result is merged
+    if self.option_stats is None:
+      self.option_stats = OptionStats(current.decisions)
+      self.codes = decision_codes(df, current.decisions)
+      self.rows = dict(zip(df['uid'].tolist(), range(df.shape[0])))
+    values = pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=float)
+    with timed('compute', 'option_stats'):
+      for uid, code in done:
+        uid = int(uid)
+        i = self.rows.get(uid)
+        if uid in self.accumulated or i is None:
+          continue
+        if np.isfinite(values[i]) or code != 0:
+          self.option_stats.add(self.codes[i], values[i])
+          self.accumulated.add(uid)
+
+
+  def get_f_sensitivity(self):
+    # live F-test sensitivity and per-option statistics, or None
+    if self.option_stats is None:
+      return None
+    return self.option_stats.summary()
+
+
+  def _sample(self, df, done):
+    """
+    The sample order and weights. Shards do not follow our sampling order,
+    so with shards the sample is the universes done, in the order they
+    finished, without importance weights.
+    """
+    if get_shards() is None:
+      return self.order, self.weights
+    rows = pd.Series(np.arange(df.shape[0]), index=df['uid'])
+    order = rows.reindex([d[0] for d in done]).dropna().astype(int).tolist()
+    return order, None
+
+
   def update_outcome(self, done):
     step = min(5, max(1, int(app.bobarun.size / 50)))
     if len(done) - self.last_merge_index <= step:
       return
 
     # merge result file
-    app.bobarun.run_after_execute()
-    df = common.read_results('point_estimate', float)
-    df = pd.merge(app.summary, df, on='uid', how='left')
     col = common.get_field_name('point_estimate')
+    shards = get_shards()
+    if shards is None:
+      app.bobarun.run_after_execute()
+      df = common.read_results('point_estimate', float)
+    else:
+      df = shards.read_results(['point_estimate'])
+      if df is None:
+        return
+      df = df.rename(columns={'point_estimate': col})
+    df = pd.merge(common.read_summary(), df, on='uid', how='left')
     dec_list = common.get_decision_list()
+    order, weights = self._sample(df, done)
+    self._update_option_stats(df, col, done)
+    strata = round_robin_strata(self.codes) \
+      if self.estimator == 'stratified' else None
 
     # compute results since the last index
     start = (int(self.last_merge_index / step) + 1) * step
@@ -109,22 +228,26 @@ class BobaWatcher:
     sen = []
     indices = None
     for i in range(start, len(done), step):
-      indices = self.order[:i+1]
+      indices = order[:i+1]
 
       # outcome mean
-      out = sampling.bootstrap_outcome(df, col, indices, self.weights)
+      with timed('compute', f'{self.estimator}_outcome'):
+        out = sampling.estimate_outcome(df, col, indices, weights,
+          self.estimator, strata, seed=self.seed, cache=self.bootstrap_cache)
       res.append([i] + out)
 
       # decision sensitivity, without CI
       # FIXME: hard coded for AD test
-      ad = [sensitivity.ad_wrapper(df.iloc[indices], dec, col) \
-        for dec in dec_list]
+      with timed('compute', 'ad_wrapper'):
+        ad = [sensitivity.ad_wrapper(df.iloc[indices], dec, col) \
+          for dec in dec_list]
       sen.append([i, 'score'] + [s[0] for s in ad])
       sen.append([i, 'p'] + [s[1] for s in ad])
 
     # schedule a job to compute the decision CI, for the last index
     if (not scheduler.get_job('compute_CI')) and (indices is not None):
-      scheduler.add_job(self._compute_dec_CI, id='compute_CI', 
+      scheduler.add_job(job('compute_CI', self._compute_dec_CI),
+        id='compute_CI',
         args=[df, col, indices, dec_list, i])
 
     # impute null in CI and remove null in mean
@@ -137,54 +260,89 @@ class BobaWatcher:
     self.decision_scores += sen
 
     # write results to disk
-    self._append_csv(BobaWatcher.get_fn_outcome(), self.header_outcome, res)
-    self._append_csv(BobaWatcher.get_fn_sensitivity(),
-      BobaWatcher.get_header_sensitivity(), sen)
+    self.log_outcome.append(res)
+    self._append_sensitivity(sen)
+    if not app.bobarun.is_running():
+      self.flush()
 
     # send to client
     socketio.emit('update-outcome', {'data': self.outcomes, 
       'header': self.header_outcome})
     socketio.emit('update-sensitivity', {'data': self.decision_scores,
       'header': BobaWatcher.get_header_sensitivity()})
-
-
-  def check_progress(self):
-    # remove self from scheduled jobs if boba run has finished
-    if not app.bobarun.is_running():
-      scheduler.remove_job('watcher')
-    print('check progress')
-
-    # estimate remaining time
-    logs = app.bobarun.exit_code
-    done = max(1, len(logs)) # avoid division by 0
-    elapsed = self.get_elapsed()
-    remain = app.bobarun.size - done
-    remain = int(elapsed * remain / done)
+    socketio.emit('update-f-sensitivity', self.get_f_sensitivity())
+
+
+  def check_progress(self, final=False):
+    """
+    Send the progress to the client. final is true when the scheduler
+    reports that boba run has finished or stopped.
+    """
+    shards = get_shards()
+    if shards is None:
+      running = app.bobarun.is_running()
+
+      # estimate remaining time
+      logs = app.bobarun.exit_code
+      done = max(1, len(logs)) # avoid division by 0
+      elapsed = self.get_elapsed()
+      remain = app.bobarun.size - done
+      remain = int(elapsed * remain / done)
+    else:
+      # read the shards in parallel; the slowest one decides the time left
+      logs = shards.poll()
+      running = app.bobarun.is_running() or shards.is_running()
+      remain = shards.time_left()
+
+    # stop watching the log once boba run has finished. We wait for the
+    # scheduler to tell us, as the log may change before the run starts.
+    # Shards run on their own, so we wait until all of them have finished.
+    finished = final if shards is None else \
+      not app.bobarun.is_running() and shards.is_finished()
+    if finished and self.file_watcher is not None:
+      self.file_watcher.stop()
 
     # schedule jobs to compute results
     if not scheduler.get_job('update_outcome'):
-      scheduler.add_job(self.update_outcome, args=[logs], id='update_outcome')
+      scheduler.add_job(job('update_outcome', self.update_outcome),
+        args=[logs], id='update_outcome')
 
     res = {'status': 'success',
       'logs': logs,
       'time_left': remain,
-      'is_running': app.bobarun.is_running()}
+      'is_running': running}
+    if shards is not None:
+      res['shards'] = shards.status()
 
     socketio.emit('update', res)
 
 
   def stop(self):
-    # stop timer
+    # stop timer and file watcher
+    if self.file_watcher is not None:
+      self.file_watcher.stop()
     t = 0 if self.start_time is None else time.time() - self.start_time
     self.prev_time += t
     self.start_time = None
+    self.flush()
 
 
   def start(self):
-    # start timer and add job
+    # start timer, and check progress whenever the run log changes
     self.start_time = time.time()
-    scheduler.add_job(self.check_progress, 'interval', seconds=5,
-      id='watcher', replace_existing=True)
+    self.watch()
+
+
+  def watch(self):
+    # (re)start checking progress whenever a run log changes
+    if self.file_watcher is not None:
+      self.file_watcher.stop()
+    files = [app.bobarun.file_log]
+    if get_shards() is not None:
+      files += get_shards().files()
+    self.file_watcher = FileWatcher(files,
+      lambda changed: self.check_progress())
+    self.file_watcher.start()
 
 
   def get_elapsed(self):
@@ -194,7 +352,8 @@ class BobaWatcher:
 
   def save_to_file(self):
     # save data to file, so it is possible to resume later
-    data = {'order': list(self.order), 'elapsed': self.get_elapsed()}
+    data = {'order': list(self.order), 'elapsed': self.get_elapsed(),
+      'seed': self.seed, 'estimator': self.estimator}
     if self.weights is not None:
       data['weights'] = list(self.weights)
     write_json(data, self.get_fn_save())
@@ -207,36 +366,65 @@ class BobaWatcher:
       self.order = data['order']
       self.weights = np.asarray(data['weights']) if 'weights' in data else None
       self.prev_time = data['elapsed']
-
-    # read outcome and sensitivity progress
-    fn = BobaWatcher.get_fn_outcome()
-    if os.path.exists(fn):
-      df = pd.read_csv(fn)
+      self.seed = data.get('seed', self.seed)
+      self.estimator = data.get('estimator', 'bootstrap')
+
+    # read outcome and sensitivity progress from the checkpoint logs
+    # NaN is converted to string 'nan'; client needs to convert it back
+    arr = read_log(BobaWatcher.get_fn_outcome_log())
+    if arr is not None:
+      self.last_merge_index = int(arr['n_samples'].max()) if len(arr) else 0
+      self.outcomes = to_rows(arr)
+    elif os.path.exists(BobaWatcher.get_fn_outcome()):
+      # fall back to the CSV written by older versions
+      df = pd.read_csv(BobaWatcher.get_fn_outcome())
       self.last_merge_index = df['n_samples'].max()
       self.outcomes = df.values.tolist()
-    fn = BobaWatcher.get_fn_sensitivity()
-    if os.path.exists(fn):
-      # convert NaN to string 'nan'; client needs to convert it back to js NaN
-      df = pd.read_csv(fn).fillna('nan')
+
+    arr = read_log(BobaWatcher.get_fn_sensitivity_log())
+    if arr is not None:
+      self.decision_scores = to_rows(arr)
+    elif os.path.exists(BobaWatcher.get_fn_sensitivity()):
+      df = pd.read_csv(BobaWatcher.get_fn_sensitivity()).fillna('nan')
       self.decision_scores = df.values.tolist()
 
 
-def check_stopped():
-  # after client issued stop command, check if boba has indeed stopped
-  if not app.bobarun.is_running():
-    scheduler.remove_job('check_stopped')
-    socketio.emit('stopped')
+def on_job_done(event):
+  # when boba run has finished or stopped, send the final progress
+  if event.job_id != 'bobarun':
+    return
+  if hasattr(app, 'bobawatcher'):
+    app.bobawatcher.check_progress(final=True)
+  socketio.emit('stopped')
+
+
+scheduler.add_listener(on_job_done, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR)
+
+
+# concurrent snapshots must not read errors.csv while another one writes it
+merge_lock = threading.Lock()
 
 
 def merge_error ():
   """ Merge the error logs into errors.csv """
+  with merge_lock:
+    return _merge_error()
+
+
+def _merge_error ():
   fn = os.path.join(app.bobarun.dir_log, 'errors.csv')
   logs = []
   merged = []
   df = None
+  shards = get_shards()
 
   # exit code
-  if os.path.exists(app.bobarun.file_log):
+  status = pd.DataFrame({'exit_code': []}, index=pd.Index([], name='uid'))
+  if shards is not None:
+    status = pd.DataFrame(shards.poll(), columns=['uid', 'exit_code'])
+    status = status.set_index('uid')
+    logs = status.index.tolist()
+  elif os.path.exists(app.bobarun.file_log):
     status = pd.read_csv(app.bobarun.file_log, index_col='uid')
     logs = status.index.tolist()
 
@@ -248,14 +436,18 @@ def merge_error ():
   # these are the new logs
   remain = set(logs).difference(set(merged))
   res = []
-  for f in os.listdir(app.bobarun.dir_log):
-    if f.startswith('error') and f.endswith('txt'):
-      uid = int(os.path.splitext(f)[0].split('_')[1])
-      if uid in remain:
-        with open(os.path.join(app.bobarun.dir_log, f), 'r') as fo:
-          data = fo.read()
-          code = status.loc[uid]['exit_code']
-          res.append([uid, code, data])
+  if shards is not None:
+    # read the error messages of every shard in parallel
+    res = shards.read_errors(remain)
+  else:
+    for f in os.listdir(app.bobarun.dir_log):
+      if f.startswith('error') and f.endswith('txt'):
+        uid = int(os.path.splitext(f)[0].split('_')[1])
+        if uid in remain:
+          with open(os.path.join(app.bobarun.dir_log, f), 'r') as fo:
+            data = fo.read()
+            code = status.loc[uid]['exit_code']
+            res.append([uid, code, data])
 
   # cluster errors into groups
   res = pd.DataFrame(res, columns=['uid', 'exit_code', 'message'])
@@ -263,6 +455,7 @@ def merge_error ():
 
   # save file and return
   df = res if df is None else pd.concat([df, res], ignore_index=True)
+  os.makedirs(app.bobarun.dir_log, exist_ok=True)
   df.to_csv(fn, index=False)
   return df, status
 
@@ -275,10 +468,21 @@ def merge_error ():
 
 @app.route('/api/monitor/start_runtime', methods=['POST'])
 def start_runtime():
+  # the outcome CI estimator, by default the one given on the command line
+  body = request.get_json(silent=True) or {}
+  estimator = body.get('estimator', getattr(app, 'estimator', 'bootstrap'))
+  if estimator not in ESTIMATORS:
+    return jsonify({'status': 'fail', 'message': 'Expecting an estimator '
+      'among ' + ', '.join(ESTIMATORS)}), 200
+  if 'estimator' in body and app.bobarun.is_running():
+    return jsonify({'status': 'fail', 'message': 'Cannot change the '
+      'estimator while a run is in progress'}), 200
+
   # compute sampling order and weights
   # TODO: allow users to specify the sampling method
   df = common.get_decision_df()
-  order, weights = sampling.round_robin(df, df.shape[0])
+  with timed('compute', 'round_robin'):
+    order, weights = sampling.round_robin(df, df.shape[0])
 
   # order is not a list of uid, but indices into the summary table
   # lookup again to get the actual uid
@@ -295,15 +499,18 @@ def start_runtime():
     scheduler.remove_job('bobarun')
 
   if fresh:
-    # periodic check for progress
-    app.bobawatcher = BobaWatcher(order, weights)
-    app.bobawatcher.start()
+    app.bobawatcher = BobaWatcher(order, weights, estimator=estimator)
 
   # set batch size to 1 so the log would be updated more frequently
   app.bobarun.batch_size = 1
 
   # the scheduler will ensure that we have only 1 running instance
-  scheduler.add_job(app.bobarun.run_multiverse, args=[order], id='bobarun')
+  scheduler.add_job(job('bobarun', app.bobarun.run_multiverse),
+    args=[order], id='bobarun')
+
+  # check progress whenever the log changes, once the run is scheduled
+  if fresh:
+    app.bobawatcher.start()
 
   return jsonify({'status': 'success'}), 200
 
@@ -328,9 +535,10 @@ def resume_runtime():
   order = [uid + 1 for uid in app.bobawatcher.order]
 
   # start runtime, as we do in start_runtime
-  app.bobawatcher.start()
   app.bobarun.batch_size = 1
-  scheduler.add_job(app.bobarun.resume_multiverse, args=[order], id='bobarun')
+  scheduler.add_job(job('bobarun', app.bobarun.resume_multiverse),
+    args=[order], id='bobarun')
+  app.bobawatcher.start()
 
   return jsonify({'status': 'success'}), 200
 
@@ -345,19 +553,22 @@ def stop_runtime():
     app.bobawatcher.stop()
     app.bobawatcher.save_to_file()
 
-  # periodically check if boba run has indeed stopped
-  scheduler.add_job(check_stopped, 'interval', seconds=1, id='check_stopped')
+  # the job listener will notify the client once boba run has indeed stopped
+  if not app.bobarun.is_running():
+    socketio.emit('stopped')
 
   return jsonify({'status': 'success'}), 200
 
 
 @app.route('/api/monitor/get_snapshot', methods=['POST'])
+@heavy
 def get_snapshot():
   res = {'status': 'success',
     'results': {'data': [], 'header': []},
     'errors': {'data': [], 'header': []}}
 
-  if not os.path.exists(app.bobarun.dir_log):
+  shards = get_shards()
+  if shards is None and not os.path.exists(app.bobarun.dir_log):
     return jsonify(res), 200
 
   # error messages
@@ -365,12 +576,17 @@ def get_snapshot():
   res['errors']['data'] = err_msg.values.tolist()
   res['errors']['header'] = err_msg.columns.tolist()
 
-  # perform merge because the last merge may be stale
-  app.bobarun.run_after_execute()
-
   # read results and keep NA
   fields = ['point_estimate', 'p_value', 'fit']
-  df = common.read_results_batch(fields)
+  if shards is None:
+    # perform merge because the last merge may be stale
+    app.bobarun.run_after_execute()
+    df = common.read_results_batch(fields)
+  else:
+    # each shard merges its own results
+    df = shards.read_results(fields)
+    if df is None:
+      df = pd.DataFrame({'uid': []})
   df = pd.merge(exit_code, df, on='uid', how='left').fillna('nan')
   res['results']['data'] = df.values.tolist()
   res['results']['header'] = df.columns.tolist()
@@ -388,7 +604,13 @@ def inquire_progress():
     'is_running': app.bobarun.is_running()}
 
   # exit code
-  if os.path.exists(app.bobarun.file_log):
+  shards = get_shards()
+  if shards is not None:
+    res['logs'] = shards.poll()
+    res['shards'] = shards.status()
+    res['time_left'] = shards.time_left()
+    res['is_running'] = res['is_running'] or shards.is_running()
+  elif os.path.exists(app.bobarun.file_log):
     err, t = read_csv(app.bobarun.file_log)
     res['logs'] = t
 
@@ -396,12 +618,38 @@ def inquire_progress():
   if not hasattr(app, 'bobawatcher'):
     app.bobawatcher = BobaWatcher([])
     app.bobawatcher.init_from_file()
+
+  # the shards run on their own, so watch them from the first inquiry, and
+  # again if we stopped watching before they finished
+  watcher = app.bobawatcher.file_watcher
+  if shards is not None and watcher is None:
+    app.bobawatcher.start()
+  elif shards is not None and watcher.stopped.is_set() and \
+    not shards.is_finished():
+    app.bobawatcher.watch()
   res['outcome']['data'] = app.bobawatcher.outcomes
   res['decision_scores']['data'] = app.bobawatcher.decision_scores
   res['decision_scores']['header'] = app.bobawatcher.get_header_sensitivity()
+  res['f_sensitivity'] = app.bobawatcher.get_f_sensitivity()
 
   # for debugging
   # logs = [int(r[0]) for r in res['logs']]
   # BobaWatcher(logs).update_outcome(logs)
 
   return jsonify(res), 200
+
+
+@app.route('/api/monitor/shards', methods=['POST'])
+def get_shard_status():
+  shards = get_shards()
+  if shards is None:
+    return jsonify({'status': 'fail',
+      'message': 'The monitor is not aggregating shards'}), 200
+
+  logs = shards.poll()
+  res = {'status': 'success',
+    'size': shards.size,
+    'done': len(logs),
+    'time_left': shards.time_left(),
+    'shards': shards.status()}
+  return jsonify(res), 200
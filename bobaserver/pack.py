@@ -0,0 +1,137 @@
+# pack the per-universe files of `multi` results into one memory-mapped file
+
+import io
+import os
+import csv
+import numpy as np
+from .store import Store, StoreWriter
+from .util import read_csv
+
+# the pack written by `boba-server pack` into the data folder
+PACK = 'multi.boba'
+
+
+def pack_files(folder, templates, uids, fn, sources=None, log=None):
+  """
+  Read every per-universe file of each path template and write them into a
+  store, one file at a time. If all files of a template are numbers, they
+  are stored as one float64 table; otherwise as their CSV bytes. Each
+  template gets a table of (uid, offset, length) rows, where offset and
+  length count table rows, or bytes for CSV.
+
+  Parameters:
+   - folder: the data folder
+   - templates: path templates with a {} for the uid
+   - uids: the universes to pack
+   - fn: the output file
+   - sources: saved as is, to tell later whether the pack is stale
+   - log: if given, called with a line of text after each template
+
+  Returns: the number of packed files
+  """
+  total = 0
+  entries = {}
+  with StoreWriter(fn) as w:
+    for t, template in enumerate(templates):
+      prefix = f'multi/{t}'
+      paths = [(uid, os.path.join(folder, template.format(uid)))
+        for uid in sorted(uids)]
+      paths = [(uid, p) for uid, p in paths if os.path.exists(p)]
+      found = []
+      header = []
+
+      def numbers():
+        for uid, p in paths:
+          err, rows = read_csv(p, 0)
+          if not len(rows):
+            continue
+          header[:] = rows[0]
+          arr = np.array([[float(v) for v in r] for r in rows[1:]],
+            dtype=np.float64).reshape(-1, len(rows[0]))
+          found.append((uid, len(arr)))
+          yield arr
+
+      def text():
+        for uid, p in paths:
+          with open(p, 'rb') as f:
+            b = f.read()
+          found.append((uid, len(b)))
+          yield np.frombuffer(b, np.uint8)
+
+      # numbers are read in place; at a non-numeric file, the bytes written
+      # so far are dropped, and the template is written again as text
+      dtype = 'f8'
+      try:
+        w.add_chunks(f'{prefix}/values', numbers(), np.float64)
+      except ValueError:
+        found.clear()
+        dtype = 'csv'
+        w.add_chunks(f'{prefix}/values', text(), np.uint8)
+
+      lengths = np.array([n for uid, n in found], dtype=np.int64)
+      rows = np.array([[uid for uid, n in found], np.cumsum(lengths) - lengths,
+        lengths], dtype=np.int64).T.reshape(-1, 3)
+      w.add(f'{prefix}/index', rows)
+      entries[template] = {'prefix': prefix, 'header': header,
+        'dtype': dtype}
+      total += len(found)
+      if log:
+        log(f'{template}: {len(found)} files')
+
+    w.add_json('multi', entries)
+    w.add_json('sources', sources or {})
+  return total
+
+
+class MultiReader:
+  """ Read the per-universe files from a pack, without a file lookup """
+
+  def __init__(self, fn):
+    self.store = Store(fn)
+    self.entries = self.store.get_json('multi')
+    self.sources = self.store.get_json('sources')
+
+
+  def _find(self, template, uid):
+    # the entry of a template and the index row of a universe, or None
+    e = self.entries.get(template)
+    if e is None:
+      return None
+    try:
+      uid = int(uid)
+    except (TypeError, ValueError):
+      return None
+
+    index = self.store.get(f'{e["prefix"]}/index')
+    i = np.searchsorted(index[:, 0], uid)
+    if i >= len(index) or index[i, 0] != uid:
+      return None
+    return e, index[i]
+
+
+  def contains(self, template, uid):
+    return self._find(template, uid) is not None
+
+
+  def read(self, template, uid):
+    """
+    Return the header and the rows of a universe file, or None if it is not
+    in the pack. Numeric files are returned as a read-only float64 array
+    viewing the mapped file, and others as a list of string rows.
+    """
+    found = self._find(template, uid)
+    if found is None:
+      return None
+    e, row = found
+    offset, length = row[1:].tolist()
+    values = self.store.get(f'{e["prefix"]}/values')
+    if e['dtype'] == 'f8':
+      return e['header'], values[offset:offset + length]
+
+    data = values[offset:offset + length].tobytes().decode('utf-8')
+    rows = list(csv.reader(io.StringIO(data, newline='')))
+    return rows[0], rows[1:]
+
+
+  def nbytes(self):
+    return self.store.nbytes()
@@ -0,0 +1,168 @@
+# opt-in cProfile captures of requests and scheduler jobs
+
+import os
+import re
+import json
+import time
+import pstats
+import cProfile
+import functools
+import threading
+from time import perf_counter
+from flask import g, has_request_context
+
+# header asking to profile one request
+HEADER = 'X-Boba-Profile'
+
+# set with --profile; nothing is profiled without it
+profiler = None
+
+
+class Profiler:
+  """
+  Save cProfile captures into a folder, keeping only the most recent ones.
+  Each capture is a .prof file, readable with pstats or snakeviz, and a .json
+  file with its duration and the most expensive functions.
+  """
+
+  def __init__(self, folder, keep=100, top=20):
+    """
+    Parameters:
+     - folder: where the captures are written
+     - keep: the number of captures to keep, older ones are deleted
+     - top: the number of functions listed in the summary of a capture
+    """
+    self.folder = os.path.realpath(folder)
+    self.keep = keep
+    self.top = top
+    self.seq = 0
+    self.lock = threading.Lock()
+    os.makedirs(self.folder, exist_ok=True)
+
+
+  def save(self, name, kind, duration, profiles):
+    """ Merge the per-thread profiles of one call and write them to disk. """
+    profiles = [p for p in profiles if p is not None]
+    if not len(profiles):
+      return None
+    stats = pstats.Stats(profiles[0])
+    for p in profiles[1:]:
+      stats.add(p)
+
+    with self.lock:
+      self.seq += 1
+      safe = re.sub(r'[^A-Za-z0-9_.-]', '_', name)
+      base = f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-' + \
+        f'{self.seq:04d}-{safe}'
+
+    fn = os.path.join(self.folder, base + '.prof')
+    stats.dump_stats(fn)
+    entry = {'name': name, 'kind': kind, 'duration': duration,
+      'time': time.time(), 'file': fn, 'top': _top_functions(stats, self.top)}
+    with open(os.path.join(self.folder, base + '.json'), 'w') as f:
+      json.dump(entry, f)
+
+    self.rotate()
+    return entry
+
+
+  def rotate(self):
+    """ Delete the oldest captures beyond the limit. """
+    fs = sorted([f for f in os.listdir(self.folder) if f.endswith('.json')])
+    for f in fs[:max(0, len(fs) - self.keep)]:
+      for ext in ['.json', '.prof']:
+        try:
+          os.remove(os.path.join(self.folder, f[:-5] + ext))
+        except OSError:
+          pass
+
+
+  def summary(self, limit=20):
+    """ The slowest captures, from all processes writing to the folder. """
+    res = []
+    for f in os.listdir(self.folder):
+      if not f.endswith('.json'):
+        continue
+      try:
+        with open(os.path.join(self.folder, f)) as fo:
+          res.append(json.load(fo))
+      except (OSError, ValueError):
+        pass  # deleted or being written
+    res.sort(key=lambda d: d['duration'], reverse=True)
+    return res[:limit]
+
+
+def _top_functions(stats, n):
+  # functions sorted by cumulative time
+  rows = []
+  for (fn, line, func), (cc, nc, tt, ct, _) in stats.stats.items():
+    rows.append({'function': f'{fn}:{line}({func})', 'calls': nc,
+      'total': tt, 'cumulative': ct})
+  rows.sort(key=lambda d: d['cumulative'], reverse=True)
+  return rows[:n]
+
+
+def _enable():
+  # another profiler may be active, such as under python -m cProfile
+  p = cProfile.Profile()
+  try:
+    p.enable()
+    return p
+  except ValueError:
+    return None
+
+
+def start_request(headers):
+  """ Start profiling the current request if it asks for it. """
+  if profiler is None or not headers.get(HEADER):
+    return
+  g.profiles = [_enable()]
+  g.profile_start = perf_counter()
+
+
+def stop_request(name):
+  """ Stop profiling the current request, and save the capture. """
+  if 'profiles' not in g:
+    return None
+  for p in g.profiles:
+    if p is not None:
+      p.disable()
+  duration = perf_counter() - g.profile_start
+  return profiler.save(name, 'request', duration, g.pop('profiles'))
+
+
+def in_thread(func):
+  """
+  Wrap a function that a profiled request runs in another thread, so the
+  work is included in the capture of the request.
+  """
+  if not has_request_context() or 'profiles' not in g:
+    return func
+
+  @functools.wraps(func)
+  def wrapper(*args, **kwargs):
+    p = _enable()
+    g.profiles.append(p)
+    try:
+      return func(*args, **kwargs)
+    finally:
+      if p is not None:
+        p.disable()
+  return wrapper
+
+
+def profiled_job(name, func):
+  """ Wrap a scheduler job so each run is captured when profiling is on """
+  @functools.wraps(func)
+  def wrapper(*args, **kwargs):
+    if profiler is None:
+      return func(*args, **kwargs)
+    p = _enable()
+    t = perf_counter()
+    try:
+      return func(*args, **kwargs)
+    finally:
+      if p is not None:
+        p.disable()
+      profiler.save(name, 'job', perf_counter() - t, [p])
+  return wrapper
@@ -1,23 +1,87 @@
 import os
-import numpy as np
-import pandas as pd
-import math
-from flask import jsonify, request
+import contextvars
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor
+from flask import g, request
 from bobaserver import app
-from .util import read_csv, read_json, read_key_safe, group_by, remove_na
+from .util import read_csv
+from .dataset import current, DatasetError
+from .serving import heavy
+from .assets import StaticAssets
+from .subset import METHODS as SENSITIVITY_METHODS
+from . import profiling
+from .metrics import jsonify, timed, registry, request_seconds, \
+    response_bytes, server_timing
 import bobaserver.common as common
 
+# bounded pool to read the raw files of a batch in parallel
+MAX_RAW_BATCH = 200
+raw_pool = ThreadPoolExecutor(max_workers=8)
+
+# the most histogram bins a query may ask for
+MAX_BINS = 1000
+
+# the client bundle, compressed and versioned by content hash
+assets = StaticAssets(app.static_folder)
+app.view_functions['static'] = assets.send
+
+
+# report an invalid data folder to the client
+@app.errorhandler(DatasetError)
+def dataset_error(err):
+    return jsonify({'status': 'fail', 'message': str(err)}), 200
+
+
+# time every request, and report the phases in the Server-Timing header
+@app.before_request
+def start_timer():
+    # a mounted dataset already started the clock before it was loaded
+    g.setdefault('start_time', perf_counter())
+    profiling.start_request(request.headers)
+
+
+@app.after_request
+def record_timing(response):
+    if 'start_time' not in g:
+        return response
+    total = perf_counter() - g.start_time
+    endpoint = request.endpoint or 'unknown'
+    if profiling.stop_request(endpoint) is not None:
+        response.headers[profiling.HEADER] = 'captured'
+    request_seconds.observe(total, endpoint=endpoint,
+        status=response.status_code)
+    if response.content_length is not None:
+        response_bytes.observe(response.content_length, endpoint=endpoint)
+    response.headers['Server-Timing'] = server_timing(total)
+    return response
+
+
+def cached_json(key, func):
+    """
+    Reply with the JSON of func(), serialized once per process. Workers
+    share the store but decode it on their own, so each keeps the encoded
+    reply instead of decoding the columns on every request.
+    """
+    body = current.cached(f'json_{key}', lambda: jsonify(func()).get_data())
+    return app.response_class(body, mimetype='application/json'), 200
 
 # entry
 @app.route('/')
 def index():
-    return app.send_static_file('index.html')
+    return assets.send_index()
 
 # read the summary file
 @app.route('/api/get_universes', methods=['POST'])
 def get_universes():
-    fn = os.path.join(app.data_folder, 'summary.csv')
-    err, res = read_csv(fn, 0)
+    if current.store is not None:
+        def reply():
+            header, cols = current.store.get_table('summary')
+            return {'status': 'success', 'data': list(zip(*cols)),
+                'header': header}
+        return cached_json('get_universes', reply)
+
+    fn = os.path.join(current.data_folder, 'summary.csv')
+    err, res = current.cached('get_universes', lambda: read_csv(fn, 0))
     reply = err if err else {'status': 'success', 'data': res[1:],
                              'header': res[0]}
     return jsonify(reply), 200
@@ -25,84 +89,229 @@ def get_universes():
 # read point estimates, p-value, fit metric value, and stacking weights
 @app.route('/api/get_pred', methods=['POST'])
 def get_pred():
-    fields = ['point_estimate', 'p_value', 'fit', 'stacking_weight',
-        'annotation', 'standard_error']
-    res = common.read_results_batch(fields)
-    header = res.columns.tolist()
+    if current.store is not None:
+        def reply():
+            header, res = current.store.get_table('pred')
+            return {'status': 'success', 'data': res, 'header': header,
+                'sensitivity': current.sensitivity}
+        return cached_json('get_pred', reply)
 
-    # remove Inf and NA in point estimates
-    res = remove_na(res, 'point_estimate', dtype=float)
+    res, header = current.cached('get_pred', common.read_pred)
 
-    res = [res[n].values.tolist() for n in header]
     reply = {'status': 'success', 'data': res, 'header': header,
-        'sensitivity': app.sensitivity}
+        'sensitivity': current.sensitivity}
     return jsonify(reply), 200
 
-# read uncertainty
-@app.route('/api/get_uncertainty', methods=['POST'])
-def get_uncertainty():
-    f = app.schema['uncertainty']
-    fn = os.path.join(app.data_folder, f['file'])
-    err, res = read_csv(fn, 0)
+def read_samples(field):
+    """
+    Reply with the samples of a field, such as the uncertainty draws. The
+    request may ask for `resolution` quantiles per universe, or for the
+    `histogram` of each universe, instead of every sample.
+    """
+    f = current.schema[field]
+    body = request.get_json(silent=True) or {}
+    resolution = body.get('resolution')
+    if body.get('histogram') or resolution is not None:
+        if resolution is not None and (not isinstance(resolution, int) or
+                                       isinstance(resolution, bool) or
+                                       resolution < 1):
+            msg = 'Resolution must be a positive number of quantiles'
+            return jsonify({'status': 'fail', 'message': msg}), 200
+
+        lod = current.cached(f'lod_{field}', lambda: common.build_lod(field))
+        if body.get('histogram'):
+            reply = {'status': 'success', 'uids': lod.uids.tolist(),
+                'edges': lod.edges.tolist(),
+                'counts': lod.histograms.tolist()}
+        else:
+            reply = {'status': 'success', 'data': lod.rows(resolution),
+                'header': ['uid', field],
+                'resolution': lod.level(resolution)}
+        return jsonify(reply), 200
+
+    fn = os.path.join(current.data_folder, f['file'])
+    err, res = current.cached(f'get_{field}', lambda: read_csv(fn, 0))
     reply = err if err else {'status': 'success', 'data': res[1:]}
     if not err:
-        header = ['uncertainty' if d == f['field'] else d for d in res[0]]
+        header = [field if d == f['field'] else d for d in res[0]]
         reply['header'] = header
-
     return jsonify(reply), 200
 
+# read uncertainty
+@app.route('/api/get_uncertainty', methods=['POST'])
+@heavy
+def get_uncertainty():
+    return read_samples('uncertainty')
+
 # read the null distribution of point estimates
 @app.route('/api/get_null', methods=['POST'])
+@heavy
 def get_null():
-    f = app.schema['null_distribution']
-    fn = os.path.join(app.data_folder, f['file'])
-    err, res = read_csv(fn, 0)
-    reply = err if err else {'status': 'success', 'data': res[1:]}
-    if not err:
-        header = ['null_distribution' if d == f['field'] else d for d in res[0]]
-        reply['header'] = header
-    return jsonify(reply), 200
+    return read_samples('null_distribution')
 
 # read the overview, including decisions and ADG
 @app.route('/api/get_overview', methods=['POST'])
 def get_overview():
-    res = {'schema': [app.schema[d]['name'] for d in app.schema],
-        'decisions': app.decisions}
-    res.update(app.visualizer)
+    res = {'schema': [current.schema[d]['name'] for d in current.schema],
+        'decisions': current.decisions}
+    res.update(current.visualizer)
     reply = {'status': 'success', 'data': res}
     return jsonify(reply), 200
 
+# the sensitivity of every decision for each per-universe outcome
+@app.route('/api/get_sensitivity_matrix', methods=['POST'])
+@heavy
+def get_sensitivity_matrix():
+    body = request.get_json(silent=True) or {}
+    method = body.get('method', current.visualizer['sensitivity'])
+    if method not in SENSITIVITY_METHODS:
+        msg = 'Expecting a method among ' + ', '.join(SENSITIVITY_METHODS)
+        return jsonify({'status': 'fail', 'message': msg}), 200
+
+    # kept while monitoring too, until the results are merged again
+    files = ['summary.csv'] + [f['path'] for f in current.files
+                               if not f['multi']]
+    try:
+        res = current.cached(f'sensitivity_matrix_{method}',
+                             lambda: common.cal_sensitivity_matrix(
+                                 method=method), files=files)
+    except (OSError, ValueError, KeyError, IndexError) as e:
+        msg = f'Cannot compute the sensitivity matrix: {e}'
+        return jsonify({'status': 'fail', 'message': msg}), 200
+
+    reply = {'status': 'success', 'data': res}
+    return jsonify(reply), 200
+
+# the raw data of a universe, cached unless it could not be read
+def read_raw(uid):
+    return current.cached(f'raw_{uid}', lambda: common.read_raw(uid),
+                          keep=lambda res: not res[0])
+
 # read the actual and predicted data of all data points in a universe
 @app.route('/api/get_raw', methods=['POST'])
 def get_raw():
-    # fixme: prediction might not exist
-    # fixme: now we assume specific column order, should use field name
     uid = request.json['uid']
-    f = app.schema['prediction']
-    fn = os.path.join(app.data_folder, f['file'].format(uid))
-    err, res = read_csv(fn, 1)
-    reply = err if err else {'status': 'success'}
+    err, data = read_raw(uid)
+    reply = err if err else {'status': 'success', 'data': data}
+    return jsonify(reply), 200
+
+# the same for many universes, reading the files in parallel
+@app.route('/api/get_raw_batch', methods=['POST'])
+@heavy
+def get_raw_batch():
+    uids = (request.get_json(silent=True) or {}).get('uids')
+    if not isinstance(uids, list) or len(uids) > MAX_RAW_BATCH:
+        msg = f'Expecting a list of at most {MAX_RAW_BATCH} uids'
+        return jsonify({'status': 'fail', 'message': msg}), 200
+
+    # a uid is a number, or a string of digits
+    valid = [(isinstance(u, int) and not isinstance(u, bool)) or
+             (isinstance(u, str) and u.isdigit()) for u in uids]
+
+    # each task runs in a copy of this context, to see the current dataset
+    futures = [raw_pool.submit(contextvars.copy_context().run, read_raw, uid)
+        if ok else None for uid, ok in zip(uids, valid)]
+    data = []
+    errors = {}
+    for uid, fut in zip(uids, futures):
+        err, res = fut.result() if fut is not None else \
+            ({'message': 'Invalid uid'}, None)
+        data.append(res)
+        if err:
+            errors[str(uid)] = err['message']
+
+    reply = {'status': 'success', 'data': data, 'errors': errors}
+    return jsonify(reply), 200
+
+
+# whether filters are a dict from decision name to a list of options
+def valid_filters(filters):
+    return isinstance(filters, dict) and all([isinstance(opts, list) and
+        all([isinstance(o, (str, int, float)) for o in opts])
+        for opts in filters.values()])
+
+# aggregate the point estimates of the universes matching option filters
+@app.route('/api/query', methods=['POST'])
+def query():
+    body = request.get_json(silent=True) or {}
+    filters = body.get('filters', {})
+    bins = body.get('bins', 20)
+    bounds = body.get('range', None)
+    number = (lambda v: isinstance(v, (int, float)) and
+              not isinstance(v, bool))
+    if not valid_filters(filters) or not number(bins) or \
+            not 1 <= bins <= MAX_BINS or bins != int(bins) or \
+            (bounds is not None and (not isinstance(bounds, list) or
+             len(bounds) != 2 or not all([number(b) for b in bounds]))):
+        msg = 'Expecting filters as {decision: [options]}, a number of ' \
+            f'bins from 1 to {MAX_BINS} and an optional range [min, max]'
+        return jsonify({'status': 'fail', 'message': msg}), 200
+
+    index = current.cached('index', common.build_index)
+    try:
+        with timed('compute', 'query'):
+            res = index.aggregate(filters, int(bins), bounds)
+    except KeyError as e:
+        msg = f'Unknown decision or option {e}'
+        return jsonify({'status': 'fail', 'message': msg}), 200
+    except ValueError as e:
+        return jsonify({'status': 'fail', 'message': str(e)}), 200
+
+    res['status'] = 'success'
+    return jsonify(res), 200
+
+
+# sensitivity of each decision within the universes matching option filters
+@app.route('/api/sensitivity', methods=['POST'])
+@heavy
+def subset_sensitivity():
+    body = request.get_json(silent=True) or {}
+    filters = body.get('filters', {})
+    method = body.get('method', current.visualizer['sensitivity'])
+    if not valid_filters(filters) or method not in SENSITIVITY_METHODS:
+        msg = 'Expecting filters as {decision: [options]} and a method ' \
+            'among ' + ', '.join(SENSITIVITY_METHODS)
+        return jsonify({'status': 'fail', 'message': msg}), 200
+
+    # kept while monitoring too, until the point estimates are merged again
+    pe = current.schema['point_estimate']['file']
+    subset = current.cached('subset', common.build_subset,
+                            files=['summary.csv', pe])
+    try:
+        with timed('compute', f'subset_{method}'):
+            res = subset.compute(filters, method)
+    except KeyError as e:
+        msg = f'Unknown decision or option {e}'
+        return jsonify({'status': 'fail', 'message': msg}), 200
+
+    reply = {'status': 'success', 'method': method}
+    reply.update(res)
+    return jsonify(reply), 200
+
+
+# list the datasets served under /d/<name>/
+@app.route('/api/datasets', methods=['POST'])
+def get_datasets():
+    res = [{'name': ds.name, 'loaded': ds.is_loaded(), 'bytes': ds.nbytes()}
+        for ds in list(app.datasets.datasets.values())]
+    reply = {'status': 'success', 'data': res,
+        'budget': app.datasets.budget}
+    return jsonify(reply), 200
+
+
+# latency and payload size histograms, in the Prometheus text format
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    return registry.render(), 200, \
+        {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
 
-    if not err:
-        # sampling
-        m = 100
-        data = []
-        for i in range(2):
-            long = list(map(lambda d: float(d[i]), res))
-            if len(long) > m:
-                # quantile dot plot
-                qt = np.append(np.arange(0, 1, 1 / m), 1.0)
-                data.append(np.quantile(long, qt).tolist())
-            else:
-                data.append(long)
-
-        # apply transform
-        trans = read_key_safe(f, ['transform'], None)
-        if trans:
-            trans = trans.format('x')
-            for i in range(2):
-                data[i] = [eval(trans) for x in data[i]]
-
-        reply['data'] = data
 
+# the slowest calls captured with --profile
+@app.route('/api/profiles', methods=['GET'])
+def get_profiles():
+    if profiling.profiler is None:
+        msg = 'Profiling is off. Start the server with --profile DIR.'
+        return jsonify({'status': 'fail', 'message': msg}), 200
+    limit = request.args.get('limit', 20, type=int)
+    reply = {'status': 'success', 'data': profiling.profiler.summary(limit)}
     return jsonify(reply), 200
@@ -1,13 +1,16 @@
 # -*- coding: utf-8 -*-
 
+# heavy modules are imported where they are needed, so --help, --version
+# and the commands start quickly
+
 import click
 import os
-import pandas as pd
-import numpy as np
-from boba.bobarun import BobaRun
-from bobaserver import app, socketio, scheduler
-from .util import read_json, write_json, read_key_safe, print_fail
-import bobaserver.common as common
+import re
+import sys
+from time import perf_counter
+
+# the names of bobastats.estimators.ESTIMATORS, which imports numpy
+ESTIMATORS = ('bootstrap', 'delta', 'snis', 'stratified')
 
 
 def check_path(p, more=''):
@@ -17,12 +20,6 @@ def check_path(p, more=''):
         print_help(msg + more)
 
 
-def check_required_field(obj, key, prefix=''):
-    """Check if a required field is in obj."""
-    if key not in obj:
-        err = 'Error: cannot find required field "{}" in {}'.format(key, obj)
-        print_help(prefix + err)
-
 def print_help(err=''):
     """Show help message and exit."""
     ctx = click.get_current_context()
@@ -35,80 +32,68 @@ def print_help(err=''):
 
 def read_meta():
     """ Read overview.json, verify, and store the meta data. """
-    fn = os.path.join(app.data_folder, 'overview.json')
-    err, res = read_json(fn)
-    if (err):
-        print_help(err['message'])
-
-    # check summary.csv
-    fn = os.path.join(app.data_folder, 'summary.csv')
-    check_path(fn)
-
-    # check file definition
-    vis = read_key_safe(res, ['visualizer'], {})
-    fs = read_key_safe(vis, ['files'], [])
-    lookup = {}
-    prefix = 'In parsing visualizer.files in overview.json:\n'
-    for f in fs:
-        check_required_field(f, 'id', prefix)
-        check_required_field(f, 'path', prefix)
-        f['multi'] = read_key_safe(f, ['multi'], False)
-        lookup[f['id']] = f
-
-    # read schema and join file
-    schema = read_key_safe(vis, ['schema'], {})
-    prefix = 'In parsing visualizer.schema in overview.json:\n'
-    check_required_field(schema, 'point_estimate', prefix)
-    for key in schema:
-        s = schema[key]
-        check_required_field(s, 'file', prefix)
-        # check_required_field(s, 'field', prefix)
-        # todo: verify if file is valid CSV and if field exist in file
-        fid = s['file']
-        if fid not in lookup:
-            msg = 'In parsing visualizer.schema in overview.json:\n'
-            msg += '{}\n'.format(s)
-            msg += 'Error: file id "{}" is not defined.'.format(fid)
-            print_help(msg)
-        s['file'] = lookup[fid]['path']
-        s['multi'] = lookup[fid]['multi']
-        s['name'] = key
-
-    # check sensitivity flag
-    sen = read_key_safe(vis, ['sensitivity'], 'ad')
-    if sen not in ('f', 'ks', 'ad'):
-        msg = f'Invalid sensitivity flag "{sen}". Available values:\n'
-        msg += ' - "f": algorithm based on the F-test\n'
-        msg += ' - "ks": algorithm based on Kolmogorov–Smirnov statistic'
-        msg += ' - "ad": k-samples Anderson-Darling test'
-        print_help(msg)
-
-    # store meta data
-    app.schema = schema
-    app.summary = common.read_summary()
-    app.decisions = read_key_safe(res, ['decisions'], {})
-    app.visualizer = {
-        "sensitivity": sen,
-        "labels": read_key_safe(vis, ['labels'], {}),
-        "graph": read_key_safe(res, ['graph'], {})
-    }
-
-
-def check_result_files ():
-    """ check if result files exists """
-    fn = os.path.join(app.data_folder, 'overview.json')
-    err, res = read_json(fn)
-    vis = read_key_safe(res, ['visualizer'], {})
-    fs = read_key_safe(vis, ['files'], [])
-
-    prefix = 'In parsing visualizer.files in overview.json:\n'
-    for f in fs:
-        multi = read_key_safe(f, ['multi'], False)
-        if not multi:
-            check_path(os.path.join(app.data_folder, f['path']))
-
-
-@click.command()
+    from bobaserver import app
+    from .dataset import DatasetError
+    try:
+        app.dataset.load()
+    except DatasetError as e:
+        print_help(str(e))
+
+
+class Startup:
+    """ Time the phases of the server startup """
+
+    def __init__(self):
+        self.phases = []
+
+    def phase(self, name):
+        return _Phase(self, name)
+
+    def report(self):
+        from .metrics import startup_seconds
+        for name, t in self.phases:
+            startup_seconds.observe(t, phase=name)
+        items = ', '.join([f'{n} {t:.2f}s' for n, t in self.phases])
+        total = sum([t for n, t in self.phases])
+        return f'Startup: {items} (total {total:.2f}s)'
+
+
+class _Phase:
+    def __init__(self, startup, name):
+        self.startup = startup
+        self.name = name
+
+    def __enter__(self):
+        self.t = perf_counter()
+
+    def __exit__(self, *args):
+        self.startup.phases.append((self.name, perf_counter() - self.t))
+
+
+def parse_mount(value):
+    """ Parse a NAME=PATH mount option """
+    name, sep, path = value.partition('=')
+    if not sep or not name or '/' in name:
+        print_help(f'Error: invalid --mount "{value}", expecting NAME=PATH')
+    check_path(path)
+    return name, path
+
+
+def parse_shard(value):
+    """ Parse a DIR or DIR:FIRST-LAST shard option """
+    m = re.match(r'^(.+):(\d+)-(\d+)$', value)
+    if m is None:
+        check_path(value)
+        return value, None
+    first, last = int(m.group(2)), int(m.group(3))
+    if first < 1 or last < first:
+        print_help(f'Error: invalid --shard "{value}", expecting '
+                   'DIR:FIRST-LAST with 1 <= FIRST <= LAST')
+    check_path(m.group(1))
+    return m.group(1), (first, last)
+
+
+@click.group(invoke_without_command=True)
 @click.option('--in', '-i', 'input', default='.', show_default=True,
               help='Path to the input directory')
 @click.option('--port', default=8080, show_default=True,
@@ -116,20 +101,93 @@ def check_result_files ():
 @click.option('--host', default='0.0.0.0', show_default=True,
               help='The interface to bind the server to')
 @click.option('--monitor', is_flag=True, help='Allow boba monitor')
+@click.option('--mount', multiple=True, metavar='NAME=PATH',
+              help='Also serve the data folder PATH under /d/NAME/')
+@click.option('--memory-budget', default=0, show_default=True,
+              help='Unload the least recently used mounted datasets when '
+              'they take more memory (MB) than this; 0 means no limit')
+@click.option('--workers', default=1, show_default=True,
+              help='Number of worker processes, sharing one read-only copy '
+              'of the data')
+@click.option('--production', is_flag=True,
+              help='Serve with bounded concurrency and keep-alive, and run '
+              'heavy requests in a worker pool')
+@click.option('--concurrency', default=64, show_default=True,
+              help='Maximum number of connections served at once')
+@click.option('--keep-alive', default=5, show_default=True,
+              help='Seconds to keep an idle connection open')
+@click.option('--timeout', default=60, show_default=True,
+              help='Seconds before a heavy request is abandoned')
+@click.option('--profile', default=None, metavar='DIR',
+              help='Save cProfile captures of scheduler jobs, and of '
+              'requests with the X-Boba-Profile header, to DIR')
+@click.option('--watch', is_flag=True,
+              help='Reload the data folder when its files change')
+@click.option('--shard', multiple=True, metavar='DIR[:FIRST-LAST]',
+              help='With --monitor, also aggregate the run in the multiverse '
+              'folder DIR, optionally of universes FIRST to LAST')
+@click.option('--estimator', default='bootstrap', show_default=True,
+              type=click.Choice(ESTIMATORS),
+              help='With --monitor, how the CI of the outcome mean is '
+              'computed')
 @click.version_option()
-def main(input, port, host, monitor):
+@click.pass_context
+def main(ctx, input, port, host, monitor, mount, memory_budget, workers,
+         production, concurrency, keep_alive, timeout, profile, watch,
+         shard, estimator):
+    """ Start the server, or run one of the commands below. """
+    if ctx.invoked_subcommand is not None:
+        return
+
     check_path(input)
-    app.data_folder = os.path.realpath(input)
+    if workers > 1 and monitor:
+        print_help('Error: --workers cannot be used with --monitor')
+    if workers > 1 and not hasattr(os, 'fork'):
+        print_help('Error: --workers is not supported on this platform')
+    if watch and (monitor or workers > 1):
+        print_help('Error: --watch cannot be used with --monitor or --workers')
+    if shard and not monitor:
+        print_help('Error: --shard requires --monitor')
+    shards = [parse_shard(s) for s in shard]
+
+    startup = Startup()
+    with startup.phase('import'):
+        from bobaserver import app
+        from .dataset import Dataset, DatasetRegistry
+        from .serving import shared_store, serve_workers, serve_production
+        from . import profiling
 
-    read_meta()
-    app.bobarun = BobaRun(app.data_folder)
-    if not monitor:
-        check_result_files()
+    app.dataset = Dataset(input, monitor=monitor)
+    app.datasets = DatasetRegistry(memory_budget * 1024 * 1024)
+    for m in mount:
+        name, path = parse_mount(m)
+        app.datasets.add(Dataset(path, name))
 
-        # compute sensitivity and write scores to file
-        app.sensitivity = common.cal_sensitivity()
-        d = {'method': app.visualizer['sensitivity'], 'scores': app.sensitivity}
-        write_json(d, os.path.join(input, 'sensitivity.json'), nice=True)
+    if profile:
+        profiling.profiler = profiling.Profiler(profile)
+
+    # read meta data, and compute sensitivity if we are not monitoring
+    with startup.phase('load'):
+        read_meta()
+
+    # requests pin the dataset they started with, so swapping is safe
+    if watch:
+        from .dataset import DatasetWatcher
+        DatasetWatcher(app.dataset,
+                       lambda ds: setattr(app, 'dataset', ds)).start()
+
+    # socket.io, the scheduler and the monitor routes are only needed here
+    socketio = None
+    if monitor:
+        with startup.phase('monitor'):
+            from boba.bobarun import BobaRun
+            from .monitor import socketio, scheduler
+            app.bobarun = BobaRun(app.dataset.data_folder)
+            app.estimator = estimator
+            if shards:
+                from .shards import Shard, ShardSet
+                app.shards = ShardSet([Shard(f, r) for f, r in shards],
+                                      app.bobarun.size)
 
     # print starting message
     s_host = '127.0.0.1' if host == '0.0.0.0' else host
@@ -137,15 +195,245 @@ def main(input, port, host, monitor):
     Server started!
     Navigate to http://{0}:{1}/ in your browser
     Press CTRL+C to stop\033[0m""".format(s_host, port)
-    print(msg)
 
     # start server
-    scheduler.start()
+    if workers > 1:
+        from contextlib import ExitStack
+        with ExitStack() as stack:
+            with startup.phase('store'):
+                stack.enter_context(shared_store(app.dataset))
+            print(startup.report())
+            print(msg)
+            serve_workers(app, host, port, workers, concurrency, keep_alive)
+        return
+
+    print(startup.report())
+    print(msg)
     if monitor:
+        scheduler.start()
+    if production:
+        serve_production(app, socketio, host, port, concurrency, keep_alive,
+                         timeout)
+    elif monitor:
         socketio.run(app, host= host, port=f'{port}')
     else:
         app.run(host= host, port=f'{port}')
 
 
+@main.command()
+@click.option('--in', '-i', 'input', default='.', show_default=True,
+              help='Path to the input directory')
+@click.option('--no-raw', is_flag=True,
+              help='Do not include the sampled raw data of each universe')
+def build(input, no_raw):
+    """ Compile the data folder into a bundle that starts quickly. """
+    from bobaserver import app
+    from .dataset import Dataset, DatasetError, BUNDLE
+
+    check_path(input)
+    out = os.path.join(input, BUNDLE)
+    t = perf_counter()
+    ds = Dataset(input, use_bundle=False)
+    app.dataset = ds
+    try:
+        ds.load()
+    except DatasetError as e:
+        print_help(str(e))
+    ds.build_store(out + '.tmp', raw=not no_raw)
+    os.replace(out + '.tmp', out)
+    click.echo('Wrote {} ({:.1f} MB) in {:.1f}s'.format(out,
+               os.path.getsize(out) / 1e6, perf_counter() - t))
+
+
+@main.command()
+@click.option('--in', '-i', 'input', default='.', show_default=True,
+              help='Path to the input directory')
+def pack(input):
+    """ Pack the per-universe result files into one file. """
+    from bobaserver import app
+    from .dataset import Dataset, DatasetError
+    from .pack import PACK, pack_files
+
+    check_path(input)
+    t = perf_counter()
+    ds = Dataset(input, use_bundle=False)
+    try:
+        ds.load()
+    except DatasetError as e:
+        print_help(str(e))
+
+    out = os.path.join(ds.data_folder, PACK)
+    templates = [f['path'] for f in ds.files if f['multi']]
+    n = pack_files(ds.data_folder, templates, ds.summary['uid'].tolist(),
+                   out + '.tmp',
+                   sources=ds._sources(['summary.csv'] + templates),
+                   log=click.echo)
+    os.replace(out + '.tmp', out)
+    click.echo('Wrote {} files to {} ({:.1f} MB) in {:.1f}s'.format(n, out,
+               os.path.getsize(out) / 1e6, perf_counter() - t))
+
+
+@main.command()
+@click.option('--in', '-i', 'input', default='.', show_default=True,
+              help='Path to the input directory')
+def export(input):
+    """ Export the monitor checkpoint logs to CSV. """
+    from boba.wrangler import DIR_LOG
+    from .checkpoint import export_csv
+
+    dir_log = os.path.join(input, DIR_LOG)
+    check_path(dir_log)
+
+    for name in ['outcomes', 'sensitivity']:
+        fn = os.path.join(dir_log, f'{name}.bin')
+        out = os.path.join(dir_log, f'{name}.csv')
+        n = export_csv(fn, out)
+        if n:
+            click.echo(f'Wrote {n} rows to {out}')
+
+
+def parse_int_list(value, name):
+    """ Parse a comma-separated list of integers """
+    try:
+        return [int(v) for v in value.split(',')]
+    except ValueError:
+        print_help(f'Error: {name} must be comma-separated integers')
+
+
+@main.command()
+@click.option('--out', '-o', required=True, help='Path to the output folder')
+@click.option('--universes', type=int, default=None,
+              help='Number of universes  [default: all combinations]')
+@click.option('--decisions', default=4, show_default=True,
+              help='Number of decisions')
+@click.option('--options', default='3', show_default=True,
+              help='Options per decision, as one number or a list like 2,3,5')
+@click.option('--seed', default=0, show_default=True, help='Random seed')
+def synth(out, universes, decisions, options, seed):
+    """ Generate a synthetic multiverse. """
+    from .bench import synthetic
+
+    opts = parse_int_list(options, '--options')
+    opts = opts[0] if len(opts) == 1 else opts
+    try:
+        n = synthetic.generate(out, universes, decisions, opts, seed=seed)
+    except ValueError as e:
+        print_help(f'Error: {e}')
+    click.echo(f'Wrote {n} universes to {out}')
+
+
+@main.command()
+@click.option('--sizes', default='100,1000', show_default=True,
+              help='Comma-separated universe counts')
+@click.option('--decisions', default=4, show_default=True,
+              help='Number of decisions')
+@click.option('--options', default=3, show_default=True,
+              help='Options per decision')
+@click.option('--repeat', default=3, show_default=True,
+              help='Timed calls per routine')
+@click.option('--only', default='', help='Comma-separated routines to run')
+@click.option('--out', '-o', default=None, help='Write the results as JSON')
+@click.option('--baseline', default=None,
+              help='Compare with the JSON results of an earlier run')
+@click.option('--threshold', default=0.2, show_default=True,
+              help='Report a regression if slower than the baseline by more '
+              'than this fraction')
+@click.option('--validate', is_flag=True,
+              help='Also check the outcome CI estimators against the '
+              'bootstrap')
+def bench(sizes, decisions, options, repeat, only, out, baseline, threshold,
+          validate):
+    """ Time the statistical routines on synthetic multiverses. """
+    from .util import read_json, write_json
+    from .bench import micro
+
+    base = None
+    if baseline:
+        err, base = read_json(baseline)
+        if err:
+            print_help(err['message'])
+
+    only = [s for s in only.split(',') if s]
+    sizes = parse_int_list(sizes, '--sizes')
+    res = micro.run(sizes, decisions, options, repeat, only=only,
+                    log=click.echo)
+    if validate:
+        click.echo('\n{:<12}{:>6}{:>10}{:>10}{:>15}'.format(
+            'estimator', 'n', 'coverage', 'width', 'time'))
+        res['estimators'] = micro.validate_estimators(
+            max(sizes), n_decisions=decisions, n_options=options,
+            log=click.echo)
+    if out:
+        write_json(res, out, nice=True)
+
+    if base:
+        rows = micro.compare(res, base, threshold)
+        click.echo('\nCompared with the baseline:')
+        for r in rows:
+            line = '{name:<24}{size:>10}{ratio:>10.2f}x'.format(**r)
+            click.secho(line, fg='red' if r['regression'] else None)
+        if any([r['regression'] for r in rows]):
+            sys.exit(1)
+
+
+@main.command()
+@click.option('--in', '-i', 'input', default=None,
+              help='Use this data folder  [default: a synthetic multiverse]')
+@click.option('--universes', default=1000, show_default=True,
+              help='Number of universes in the synthetic multiverse, '
+              'ignored with --in')
+@click.option('--concurrency', default=16, show_default=True,
+              help='Number of concurrent HTTP clients')
+@click.option('--duration', default=10, show_default=True,
+              help='Seconds of load on each server')
+@click.option('--sockets', default=10, show_default=True,
+              help='Number of socket.io clients connected to the monitor')
+@click.option('--server-args', default='',
+              help='Extra boba-server options, such as "--production"')
+@click.option('--out', '-o', default=None, help='Write the report as JSON')
+@click.option('--baseline', default=None,
+              help='Compare with the JSON report of an earlier run')
+def loadtest(input, universes, concurrency, duration, sockets, server_args,
+             out, baseline):
+    """ Measure throughput and latency of the server under load. """
+    import shlex
+    from .util import read_json, write_json
+    from .bench import loadtest as lt
+
+    base = None
+    if baseline:
+        err, base = read_json(baseline)
+        if err:
+            print_help(err['message'])
+
+    try:
+        res = lt.run(universes, concurrency, duration, sockets,
+                     shlex.split(server_args), input, log=click.echo)
+    except RuntimeError as e:
+        print_help(f'Error: {e}')
+    if out:
+        write_json(res, out, nice=True)
+
+    click.echo('\n{:<24}{:>10}{:>8}{:>10}{:>10}{:>10}'.format('endpoint',
+               'req/s', 'errors', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for ep, r in res['endpoints'].items():
+        click.echo('{:<24}{:>10.1f}{:>8}{:>10.1f}{:>10.1f}{:>10.1f}'.format(
+            ep, r['throughput'], r['errors'], r.get('p50', float('nan')),
+            r.get('p95', float('nan')), r.get('p99', float('nan'))))
+    sk = res['sockets']
+    if 'error' in sk:
+        click.echo(f'\nsocket.io: {sk["error"]}')
+    elif sk:
+        click.echo('\nsocket.io: {alive_at_end}/{clients} connected, '
+                   'connect p50 {p50:.1f} ms, p95 {p95:.1f} ms'.format(**sk))
+
+    if base:
+        click.echo('\nCompared with the baseline (current / baseline):')
+        for r in lt.compare(res, base):
+            click.echo('{endpoint:<24}{throughput:>10.2f}x req/s'
+                       '{p50:>8.2f}x p50{p95:>8.2f}x p95{p99:>8.2f}x p99'
+                       .format(**r))
+
+
 if __name__ == '__main__':
     main()
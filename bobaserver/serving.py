@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+# ways to run the server beyond the single-process development server
+
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+import functools
+import traceback
+import contextvars
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from flask import jsonify
+from werkzeug.serving import ThreadedWSGIServer
+from werkzeug.serving import WSGIRequestHandler
+from . import profiling
+
+
+class BoundedThreadedWSGIServer(ThreadedWSGIServer):
+    """
+    A threaded server that handles at most `concurrency` connections at a
+    time. Further connections wait in the listen backlog. Werkzeug closes
+    every connection after one response, so `timeout` only bounds how long
+    a slow client may hold a thread.
+    """
+
+    def __init__(self, host, port, app, concurrency=64, timeout=5, fd=None):
+        handler = type('Handler', (WSGIRequestHandler,), {'timeout': timeout})
+        super().__init__(host, port, app, handler=handler, fd=fd)
+        self.slots = threading.BoundedSemaphore(concurrency)
+
+    def process_request(self, request, client_address):
+        self.slots.acquire()
+        try:
+            super().process_request(request, client_address)
+        except Exception:
+            self.slots.release()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self.slots.release()
+
+
+class Offloader:
+    """
+    Run heavy work in a pool of OS threads, so it cannot block the event
+    loop (gevent, eventlet) or take all request threads.
+    """
+
+    def __init__(self, async_mode='threading', workers=4, timeout=60):
+        self.async_mode = async_mode
+        self.timeout = timeout
+        if async_mode == 'gevent':
+            from gevent.threadpool import ThreadPool
+            self.pool = ThreadPool(workers)
+        elif async_mode == 'eventlet':
+            self.pool = None  # eventlet.tpool has its own threads
+        else:
+            self.pool = ThreadPoolExecutor(max_workers=workers)
+
+    def run(self, func, *args, **kwargs):
+        """
+        Call func in the pool, with the caller's (request) context. Flask
+        keeps the request and app context in context variables since 2.3,
+        so copying them carries request, g and the current dataset over.
+
+        On timeout, a job that has not started yet is cancelled. A running
+        job cannot be interrupted, so it finishes in the background and
+        its result is dropped.
+        """
+        ctx = contextvars.copy_context()
+        if self.async_mode == 'gevent':
+            from gevent import Timeout
+            res = self.pool.spawn(ctx.run, func, *args, **kwargs)
+            try:
+                return res.get(timeout=self.timeout)
+            except Timeout:
+                raise TimeoutError()
+        if self.async_mode == 'eventlet':
+            from eventlet import tpool
+            return tpool.execute(ctx.run, func, *args, **kwargs)
+        future = self.pool.submit(ctx.run, func, *args, **kwargs)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise
+
+
+# set by serve_production; heavy views run inline without it
+offloader = None
+
+
+def heavy(view):
+    """ Decorate a view that should run in the offload pool. """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if offloader is None:
+            return view(*args, **kwargs)
+        try:
+            return offloader.run(profiling.in_thread(view), *args, **kwargs)
+        except (FutureTimeout, TimeoutError):
+            msg = 'The request took too long and was abandoned.'
+            return jsonify({'status': 'fail', 'message': msg}), 200
+    return wrapper
+
+
+def serve_production(app, socketio, host, port, concurrency=64, keep_alive=5,
+                     timeout=60, heavy_workers=4):
+    """
+    Serve HTTP and socket.io with bounded concurrency. Use the gevent or
+    eventlet server if Flask-SocketIO picked one of them, then waitress if it
+    is installed, and a bounded threaded server otherwise. Keep-alive is not
+    available with the last one. Without the monitor, socketio is None and
+    only the threaded servers are used.
+    """
+    global offloader
+    mode = socketio.async_mode if socketio is not None else 'threading'
+    offloader = Offloader(mode, heavy_workers, timeout)
+
+    if mode == 'eventlet':
+        socketio.run(app, host=host, port=port, log_output=False,
+                     max_size=concurrency, keepalive=keep_alive,
+                     socket_timeout=timeout)
+    elif mode == 'gevent':
+        from gevent.pool import Pool
+        socketio.run(app, host=host, port=port, log_output=False,
+                     spawn=Pool(concurrency))
+    else:
+        try:
+            import waitress
+        except ImportError:
+            waitress = None
+
+        if waitress is not None:
+            waitress.serve(app, host=host, port=port, threads=concurrency,
+                           channel_timeout=keep_alive, ident='boba-server',
+                           _quiet=True)
+        else:
+            srv = BoundedThreadedWSGIServer(host, port, app, concurrency,
+                                            keep_alive)
+            srv.serve_forever()
+
+
+@contextmanager
+def shared_store(dataset):
+    """
+    Build a memory-mapped store of the dataset in shared memory (or a temp
+    folder if /dev/shm is unavailable), and remove it on exit. A dataset
+    loaded from its bundle is already memory mapped, so it is used as is.
+    """
+    if dataset.store is not None:
+        yield dataset.store
+        return
+
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else None
+    folder = tempfile.mkdtemp(prefix='boba-', dir=base)
+    try:
+        dataset.build_store(os.path.join(folder, 'store.bin'), raw=False)
+        yield dataset.store
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def serve_workers(app, host, port, workers, concurrency=64, keep_alive=5):
+    """
+    Serve the app from several forked worker processes that accept
+    connections on one shared socket. Anything loaded before calling this,
+    including memory-mapped stores, is shared with the workers.
+    """
+    sock = socket.create_server((host, port), backlog=128)
+    children = []
+    for i in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                srv = BoundedThreadedWSGIServer(host, port, app,
+                                                concurrency, keep_alive,
+                                                fd=sock.fileno())
+                srv.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            except Exception:
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        children.append(pid)
+
+    def stop(*args):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, lambda *args: stop())
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        stop()
+        for pid in children:
+            os.waitpid(pid, 0)
+    finally:
+        sock.close()
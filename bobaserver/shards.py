@@ -0,0 +1,248 @@
+# aggregate a multiverse run split across several folders, each written by
+# its own boba run, for example one per machine on a shared file system
+
+import os
+import time
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from boba.wrangler import DIR_LOG
+import bobaserver.common as common
+
+# seconds of recent progress used to estimate the throughput of a shard
+WINDOW = 300
+# a shard without progress for this many seconds is no longer running
+IDLE_AFTER = 300
+
+
+class Shard:
+  """
+  One run folder: the exit code and error message of the universes it has
+  run, its merged results, and the times its log grew, from which we
+  estimate its throughput and remaining time.
+  """
+
+  def __init__(self, folder, universes=None):
+    """
+    Parameters:
+     - folder: the multiverse folder the shard runs in
+     - universes: the (first, last) universe this shard runs, or None
+    """
+    self.folder = folder
+    self.name = os.path.basename(os.path.realpath(folder))
+    self.dir_log = os.path.join(folder, DIR_LOG)
+    self.file_log = os.path.join(self.dir_log, 'logs.csv')
+    self.universes = universes
+    self.size = None if universes is None else \
+      universes[1] - universes[0] + 1
+
+    self.logs = []  # [uid, exit_code] in the order they finished
+    self.signature = None  # mtime and size of the log when last read
+    self.history = deque()  # (time, number of universes done)
+    self.lock = threading.Lock()
+
+
+  def poll(self):
+    """ Read the log if it has changed, and return the exit codes """
+    with self.lock:
+      try:
+        st = os.stat(self.file_log)
+        sig = (st.st_mtime_ns, st.st_size)
+      except OSError:
+        st, sig = None, None
+      if sig == self.signature:
+        return self.logs
+
+      logs = []
+      if st is not None:
+        try:
+          df = pd.read_csv(self.file_log)
+          logs = df[['uid', 'exit_code']].values.tolist()
+        except (OSError, ValueError, KeyError):
+          return self.logs  # being written, read it next time
+      self.signature = sig
+
+      # a shorter log means the run started over
+      now = time.time()
+      if len(logs) < len(self.logs):
+        self.history.clear()
+      # when we first see a log, its progress is as of its last write
+      t = min(now, st.st_mtime) if st is not None and not self.history \
+        else now
+      self.history.append((t, len(logs)))
+      while len(self.history) > 2 and self.history[1][0] < now - WINDOW:
+        self.history.popleft()
+      self.logs = logs
+      return logs
+
+
+  def read_errors(self, uids):
+    """ The [uid, exit_code, message] of the failed universes among uids """
+    codes = dict([(int(u), c) for u, c in self.logs])
+    res = []
+    try:
+      files = os.listdir(self.dir_log)
+    except OSError:
+      return res
+    for f in files:
+      if f.startswith('error') and f.endswith('txt'):
+        uid = int(os.path.splitext(f)[0].split('_')[1])
+        if uid in uids and uid in codes:
+          with open(os.path.join(self.dir_log, f), 'r') as fo:
+            res.append([uid, codes[uid], fo.read()])
+    return res
+
+
+  def read_results(self, fields):
+    """ The merged results of this shard, or None if there are none yet """
+    try:
+      return common.read_results_batch(fields, self.folder)
+    except (OSError, ValueError, KeyError):
+      return None
+
+
+  def throughput(self):
+    """ Universes per second over the recent window, or None """
+    if len(self.history) < 2:
+      return None
+    (t0, n0), (t1, n1) = self.history[0], self.history[-1]
+    return (n1 - n0) / (t1 - t0) if t1 > t0 else None
+
+
+  def status(self):
+    """ A JSON-serializable summary of the progress of this shard """
+    done = len(self.logs)
+    failed = len([c for u, c in self.logs if c != 0])
+    rate = self.throughput()
+    last = self.history[-1][0] if len(self.history) else None
+    finished = self.size is not None and done >= self.size
+
+    time_left = None
+    if finished:
+      time_left = 0
+    elif self.size is not None and rate:
+      time_left = int((self.size - done) / rate)
+
+    return {'name': self.name, 'folder': self.folder,
+      'universes': None if self.universes is None else list(self.universes),
+      'size': self.size, 'done': done, 'failed': failed,
+      'throughput': rate, 'time_left': time_left,
+      'last_update': None if last is None else time.time() - last,
+      'is_running': not finished and last is not None and \
+        time.time() - last < IDLE_AFTER}
+
+
+class ShardSet:
+  """
+  The shards of a run, read in parallel. A universe finished by more than
+  one shard counts once, with the result of the first shard listed.
+  """
+
+  def __init__(self, shards, size):
+    """
+    Parameters:
+     - shards: a list of Shard
+     - size: the number of universes in the multiverse; shards without a
+       universe range split the universes not in any range evenly
+    """
+    self.shards = shards
+    self.size = size
+    self.pool = ThreadPoolExecutor(max_workers=max(1, min(len(shards), 16)))
+
+    # the finished universes in a stable order, and how much of the log of
+    # each shard they include
+    self.done = []
+    self.seen = set()
+    self.consumed = [0] * len(shards)
+    self.lock = threading.Lock()
+
+    free = [s for s in shards if s.size is None]
+    if len(free):
+      taken = sum([s.size for s in shards if s.size is not None])
+      n = max(0, size - taken)
+      for i, s in enumerate(free):
+        s.size = n // len(free) + (1 if i < n % len(free) else 0)
+
+
+  def _map(self, func):
+    # call func on each shard in the pool, within the current context
+    futures = [self.pool.submit(contextvars.copy_context().run, func, s)
+      for s in self.shards]
+    return [f.result() for f in futures]
+
+
+  def files(self):
+    """ The log file of each shard, to watch for progress """
+    return [s.file_log for s in self.shards]
+
+
+  def poll(self):
+    """
+    The [uid, exit_code] of every finished universe. The universes finished
+    since the last poll are appended with the logs of the shards
+    interleaved, so a prefix samples every shard in proportion, and the
+    order of the universes already returned never changes.
+    """
+    logs = self._map(lambda s: s.poll())
+    with self.lock:
+      new = []
+      for k, l in enumerate(logs):
+        new.append(l[min(self.consumed[k], len(l)):])
+        self.consumed[k] = len(l)
+      for i in range(max([len(l) for l in new] + [0])):
+        for l in new:
+          if i < len(l) and l[i][0] not in self.seen:
+            self.seen.add(l[i][0])
+            self.done.append(l[i])
+      return list(self.done)
+
+
+  def read_errors(self, uids):
+    """ The [uid, exit_code, message] of the failed universes among uids """
+    uids = set(uids)
+    res = []
+    for errors in self._map(lambda s: s.read_errors(uids)):
+      res += [e for e in errors if e[0] in uids]
+      uids.difference_update([e[0] for e in errors])
+    return res
+
+
+  def read_results(self, fields):
+    """ The merged results of all shards, or None if there are none yet """
+    dfs = [df for df in self._map(lambda s: s.read_results(fields))
+      if df is not None]
+    if not len(dfs):
+      return None
+    df = pd.concat(dfs, ignore_index=True)
+    return df.drop_duplicates('uid', keep='first').reset_index(drop=True)
+
+
+  def status(self):
+    """ The progress of each shard """
+    return [s.status() for s in self.shards]
+
+
+  def is_running(self):
+    return any([s['is_running'] for s in self.status()])
+
+
+  def is_finished(self):
+    """
+    Whether every universe is done, or every shard has a range and has
+    finished it. Shards without a range may run any number of universes, so
+    until then the run could still change.
+    """
+    if len(self.seen) >= self.size:
+      return True
+    return all([s.universes is not None and s.status()['time_left'] == 0
+      for s in self.shards])
+
+
+  def time_left(self):
+    """ Seconds until the slowest shard finishes, or None if unknown """
+    times = [s['time_left'] for s in self.status()]
+    if any([t is None for t in times]):
+      return None
+    return max(times + [0])
@@ -0,0 +1,191 @@
+# a read-only, memory-mapped container of named arrays
+
+import json
+import mmap
+import struct
+import numpy as np
+
+MAGIC = b'BOBASTR1'
+ALIGN = 64
+FOOTER = struct.Struct('<Q8s')
+
+
+class StoreWriter:
+  """
+  Write named arrays into one file. Each array is aligned so it can be
+  viewed in place once the file is memory mapped, and an index of names,
+  offsets, dtypes and shapes is written at the end.
+  """
+
+  def __init__(self, fn):
+    self.fn = fn
+    self.index = {}
+    self.f = open(fn, 'wb')
+    self.f.write(MAGIC)
+
+
+  def add(self, name, arr):
+    """ Add a numeric numpy array. """
+    arr = np.ascontiguousarray(arr)
+    if arr.dtype.hasobject:
+      raise ValueError(f'Cannot store object array "{name}"')
+
+    self.f.write(b'\0' * (-self.f.tell() % ALIGN))
+    self.index[name] = {'offset': self.f.tell(), 'dtype': arr.dtype.str,
+      'shape': list(arr.shape)}
+    self.f.write(arr.tobytes())
+
+
+  def add_chunks(self, name, chunks, dtype):
+    """
+    Add an array written chunk by chunk along its first axis, so it never
+    has to be in memory at once. All chunks must have the same trailing
+    shape. If the iterable raises, the array is not added and the bytes
+    written for it are discarded.
+    """
+    dtype = np.dtype(dtype)
+    start = self.f.tell()
+    self.f.write(b'\0' * (-start % ALIGN))
+    offset = self.f.tell()
+    n = 0
+    tail = None
+    try:
+      for c in chunks:
+        c = np.ascontiguousarray(c, dtype=dtype)
+        tail = c.shape[1:] if tail is None else tail
+        if c.shape[1:] != tail:
+          raise ValueError(f'Chunks of "{name}" have different shapes')
+        self.f.write(c.tobytes())
+        n += c.shape[0]
+    except BaseException:
+      self.f.seek(start)
+      self.f.truncate()
+      raise
+    self.index[name] = {'offset': offset, 'dtype': dtype.str,
+      'shape': [n] + list(tail or ())}
+
+
+  def add_json(self, name, obj):
+    """ Add a JSON-serializable object. """
+    self.add(name, np.frombuffer(json.dumps(obj).encode('utf-8'), np.uint8))
+    self.index[name]['kind'] = 'json'
+
+
+  def add_column(self, name, values):
+    """
+    Add a table column. Numbers are stored as they are, and anything else is
+    stored as integer codes into a list of unique strings.
+    """
+    arr = np.asarray(values)
+    if arr.dtype.kind in 'biuf':
+      self.add(name, arr)
+      return
+
+    cats, codes = np.unique(arr.astype(str), return_inverse=True)
+    self.add(name, codes.astype(np.int32))
+    self.index[name]['kind'] = 'category'
+    self.index[name]['categories'] = cats.tolist()
+
+
+  def add_table(self, name, header, columns):
+    """ Add a table as a header and a list of columns. """
+    self.add_json(f'{name}/header', header)
+    for i, col in enumerate(columns):
+      self.add_column(f'{name}/{i}', col)
+
+
+  def close(self):
+    offset = self.f.tell()
+    self.f.write(json.dumps(self.index).encode('utf-8'))
+    self.f.write(FOOTER.pack(offset, MAGIC))
+    self.f.close()
+
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+
+class Store:
+  """
+  Memory map a file written by StoreWriter. Arrays are read-only views into
+  the mapping, so processes forked after opening share the same pages.
+  """
+
+  def __init__(self, fn):
+    self.fn = fn
+    with open(fn, 'rb') as f:
+      self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if self.mm[:len(MAGIC)] != MAGIC:
+      raise ValueError(f'{fn} is not a boba store')
+    offset, magic = FOOTER.unpack(self.mm[-FOOTER.size:])
+    if magic != MAGIC:
+      raise ValueError(f'{fn} is truncated')
+    self.index = json.loads(self.mm[offset:-FOOTER.size].decode('utf-8'))
+
+
+  def __contains__(self, name):
+    return name in self.index
+
+
+  def keys(self):
+    return self.index.keys()
+
+
+  def get(self, name):
+    """ Return the raw array, without copying. """
+    info = self.index[name]
+    dtype = np.dtype(info['dtype'])
+    count = int(np.prod(info['shape'])) if len(info['shape']) else 1
+    arr = np.frombuffer(self.mm, dtype=dtype, count=count,
+      offset=info['offset'])
+    return arr.reshape(info['shape'])
+
+
+  def get_json(self, name):
+    return json.loads(self.get(name).tobytes().decode('utf-8'))
+
+
+  def get_column(self, name):
+    """ Return a column as a list, decoding strings if necessary. """
+    info = self.index[name]
+    arr = self.get(name)
+    if info.get('kind') == 'category':
+      cats = info['categories']
+      return [cats[i] for i in arr.tolist()]
+    return arr.tolist()
+
+
+  def get_values(self, name):
+    """
+    Return a column as a numpy array: numbers without copying, and strings
+    as an object array.
+    """
+    info = self.index[name]
+    arr = self.get(name)
+    if info.get('kind') == 'category':
+      cats = np.asarray(info['categories'], dtype=object)
+      return cats[arr] if len(cats) else np.empty(arr.shape, dtype=object)
+    return arr
+
+
+  def get_frame(self, name):
+    """ Return a table as a pandas DataFrame """
+    import pandas as pd
+    header = self.get_json(f'{name}/header')
+    return pd.DataFrame({h: self.get_values(f'{name}/{i}')
+      for i, h in enumerate(header)}, columns=header)
+
+
+  def get_table(self, name):
+    """ Return the header and the list of columns of a table. """
+    header = self.get_json(f'{name}/header')
+    cols = [self.get_column(f'{name}/{i}') for i in range(len(header))]
+    return header, cols
+
+
+  def nbytes(self):
+    return len(self.mm)
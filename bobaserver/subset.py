@@ -0,0 +1,124 @@
+# decision sensitivity of filtered subsets of the multiverse
+
+import sys
+import threading
+from collections import OrderedDict
+import numpy as np
+from .bobastats import sensitivity
+from .bobastats.accumulator import decision_codes
+
+# sensitivity methods, as in the "sensitivity" option of overview.json
+METHODS = ('f', 'ks', 'ad')
+# number of (filter, method) results kept per dataset
+CAPACITY = 256
+# each option needs this many universes for the AD test, as in ad_wrapper
+MIN_AD_GROUP = 3
+
+
+class SubsetSensitivity:
+  """
+  The decisions of each universe with a valid point estimate, coded as
+  integers, to compute the sensitivity of every decision within the subset of
+  universes matching a filter. Results are kept in an LRU cache keyed by the
+  filter and the method.
+  """
+
+  def __init__(self, summary, decisions, estimates, capacity=CAPACITY):
+    """
+    Parameters:
+     - summary: the summary table joined with the point estimates, without
+       missing estimates
+     - decisions: a list of {'var': name, 'options': [...]}
+     - estimates: the point estimate of each row
+     - capacity: the number of results to cache
+    """
+    self.estimates = np.asarray(estimates, dtype=float)
+    self.decisions = [(d['var'], [str(o) for o in d['options']])
+      for d in decisions]
+    self.codes = decision_codes(summary, decisions)
+
+    self.capacity = capacity
+    self.cache = OrderedDict()
+    self.lock = threading.Lock()
+
+
+  def nbytes(self):
+    """ The coded decisions and estimates, and the cached results """
+    with self.lock:
+      results = sum([sys.getsizeof(k) + sys.getsizeof(v) +
+        sys.getsizeof(v['scores']) for k, v in self.cache.items()])
+    return self.estimates.nbytes + self.codes.nbytes + results
+
+
+  def mask(self, filters):
+    """
+    The rows matching the filters, a dict from decision name to a list of
+    options. Raises KeyError on an unknown decision or option.
+    """
+    names = [dec for dec, opts in self.decisions]
+    res = np.ones(len(self.estimates), dtype=bool)
+    for dec, opts in filters.items():
+      if not len(opts):
+        continue
+      if dec not in names:
+        raise KeyError(dec)
+      i = names.index(dec)
+      options = self.decisions[i][1]
+      codes = []
+      for o in opts:
+        if str(o) not in options:
+          raise KeyError(o)
+        codes.append(options.index(str(o)))
+      res &= np.isin(self.codes[:, i], codes)
+    return res
+
+
+  def compute(self, filters, method):
+    """
+    Sensitivity of each decision within the universes matching the filters.
+    Options without any matching universe are left out, so a decision fixed
+    by the filter has a score of 0. A score that cannot be computed, such as
+    AD with fewer than 3 universes in an option, is None.
+
+    Returns: a dict with the number of matching universes and the scores
+    """
+    key = (method, tuple(sorted([(dec, tuple(sorted(set(map(str, opts)))))
+      for dec, opts in filters.items() if len(opts)])))
+    with self.lock:
+      if key in self.cache:
+        self.cache.move_to_end(key)
+        return self.cache[key]
+
+    m = self.mask(filters)
+    values = self.estimates[m]
+    codes = self.codes[m]
+    scores = {}
+    for i, (dec, opts) in enumerate(self.decisions):
+      s = _score(method, values, codes[:, i], len(opts))
+      scores[dec] = None if s is None or not np.isfinite(s) else float(s)
+    res = {'count': int(m.sum()), 'scores': scores}
+
+    with self.lock:
+      self.cache[key] = res
+      while len(self.cache) > self.capacity:
+        self.cache.popitem(last=False)
+    return res
+
+
+def _score(method, values, codes, k):
+  # sensitivity of one decision, from the values and option code of each row
+  if method == 'f':
+    return sensitivity.f_codes(values, codes, k)
+
+  groups = [values[codes == j] for j in range(k)]
+  groups = [g for g in groups if len(g)]
+  if len(groups) < 2:
+    return 0
+  if method == 'ks':
+    return sensitivity.ks_groups(groups)
+  if min([len(g) for g in groups]) < MIN_AD_GROUP:
+    return None
+  try:
+    return sensitivity.ad_groups(groups)[0]
+  except (ValueError, IndexError):
+    return None
@@ -4,6 +4,7 @@ import csv
 import json
 import pandas as pd
 import numpy as np
+from .metrics import timed
 
 
 class Colors:
@@ -39,7 +40,7 @@ def read_csv(fn, row_start=1):
         return err, None
 
     res = []
-    with open(fn, 'r', newline='') as f:
+    with timed('parse'), open(fn, 'r', newline='') as f:
         reader = csv.reader(f, delimiter=',')
         for row in reader:
             res.append(row)
@@ -0,0 +1,170 @@
+# notify a callback when files change, without a fixed polling schedule
+
+import os
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+import traceback
+
+# inotify flags, see <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0o4000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | \
+  IN_DELETE_SELF
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def _load_inotify():
+  """ Return libc if it supports inotify, otherwise None """
+  try:
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    libc.inotify_init1
+    libc.inotify_add_watch
+    return libc
+  except (OSError, AttributeError, TypeError):
+    return None
+
+
+class FileWatcher:
+  """
+  Call a function when any of the given files changes. It uses inotify on
+  the parent directories where available, and otherwise polls the files with
+  an interval that shrinks on activity and grows when idle. Bursts of changes
+  are debounced into a single call.
+  """
+
+  def __init__(self, paths, callback, debounce=0.5, min_interval=0.5,
+    max_interval=5, use_inotify=True):
+    """
+    Parameters:
+     - paths: a list of files to watch; they do not need to exist yet
+     - callback: called with the set of changed paths
+     - debounce: seconds to wait for more changes before calling, which is
+       also the minimum gap between two calls
+     - min_interval, max_interval: bounds of the polling interval
+     - use_inotify: if false, always poll
+    """
+    self.paths = [os.path.realpath(p) for p in paths]
+    self.callback = callback
+    self.debounce = debounce
+    self.min_interval = min_interval
+    self.max_interval = max_interval
+    self.libc = _load_inotify() if use_inotify else None
+    self.thread = None
+    self.stopped = threading.Event()
+
+
+  def start(self):
+    if self.thread is not None and self.thread.is_alive():
+      return
+    self.stopped.clear()
+    target = self._run_inotify if self.libc else self._run_polling
+    self.thread = threading.Thread(target=target, daemon=True)
+    self.thread.start()
+
+
+  def stop(self):
+    # safe to call from the callback, as we do not join the thread
+    self.stopped.set()
+
+
+  def _fire(self, changed):
+    # debounce, then call
+    self.stopped.wait(self.debounce)
+    if not self.stopped.is_set() and len(changed):
+      try:
+        self.callback(set(changed))
+      except Exception:
+        # keep watching even if one update fails
+        traceback.print_exc()
+
+
+  def _signature(self, p):
+    try:
+      st = os.stat(p)
+      return st.st_mtime_ns, st.st_size
+    except OSError:
+      return None
+
+
+  def _run_polling(self):
+    last = {p: self._signature(p) for p in self.paths}
+    interval = self.min_interval
+    while not self.stopped.wait(interval):
+      now = {p: self._signature(p) for p in self.paths}
+      changed = [p for p in self.paths if now[p] != last[p]]
+      last = now
+      if len(changed):
+        interval = self.min_interval
+        self._fire(changed)
+      else:
+        interval = min(interval * 1.5, self.max_interval)
+
+
+  def _run_inotify(self):
+    fd = self.libc.inotify_init1(IN_NONBLOCK)
+    if fd < 0:
+      return self._run_polling()
+
+    # directory -> basenames we care about
+    dirs = {}
+    for p in self.paths:
+      dirs.setdefault(os.path.dirname(p), set()).add(os.path.basename(p))
+    wds = {}
+
+    try:
+      while not self.stopped.is_set():
+        # (re-)arm watches on directories that appeared since the last round
+        changed = set()
+        for d in dirs:
+          if d in wds.values() or not os.path.isdir(d):
+            continue
+          wd = self.libc.inotify_add_watch(fd, d.encode(), WATCH_MASK)
+          if wd >= 0:
+            wds[wd] = d
+            # the files might have been written before we started watching
+            changed.update(os.path.join(d, n) for n in dirs[d])
+
+        timeout = self.min_interval if len(wds) < len(dirs) \
+          else self.max_interval
+        if not len(changed):
+          ready, _, _ = select.select([fd], [], [], timeout)
+          if ready:
+            changed = self._read_events(fd, wds, dirs)
+
+        if len(changed):
+          self._fire(changed)
+    finally:
+      os.close(fd)
+
+
+  def _read_events(self, fd, wds, dirs):
+    changed = set()
+    try:
+      buf = os.read(fd, 64 * 1024)
+    except BlockingIOError:
+      return changed
+
+    i = 0
+    while i + EVENT_HEADER.size <= len(buf):
+      wd, mask, _, n = EVENT_HEADER.unpack_from(buf, i)
+      name = buf[i + EVENT_HEADER.size:i + EVENT_HEADER.size + n]
+      name = name.rstrip(b'\0').decode(errors='replace')
+      i += EVENT_HEADER.size + n
+
+      d = wds.get(wd)
+      if d is None:
+        continue
+      if mask & (IN_IGNORED | IN_DELETE_SELF):
+        # the directory is gone; it will be watched again once re-created
+        del wds[wd]
+      elif name in dirs[d]:
+        changed.add(os.path.join(d, name))
+    return changed
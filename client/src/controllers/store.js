@@ -6,6 +6,9 @@ import _ from 'lodash'
 import {default_config, bus} from './config'
 import {SCHEMA, DTYPE, RUN_STATUS} from './constants'
 
+// quantiles per universe to fetch of the uncertainty and null distribution
+const SAMPLE_RESOLUTION = 64
+
 /**
  * Shared data store across pages.
  */
@@ -75,6 +78,8 @@ class Store {
     this.exit_code = {} // key is UID, value is exit code
     this.running_outcome = []  // attributes: n_samples, mean, lower, upper
     this.running_sensitivity = []  // n_samples, type, ... (every decision)
+    this.running_f_sensitivity = null  // n_samples, decisions (F score, option stats)
+    this.running_shards = []  // name, size, done, failed, throughput, time_left
     this.error_messages = []  // uid, exit_code, message, group
     this.outcomes = [] // uid, exit_code, ... (field in SCHEMA)
 
@@ -112,6 +117,11 @@ class Store {
       bus.$emit('/monitor/update-sensitivity')
     })
 
+    this.socket.on('update-f-sensitivity', (msg) => {
+      this.running_f_sensitivity = msg
+      bus.$emit('/monitor/update-f-sensitivity')
+    })
+
     this.socket.on('stopped', () => {
       this.running_status = this._deriveRunStatus(false, _.size(this.exit_code))
       bus.$emit('/monitor/update')
@@ -129,7 +139,7 @@ class Store {
         return
       }
 
-      http.post('/api/get_universes')
+      http.post('api/get_universes')
         .then((response) => {
           let msg = response.data
 
@@ -161,27 +171,19 @@ class Store {
    */
   fetchRaw (uids) {
     return new Promise((resolve, reject) => {
-      // send requests
-      Promise.all(_.map(uids, (u) => http.post('/api/get_raw', {'uid': u})))
-        .then((values) => {
-          let err = ''
-          let ret = _.map(values, (response, idx) => {
-            let msg = response.data
-
-            if (msg && msg.status === 'success') {
-              let actual = msg.data[0]
-              let pred = msg.data[1]
-
-              return {'actual': actual, 'pred': pred, 'uid': uids[idx]}
-            } else {
-              err = msg.message || 'Internal server error.'
-            }
-          })
+      // send one request for all universes
+      http.post('api/get_raw_batch', {'uids': uids})
+        .then((response) => {
+          let msg = response.data
 
-          if (err) {
-            reject(err)
+          if (msg && msg.status === 'success' && _.isEmpty(msg.errors)) {
+            resolve(_.map(msg.data, (d, idx) => {
+              return {'actual': d[0], 'pred': d[1], 'uid': uids[idx]}
+            }))
+          } else if (msg && msg.status === 'success') {
+            reject(_.values(msg.errors)[0])
           } else {
-            resolve(ret)
+            reject(msg.message || 'Internal server error.')
           }
         }, () => {
           reject('Network error.')
@@ -200,7 +202,7 @@ class Store {
         return
       }
 
-      http.post('/api/get_overview')
+      http.post('api/get_overview')
         .then((response) => {
           let msg = response.data
 
@@ -242,7 +244,7 @@ class Store {
         return
       }
 
-      http.post('/api/get_pred')
+      http.post('api/get_pred')
         .then((response) => {
           let msg = response.data
 
@@ -307,7 +309,7 @@ class Store {
         return
       }
 
-      http.post('/api/get_uncertainty')
+      http.post('api/get_uncertainty', {resolution: SAMPLE_RESOLUTION})
         .then((response) => {
           let msg = response.data
 
@@ -339,7 +341,7 @@ class Store {
         return
       }
 
-      http.post('/api/get_null')
+      http.post('api/get_null', {resolution: SAMPLE_RESOLUTION})
         .then((response) => {
           let msg = response.data
 
@@ -365,6 +367,9 @@ class Store {
     let done = _.size(this.exit_code)
     this.running_status = this._deriveRunStatus(msg['is_running'], done, msg['size'])
     this.time_left = msg['time_left']
+    if ('shards' in msg) {
+      this.running_shards = msg['shards']
+    }
 
     // these fields will only be in the client-initiated update
     if ('outcome' in msg) {
@@ -374,6 +379,9 @@ class Store {
     if ('decision_scores' in msg) {
       this._wrangleMonitorSensitivity(msg['decision_scores'])
     }
+    if ('f_sensitivity' in msg) {
+      this.running_f_sensitivity = msg['f_sensitivity']
+    }
   }
 
   _wrangleMonitorSensitivity (msg) {
@@ -393,7 +401,7 @@ class Store {
 
   fetchMonitorSnapshot () {
     return new Promise((resolve, reject) => {
-      http.post('/api/monitor/get_snapshot')
+      http.post('api/monitor/get_snapshot')
         .then((response) => {
           let msg = response.data
           if (msg && msg.status === 'success') {
@@ -408,7 +416,7 @@ class Store {
 
   fetchMonitorStatus () {
     return new Promise((resolve, reject) => {
-      http.post('/api/monitor/inquire_progress')
+      http.post('api/monitor/inquire_progress')
         .then((response) => {
           let msg = response.data
           if (msg && msg.status === 'success') {
@@ -421,7 +429,7 @@ class Store {
 
   startRuntime () {
     return new Promise((resolve, reject) => {
-      http.post('/api/monitor/start_runtime', {})
+      http.post('api/monitor/start_runtime', {})
         .then((rsp) => {
           if (rsp.data && rsp.data.status === 'success') {
             this.running_status = RUN_STATUS.RUNNING
@@ -429,6 +437,7 @@ class Store {
             this.exit_code = {}
             this.running_outcome = []
             this.running_sensitivity = []
+            this.running_f_sensitivity = null
             this.sensitivity = {}
             this.outcomes = []
             this.error_messages = []
@@ -443,7 +452,7 @@ class Store {
 
   resumeRuntime () {
     return new Promise((resolve, reject) => {
-      http.post('/api/monitor/resume_runtime')
+      http.post('api/monitor/resume_runtime')
         .then((rsp) => {
           if (rsp.data && rsp.data.status === 'success') {
             this.running_status = RUN_STATUS.RUNNING
@@ -455,7 +464,7 @@ class Store {
 
   stopRuntime () {
     return new Promise((resolve, reject) => {
-      http.post('/api/monitor/stop_runtime')
+      http.post('api/monitor/stop_runtime')
         .then((rsp) => {
           if (rsp.data && rsp.data.status === 'success') {
             this.running_status = RUN_STATUS.STOPPING
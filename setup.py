@@ -9,9 +9,10 @@ with open("README.rst", "r") as fh:
 with open('HISTORY.rst') as history_file:
     history = history_file.read()
 
-requirements = ['flask>=1.1.1', 'Click>=7.0', 'pandas>=1.0.1', 'scipy>=1.4.1',
-    'boba>=1.1.1', 'flask-socketio>=5.0.0', 'apscheduler>=3.7.0',
-    'scikit-learn>=0.24.1']
+requirements = ['flask>=2.3.0', 'Click>=7.0', 'pandas>=1.0.1', 'scipy>=1.4.1',
+    'boba>=1.1.1', 'flask-socketio>=5.0.0', 'apscheduler>=3.7.0']
+
+extra_requirements = {'production': ['waitress>=2.0.0']}
 
 setup_requirements = []
 
@@ -32,8 +33,7 @@ setup(
         'License :: OSI Approved :: BSD License',
         'Natural Language :: English',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.6',
-        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
     ],
     entry_points={
         'console_scripts': [
@@ -41,6 +41,7 @@ setup(
         ],
     },
     install_requires=requirements,
+    extras_require=extra_requirements,
     long_description=readme + '\n\n' + history,
     packages=find_packages(include=['bobaserver', 'bobaserver.*']),
     setup_requires=setup_requirements,
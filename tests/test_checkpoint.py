@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import numpy as np
+from bobaserver.checkpoint import CheckpointLog, read_log, to_rows, export_csv
+
+FIELDS = [('n_samples', '<i8'), ('type', 'S8'), ('a', '<f8')]
+
+
+class TestCheckpointLog(unittest.TestCase):
+
+  def setUp (self):
+    self.folder = tempfile.mkdtemp()
+    self.fn = os.path.join(self.folder, 'log.bin')
+
+  def tearDown (self):
+    shutil.rmtree(self.folder)
+
+  def test_round_trip (self):
+    log = CheckpointLog(self.fn, FIELDS, flush_size=2)
+    self.assertIsNone(read_log(self.fn))
+    log.append([[1, b'score', 0.5], [2, b'p', np.nan]])
+    log.append([[3, b'score', 1.5]])
+    log.flush()
+    arr = read_log(self.fn)
+    self.assertEqual(to_rows(arr), [[1, 'score', 0.5], [2, 'p', 'nan'],
+      [3, 'score', 1.5]])
+
+    out = os.path.join(self.folder, 'log.csv')
+    self.assertEqual(export_csv(self.fn, out), 3)
+    with open(out) as f:
+      self.assertEqual(f.readline().strip(), 'n_samples,type,a')
+
+  def test_partial_record (self):
+    log = CheckpointLog(self.fn, FIELDS)
+    log.append([[1, b'score', 0.5]])
+    log.flush()
+    with open(self.fn, 'ab') as f:
+      f.write(b'\0' * 5)
+    self.assertEqual(read_log(self.fn).shape[0], 1)
+
+  def test_concurrent_appends (self):
+    # no row is lost when threads append and flush at the same time
+    log = CheckpointLog(self.fn, FIELDS, flush_size=3)
+
+    def work(t):
+      for i in range(200):
+        log.append([[t * 1000 + i, b'score', float(i)]])
+
+    threads = [threading.Thread(target=work, args=(t,)) for t in range(4)]
+    for th in threads:
+      th.start()
+    for th in threads:
+      th.join()
+    log.flush()
+    ids = sorted(read_log(self.fn)['n_samples'].tolist())
+    self.assertEqual(ids, sorted([t * 1000 + i for t in range(4)
+      for i in range(200)]))
+
+
+if __name__ == '__main__':
+  unittest.main()
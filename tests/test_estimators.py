@@ -0,0 +1,95 @@
+import subprocess
+import sys
+import unittest
+import numpy as np
+import pandas as pd
+from bobaserver import run_server
+from bobaserver.bobastats import estimators, sampling
+
+
+def multiverse (n_decisions, n_options=4, seed=3):
+  # every combination of options, with additive option effects and noise
+  rng = np.random.default_rng(seed)
+  codes = np.array(np.meshgrid(*[np.arange(n_options)] * n_decisions,
+    indexing='ij')).reshape(n_decisions, -1).T
+  effect = rng.normal(0, 1, (n_decisions, n_options))
+  y = sum(effect[d][codes[:, d]] for d in range(n_decisions))
+  return codes, y + rng.normal(0, 0.5, len(y))
+
+
+def width (ci):
+  return ci[2] - ci[1]
+
+
+class TestEstimatorNames(unittest.TestCase):
+
+  def test_cli_choices (self):
+    self.assertEqual(run_server.ESTIMATORS, estimators.ESTIMATORS)
+
+  def test_cli_without_numpy (self):
+    code = 'import sys, bobaserver.run_server; ' \
+      'print("numpy" in sys.modules)'
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True,
+      text=True, check=True)
+    self.assertEqual(out.stdout.strip(), 'False')
+
+
+class TestEstimators(unittest.TestCase):
+
+  def setUp (self):
+    self.codes, self.y = multiverse(4)
+    self.df = pd.DataFrame({'y': self.y})
+    self.rng = np.random.default_rng(4)
+
+  def assertLike (self, ci, bs):
+    # same mean, and a CI about as wide as the bootstrap one
+    self.assertAlmostEqual(ci[0], bs[0], delta=0.05 * width(bs))
+    self.assertTrue(0.8 < width(ci) / width(bs) < 1.2)
+
+  def test_uniform (self):
+    idx = self.rng.choice(len(self.y), 120, replace=False)
+    bs = sampling.estimate_outcome(self.df, 'y', idx, seed=0)
+    self.assertLike(estimators.delta_ci(self.y, idx), bs)
+    self.assertLike(estimators.snis_ci(self.y, idx), bs)
+
+  def test_weighted (self):
+    p = np.exp(0.3 * self.codes[:, 0])
+    p = p / p.sum()
+    idx = self.rng.choice(len(self.y), 120, replace=False, p=p)
+    w = 1 / (len(self.y) * p)
+    bs = sampling.estimate_outcome(self.df, 'y', idx, w, seed=0)
+    self.assertLike(estimators.delta_ci(self.y, idx, w), bs)
+    ci = estimators.snis_ci(self.y, idx, w)
+    self.assertTrue(0.8 < width(ci) / width(bs) < 1.2)
+    self.assertTrue(bs[1] < ci[0] < bs[2])
+
+  def test_stratified (self):
+    # against a bootstrap within each stratum, on a multiverse large
+    # enough that sampling without replacement barely narrows the CI
+    codes, y = multiverse(5)
+    strata = estimators.round_robin_strata(codes)
+    idx = self.rng.choice(len(y), 120, replace=False)
+    ci = estimators.stratified_ci(y, idx, strata)
+
+    boot = np.random.default_rng(0)
+    share = np.bincount(strata) / len(strata)
+    groups = [y[idx][strata[idx] == s] for s in range(len(share))]
+    means = [np.dot(share, [boot.choice(g, len(g)).mean() for g in groups])
+      for _ in range(2000)]
+    bs = [np.mean(means)] + list(np.percentile(means, [2.5, 97.5]))
+    self.assertLike(ci, bs)
+
+    # the strata explain most of the variance
+    plain = estimators.delta_ci(y, idx)
+    self.assertLess(width(ci), 0.8 * width(plain))
+
+  def test_empty (self):
+    y = np.full(10, np.nan)
+    self.assertTrue(np.isnan(estimators.delta_ci(y, [1, 2])).all())
+    self.assertTrue(np.isnan(estimators.snis_ci(y, [1, 2])).all())
+    self.assertTrue(np.isnan(
+      estimators.stratified_ci(y, [1, 2], np.zeros(10))).all())
+
+
+if __name__ == '__main__':
+  unittest.main()
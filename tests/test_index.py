@@ -0,0 +1,59 @@
+import unittest
+import numpy as np
+import pandas as pd
+from bobaserver.index import DecisionIndex, popcount
+
+
+class TestDecisionIndex(unittest.TestCase):
+
+  def setUp (self):
+    rng = np.random.default_rng(5)
+    n = 37
+    self.decisions = [{'var': 'a', 'options': ['x', 'y', 'z']},
+      {'var': 'b', 'options': [0, 1]}]
+    self.df = pd.DataFrame({'a': rng.choice(['x', 'y', 'z'], n),
+      'b': rng.choice([0, 1], n)})
+    est = rng.normal(0, 1, n)
+    est[[3, 10]] = np.nan
+    est[5] = np.inf
+    self.est = est
+    self.index = DecisionIndex(self.df, self.decisions, est)
+
+  def test_popcount (self):
+    bits = np.packbits(np.array([1, 0, 1, 1, 0, 0, 0, 1, 1], dtype=bool))
+    self.assertEqual(popcount(bits), 5)
+
+  def test_aggregate_matches_pandas (self):
+    filters = {'a': ['x', 'z'], 'b': [1]}
+    res = self.index.aggregate(filters, bins=5)
+    match = self.df['a'].isin(['x', 'z']) & (self.df['b'] == 1)
+    est = self.est[match.to_numpy() & np.isfinite(self.est)]
+    self.assertEqual(res['total'], len(self.df))
+    self.assertEqual(res['count'], int(match.sum()))
+    self.assertEqual(res['valid'], len(est))
+    self.assertAlmostEqual(res['mean'], est.mean())
+    lo, hi = self.index.range
+    counts, edges = np.histogram(est, bins=5, range=(lo, hi))
+    self.assertEqual(res['histogram']['counts'], counts.tolist())
+    np.testing.assert_allclose(res['histogram']['edges'], edges)
+
+    # per option counts within the match
+    b = res['decisions'][1]['options']
+    self.assertEqual([o['count'] for o in b], [0, int(match.sum())])
+
+  def test_empty_filter_selects_all (self):
+    res = self.index.aggregate({'a': []})
+    self.assertEqual(res['count'], len(self.df))
+
+  def test_bad_filters_and_range (self):
+    with self.assertRaises(KeyError):
+      self.index.aggregate({'c': ['x']})
+    with self.assertRaises(KeyError):
+      self.index.aggregate({'a': ['w']})
+    for bounds in [(1, 1), (2, 1), (0, np.inf), (np.nan, 1)]:
+      with self.assertRaises(ValueError):
+        self.index.aggregate({}, bounds=bounds)
+
+
+if __name__ == '__main__':
+  unittest.main()
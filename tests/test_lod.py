@@ -0,0 +1,45 @@
+import unittest
+import numpy as np
+from bobaserver.lod import LevelOfDetail
+
+
+class TestLevelOfDetail(unittest.TestCase):
+
+  def setUp (self):
+    rng = np.random.default_rng(6)
+    self.uids = np.repeat([3, 1, 2], [500, 5, 40])
+    self.values = rng.normal(0, 1, len(self.uids))
+    self.values[7] = np.nan
+    self.lod = LevelOfDetail(self.uids, self.values, levels=(4, 16), bins=8)
+
+  def samples (self, uid):
+    v = self.values[self.uids == uid]
+    return v[np.isfinite(v)]
+
+  def test_quantiles_include_extremes (self):
+    for k, uid in enumerate(self.lod.uids):
+      x = self.samples(uid)
+      q = self.lod.quantiles[16][k]
+      q = q[~np.isnan(q)]
+      self.assertEqual(len(q), min(16, len(x)))
+      self.assertEqual(q.min(), x.min())
+      self.assertEqual(q.max(), x.max())
+      if len(x) > 16:
+        np.testing.assert_allclose(q, np.quantile(x, np.linspace(0, 1, 16)))
+
+  def test_rows_and_level (self):
+    self.assertEqual(self.lod.level(10), 16)
+    self.assertEqual(self.lod.level(100), 16)
+    rows = self.lod.rows(3)
+    self.assertEqual(len(rows), 4 + 4 + 4)
+    self.assertEqual(sorted(set([r[0] for r in rows])), [1, 2, 3])
+
+  def test_histograms (self):
+    self.assertEqual(self.lod.histograms.sum(axis=1).tolist(),
+      [len(self.samples(u)) for u in self.lod.uids])
+    self.assertEqual(self.lod.edges[0], np.nanmin(self.values))
+    self.assertEqual(self.lod.edges[-1], np.nanmax(self.values))
+
+
+if __name__ == '__main__':
+  unittest.main()
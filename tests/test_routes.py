@@ -0,0 +1,78 @@
+import re
+import shutil
+import tempfile
+import unittest
+from bobaserver import app
+from bobaserver.bench.synthetic import generate
+from bobaserver.dataset import Dataset, DatasetRegistry
+
+
+class TestRoutes(unittest.TestCase):
+
+  @classmethod
+  def setUpClass (cls):
+    cls.folder = tempfile.mkdtemp()
+    generate(cls.folder, 40, n_decisions=3, n_points=20, n_draws=10)
+    cls.client = app.test_client()
+
+  @classmethod
+  def tearDownClass (cls):
+    shutil.rmtree(cls.folder)
+
+  def setUp (self):
+    app.dataset = Dataset(self.folder, use_bundle=False).load()
+    app.datasets = DatasetRegistry(0)
+
+  def post (self, url, body):
+    rsp = self.client.post(url, json=body)
+    self.assertEqual(rsp.status_code, 200, url)
+    return rsp.get_json()
+
+  def test_timing_counts_mounted_load (self):
+    # loading a mounted dataset happens within the total
+    app.datasets.add(Dataset(self.folder, 'm', use_bundle=False))
+    rsp = self.client.post('/d/m/api/get_pred', json={})
+    parts = dict(re.findall(r'(\w+);dur=([\d.]+)',
+      rsp.headers['Server-Timing']))
+    total = float(parts.pop('total'))
+    for k, v in parts.items():
+      self.assertLessEqual(float(v), total, k)
+
+  def test_query_validation (self):
+    self.assertEqual(self.post('/api/query', {})['status'], 'success')
+    for body in [{'filters': {'d0': 5}}, {'filters': {'d0': [[1]]}},
+      {'filters': []}, {'bins': 0}, {'bins': True}, {'bins': 10**6},
+      {'range': [1, 0]}, {'range': [0, 'a']}, {'filters': {'zz': ['a']}}]:
+      self.assertEqual(self.post('/api/query', body)['status'], 'fail', body)
+
+    rsp = self.client.post('/api/query', data='x', content_type='text/plain')
+    self.assertEqual(rsp.status_code, 200)
+    self.assertEqual(rsp.get_json()['status'], 'success')
+
+  def test_resolution (self):
+    res = self.post('/api/get_uncertainty', {'resolution': 16})
+    self.assertEqual(res['resolution'], 16)
+    for r in [True, False, 0, 2.5, 'a']:
+      res = self.post('/api/get_uncertainty', {'resolution': r})
+      self.assertEqual(res['status'], 'fail', r)
+
+  def test_raw_batch (self):
+    res = self.post('/api/get_raw_batch', {'uids': [1, '2', [1], None, True,
+      999]})
+    self.assertEqual(res['status'], 'success')
+    self.assertEqual([d is not None for d in res['data']],
+      [True, True, False, False, False, False])
+    self.assertEqual(sorted(res['errors'].keys()),
+      sorted(['[1]', 'None', 'True', '999']))
+
+  def test_sensitivity_validation (self):
+    res = self.post('/api/sensitivity', {'filters': {'d0': ['d0_opt0']}})
+    self.assertEqual(res['status'], 'success')
+    for body in [{'filters': {'d0': 5}}, {'filters': {'d0': [{}]}},
+      {'filters': 'd0'}, {'method': 'zz'}, {'filters': {'zz': ['a']}}]:
+      res = self.post('/api/sensitivity', body)
+      self.assertEqual(res['status'], 'fail', body)
+
+
+if __name__ == '__main__':
+  unittest.main()
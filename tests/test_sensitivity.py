@@ -0,0 +1,128 @@
+import unittest
+import numpy as np
+import pandas as pd
+from scipy import stats
+from bobaserver.bobastats import sensitivity
+from bobaserver.bobastats.accumulator import decision_codes
+
+
+def make_frame (sizes, seed=0, ties=False):
+  # one decision with an option per size, and an outcome shifted per option
+  rng = np.random.default_rng(seed)
+  options = [f'opt{i}' for i in range(len(sizes))]
+  dec = np.repeat(options, sizes)
+  y = rng.normal(0, 1, sum(sizes)) + np.repeat(np.arange(len(sizes)) * 0.3,
+    sizes)
+  if ties:
+    y = np.round(y, 1)
+  return pd.DataFrame({'uid': np.arange(1, len(y) + 1), 'dec': dec, 'y': y}), \
+    options
+
+
+def ks_reference (df, options):
+  # the median of ks_2samp over all pairs of options
+  groups = [df.loc[df['dec'] == o, 'y'].to_numpy() for o in options]
+  return np.median([stats.ks_2samp(groups[i], groups[j]).statistic
+    for i in range(len(groups)) for j in range(i + 1, len(groups))])
+
+
+class TestSensitivity(unittest.TestCase):
+
+  def test_ks_matches_scipy (self):
+    for sizes, ties in [([30, 30], False), ([5, 17, 40, 8], False),
+      ([50, 60, 70], True), ([1, 2, 3, 200], True)]:
+      df, options = make_frame(sizes, ties=ties)
+      self.assertAlmostEqual(sensitivity.sensitivity_ks(df, 'dec', options,
+        'y'), ks_reference(df, options), places=12)
+
+  def test_ks_large_groups (self):
+    # above KS_MAX_EXACT_N, ks_2samp no longer rounds the statistic
+    n = sensitivity.KS_MAX_EXACT_N + 1
+    df, options = make_frame([n, n - 7], ties=True)
+    self.assertAlmostEqual(sensitivity.sensitivity_ks(df, 'dec', options,
+      'y'), ks_reference(df, options), places=12)
+
+  def test_ks_groups (self):
+    df, options = make_frame([10, 20, 30], seed=1)
+    groups = [df.loc[df['dec'] == o, 'y'].to_numpy() for o in options]
+    self.assertAlmostEqual(sensitivity.ks_groups(groups),
+      ks_reference(df, options), places=12)
+
+  def test_f_matches_scipy (self):
+    for sizes in [[30, 30], [5, 17, 40, 8], [2, 3, 100]]:
+      df, options = make_frame(sizes, seed=2)
+      groups = [df.loc[df['dec'] == o, 'y'] for o in options]
+      self.assertAlmostEqual(sensitivity.sensitivity_f(df, 'dec', options,
+        'y'), stats.f_oneway(*groups).statistic, places=10)
+
+  def test_f_rows_without_option (self):
+    # rows of other options count in the grand mean and degrees of freedom
+    df, options = make_frame([10, 20, 30], seed=3)
+    sub = options[:2]
+    y = df['y']
+    groups = [df.loc[df['dec'] == o, 'y'] for o in sub]
+    ms_b = sum([len(g) * (g.mean() - y.mean())**2 for g in groups])
+    ms_b /= len(sub) - 1
+    ms_w = sum([((g - g.mean())**2).sum() for g in groups])
+    ms_w /= len(df) - len(sub)
+    self.assertAlmostEqual(sensitivity.sensitivity_f(df, 'dec', sub, 'y'),
+      ms_b / ms_w, places=10)
+
+  def test_single_option (self):
+    df, options = make_frame([10])
+    self.assertEqual(sensitivity.sensitivity_ks(df, 'dec', options, 'y'), 0)
+    self.assertEqual(sensitivity.sensitivity_f(df, 'dec', options, 'y'), 0)
+
+
+class TestSensitivityMatrix(unittest.TestCase):
+
+  def setUp (self):
+    # three decisions, one with a single option, and three outcomes with NaN
+    rng = np.random.default_rng(4)
+    n = 120
+    self.decisions = [{'var': 'a', 'options': ['a0', 'a1', 'a2']},
+      {'var': 'b', 'options': ['b0', 'b1']}, {'var': 'c', 'options': ['c0']}]
+    df = pd.DataFrame({d['var']: rng.choice(d['options'], n)
+      for d in self.decisions})
+    df['uid'] = np.arange(1, n + 1)
+    for j, col in enumerate(['y0', 'y1', 'y2']):
+      y = rng.normal(0, 1, n) + (df['a'] == 'a1') * j * 0.5
+      y[rng.random(n) < 0.1 * j] = np.nan
+      df[col] = np.round(y, 2)
+    self.df = df
+    self.outcomes = ['y0', 'y1', 'y2']
+
+  def per_field (self, method):
+    # the scores of the per-field calls, on the rows where the outcome is set
+    res = np.zeros((len(self.decisions), len(self.outcomes)))
+    for o, col in enumerate(self.outcomes):
+      df = self.df[~self.df[col].isna()]
+      for d, dec in enumerate(self.decisions):
+        args = (df, dec['var'], dec['options'], col)
+        if method == 'f':
+          res[d, o] = sensitivity.sensitivity_f(*args)
+        elif method == 'ks':
+          res[d, o] = sensitivity.sensitivity_ks(*args)
+        else:
+          res[d, o] = np.asarray(sensitivity.sensitivity_ad(*args)).flat[0]
+    return res
+
+  def matrix (self, method):
+    codes = decision_codes(self.df, self.decisions)
+    return sensitivity.sensitivity_matrix(self.df[self.outcomes].to_numpy(),
+      codes, [len(d['options']) for d in self.decisions], method)
+
+  def test_matches_per_field (self):
+    for method in ['f', 'ks', 'ad']:
+      np.testing.assert_allclose(self.matrix(method), self.per_field(method),
+        rtol=1e-10, atol=1e-12, err_msg=method)
+
+  def test_option_without_rows (self):
+    # F is undefined, so NaN, while KS and AD raise and give NaN
+    self.decisions[1]['options'].append('b2')
+    for method in ['f', 'ks', 'ad']:
+      self.assertTrue(np.isnan(self.matrix(method)[1]).all(), method)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+import numpy as np
+from bobaserver.bobastats.sketch import QuantileSketch
+
+QT = np.append(np.arange(0, 1, 1 / 100), 1.0)
+
+
+def rank_error (x, est):
+  # the largest distance in rank between each estimate and its quantile
+  x = np.sort(x)
+  ranks = np.searchsorted(x, est, side='right') / len(x)
+  return np.max(np.abs(ranks - QT))
+
+
+class TestQuantileSketch(unittest.TestCase):
+
+  def test_exact_when_small (self):
+    x = np.random.default_rng(7).normal(0, 1, 150)
+    s = QuantileSketch(k=200)
+    s.update(x[:50])
+    s.update(np.append(x[50:], np.nan))
+    self.assertEqual(s.count, 150)
+    np.testing.assert_allclose(s.quantile(QT), np.quantile(x, QT))
+
+  def test_rank_error (self):
+    x = np.random.default_rng(8).lognormal(0, 1, 200000)
+    s = QuantileSketch(k=200)
+    for chunk in np.array_split(x, 37):
+      s.update(chunk)
+    est = s.quantile(QT)
+    self.assertEqual(est[0], x.min())
+    self.assertEqual(est[-1], x.max())
+    self.assertLess(rank_error(x, est), 0.02)
+    self.assertLess(s.nbytes(), x.nbytes / 50)
+
+  def test_merge (self):
+    x = np.random.default_rng(9).normal(0, 1, 50000)
+    a, b = QuantileSketch(seed=1), QuantileSketch(seed=2)
+    a.update(x[:20000])
+    b.update(x[20000:])
+    a.merge(b)
+    self.assertEqual(a.count, len(x))
+    self.assertLess(rank_error(x, a.quantile(QT)), 0.02)
+
+  def test_empty (self):
+    self.assertTrue(np.isnan(QuantileSketch().quantile([0.5])).all())
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from bobaserver import app
+from bobaserver.bench.synthetic import generate
+from bobaserver.dataset import Dataset, DatasetRegistry, BUNDLE
+from bobaserver.pack import PACK, pack_files
+
+QUERIES = [
+  ('/api/get_universes', {}),
+  ('/api/get_pred', {}),
+  ('/api/get_raw', {'uid': 3}),
+  ('/api/get_raw_batch', {'uids': [1, 2, 40]}),
+  ('/api/sensitivity', {'filters': {'d0': ['d0_opt1']}, 'method': 'f'}),
+  ('/api/sensitivity', {'filters': {}, 'method': 'ks'}),
+  ('/api/get_uncertainty', {'resolution': 16}),
+]
+
+
+def assert_same (test, a, b, path=''):
+  # the same JSON, with numbers equal up to float rounding
+  if isinstance(a, dict):
+    test.assertEqual(sorted(a.keys()), sorted(b.keys()), path)
+    for k in a:
+      assert_same(test, a[k], b[k], f'{path}/{k}')
+  elif isinstance(a, list):
+    test.assertEqual(len(a), len(b), path)
+    for i, (x, y) in enumerate(zip(a, b)):
+      assert_same(test, x, y, f'{path}/{i}')
+  elif isinstance(a, float) or isinstance(b, float):
+    np.testing.assert_allclose(float(a), float(b), rtol=1e-9, err_msg=path)
+  else:
+    test.assertEqual(a, b, path)
+
+
+class TestStore(unittest.TestCase):
+  """ The bundle and the pack answer like the CSV files they are built from """
+
+  @classmethod
+  def setUpClass (cls):
+    cls.folder = tempfile.mkdtemp()
+    generate(cls.folder, 30, n_decisions=3, n_points=50, n_draws=20)
+    cls.client = app.test_client()
+
+  @classmethod
+  def tearDownClass (cls):
+    shutil.rmtree(cls.folder)
+
+  def serve (self, ds):
+    app.dataset = ds.load()
+    app.datasets = DatasetRegistry(0)
+    res = []
+    for url, body in QUERIES:
+      rsp = self.client.post(url, json=body)
+      self.assertEqual(rsp.status_code, 200, url)
+      res.append(rsp.get_json())
+    return res
+
+  def build (self):
+    ds = Dataset(self.folder, use_bundle=False).load()
+    ds.build_store(os.path.join(self.folder, BUNDLE))
+    pack_files(self.folder, [f['path'] for f in ds.files if f['multi']],
+      ds.summary['uid'].tolist(), os.path.join(self.folder, PACK),
+      sources=ds._sources(['summary.csv'] +
+        [f['path'] for f in ds.files if f['multi']]))
+
+  def test_bundle_and_pack (self):
+    expected = self.serve(Dataset(self.folder, use_bundle=False))
+    self.build()
+    ds = Dataset(self.folder)
+    actual = self.serve(ds)
+    self.assertIsNotNone(ds.store)
+    self.assertIsNotNone(ds.pack)
+    for (url, body), a, b in zip(QUERIES, expected, actual):
+      self.assertEqual(a['status'], 'success', url)
+      assert_same(self, a, b, url)
+
+    # cached replies are served again unchanged
+    assert_same(self, actual, self.serve(ds))
+
+  def test_stale_bundle (self):
+    self.build()
+    fn = os.path.join(self.folder, 'raw', 'pred_2.csv')
+    with open(fn, 'a') as f:
+      f.write('1,2\n')
+    st = os.stat(fn)
+    os.utime(fn, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    ds = Dataset(self.folder).load()
+    self.assertIsNone(ds.store)
+    self.assertIsNone(ds.pack)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+import numpy as np
+import pandas as pd
+from bobaserver.bobastats import sensitivity
+from bobaserver.subset import SubsetSensitivity
+
+
+class TestSubsetSensitivity(unittest.TestCase):
+
+  def setUp (self):
+    rng = np.random.default_rng(10)
+    n = 200
+    self.decisions = [{'var': 'a', 'options': ['x', 'y', 'z']},
+      {'var': 'b', 'options': ['u', 'v']}]
+    self.df = pd.DataFrame({'a': rng.choice(['x', 'y', 'z'], n),
+      'b': rng.choice(['u', 'v'], n)})
+    self.df['y'] = rng.normal(0, 1, n) + (self.df['a'] == 'y') * 1.0
+    self.subset = SubsetSensitivity(self.df, self.decisions, self.df['y'])
+
+  def expected (self, df, method):
+    # the per-field sensitivity on the filtered rows, with the options left
+    res = {}
+    for d in self.decisions:
+      opts = [o for o in d['options'] if (df[d['var']] == o).any()]
+      if method == 'f':
+        res[d['var']] = sensitivity.sensitivity_f(df, d['var'], opts, 'y')
+      else:
+        res[d['var']] = sensitivity.sensitivity_ks(df, d['var'], opts, 'y')
+    return res
+
+  def test_matches_per_field (self):
+    for filters in [{}, {'b': ['u']}, {'a': ['x', 'y'], 'b': []}]:
+      mask = np.ones(len(self.df), dtype=bool)
+      for dec, opts in filters.items():
+        if len(opts):
+          mask &= self.df[dec].isin(opts).to_numpy()
+      for method in ['f', 'ks']:
+        res = self.subset.compute(filters, method)
+        self.assertEqual(res['count'], int(mask.sum()))
+        for dec, s in self.expected(self.df[mask], method).items():
+          self.assertAlmostEqual(res['scores'][dec], s, places=10,
+            msg=f'{filters} {method} {dec}')
+
+  def test_fixed_decision_scores_zero (self):
+    res = self.subset.compute({'a': ['z']}, 'ks')
+    self.assertEqual(res['scores']['a'], 0)
+
+  def test_cache (self):
+    before = self.subset.nbytes()
+    a = self.subset.compute({'b': ['v', 'u']}, 'f')
+    self.assertIs(self.subset.compute({'b': ['u', 'v']}, 'f'), a)
+    self.assertGreater(self.subset.nbytes(), before)
+    small = SubsetSensitivity(self.df, self.decisions, self.df['y'],
+      capacity=2)
+    for f in [{'a': ['x']}, {'a': ['y']}, {'a': ['z']}]:
+      small.compute(f, 'f')
+    self.assertEqual(len(small.cache), 2)
+
+  def test_unknown_option (self):
+    with self.assertRaises(KeyError):
+      self.subset.compute({'a': ['w']}, 'f')
+    with self.assertRaises(KeyError):
+      self.subset.compute({'c': ['x']}, 'f')
+
+
+if __name__ == '__main__':
+  unittest.main()